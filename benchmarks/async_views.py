@@ -0,0 +1,125 @@
+"""
+Compare per-worker throughput of the sync (WSGI) and async (ASGI) diagram views.
+
+The sync path serves requests one after another, like a single WSGI worker
+thread; the async path keeps ``--concurrency`` requests in flight on one event
+loop. Each round issues the editor's hot calls: lock, load, autosave, links.
+Everything runs against a throwaway test database.
+
+    python benchmarks/async_views.py --requests 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'diagram_system.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import AsyncClient, Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import path  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+
+from diagrams.async_views import (  # noqa: E402
+    AsyncDiagramDetailApiView,
+    AsyncDiagramLinksView,
+    AsyncDiagramLockView,
+)
+from diagrams.models import Diagram, Project, ProjectMembership  # noqa: E402
+from diagrams.views import DiagramDetailApiView, DiagramLinksView, DiagramLockView  # noqa: E402
+
+
+def _urlconf(name, detail, lock, links):
+    module = types.ModuleType(name)
+    module.urlpatterns = [
+        path('api/diagrams/<int:diagram_id>', detail.as_view()),
+        path('api/diagrams/<int:diagram_id>/lock', lock.as_view()),
+        path('api/diagrams/<int:diagram_id>/links', links.as_view()),
+    ]
+    return module
+
+
+SYNC_URLS = _urlconf('sync_urls', DiagramDetailApiView, DiagramLockView, DiagramLinksView)
+ASYNC_URLS = _urlconf('async_urls', AsyncDiagramDetailApiView, AsyncDiagramLockView, AsyncDiagramLinksView)
+
+
+def _fixture():
+    user = User.objects.create_user('bench')
+    project = Project.objects.create(name='bench', user=user)
+    ProjectMembership.objects.create(project=project, user=user, role=ProjectMembership.ROLE_OWNER)
+    nodes = [{'id': f'n{i}', 'position': {'x': i * 10, 'y': 0}, 'data': {'label': f'Node {i}'}} for i in range(200)]
+    diagram = Diagram.objects.create(name='bench', project=project, data={'nodes': nodes, 'edges': []})
+    token = Token.objects.create(user=user)
+    return diagram, {'Authorization': f'Bearer {token.key}'}, {'nodes': nodes, 'edges': []}
+
+
+def _round(diagram_id, data):
+    base = f'/api/diagrams/{diagram_id}'
+    return [
+        ('post', f'{base}/lock', None),
+        ('get', base, None),
+        ('put', base, {'data': data}),
+        ('get', f'{base}/links', None),
+    ]
+
+
+def run_sync(total, diagram_id, headers, data):
+    client = Client()
+    calls = (_round(diagram_id, data) * (total // 4 + 1))[:total]
+    start = time.perf_counter()
+    for method, url, body in calls:
+        response = getattr(client, method)(url, body, content_type='application/json', headers=headers)
+        assert response.status_code == 200, response.content
+    return time.perf_counter() - start
+
+
+async def run_async(total, concurrency, diagram_id, headers, data):
+    client = AsyncClient()
+    calls = (_round(diagram_id, data) * (total // 4 + 1))[:total]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(method, url, body):
+        async with semaphore:
+            response = await getattr(client, method)(url, body, content_type='application/json', headers=headers)
+            assert response.status_code == 200, response.content
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call(*c) for c in calls))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        diagram, headers, data = _fixture()
+        # Metrics/profiling stay on as configured; throttling does not apply to these views.
+        with override_settings(ROOT_URLCONF=SYNC_URLS):
+            sync_elapsed = run_sync(args.requests, diagram.id, headers, data)
+        with override_settings(ROOT_URLCONF=ASYNC_URLS):
+            async_elapsed = asyncio.run(run_async(args.requests, args.concurrency, diagram.id, headers, data))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f'{"path":<28}{"seconds":>10}{"req/s":>10}')
+    print(f'{"sync (WSGI, 1 thread)":<28}{sync_elapsed:>10.3f}{args.requests / sync_elapsed:>10.1f}')
+    label = f'async (ASGI, {args.concurrency} in flight)'
+    print(f'{label:<28}{async_elapsed:>10.3f}{args.requests / async_elapsed:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare URL resolution through RouteTree with the flat list of patterns it replaced.
+
+The flat URLconf lists the same patterns as plain ``path()`` entries, /api/
+ones first and the legacy aliases after them, the way diagram_system/urls.py
+used to. Each round resolves the paths the editor and dashboard hit most.
+
+    python benchmarks/url_resolution.py --rounds 20000
+"""
+import argparse
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'diagram_system.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.urls import URLResolver  # noqa: E402
+from django.urls.resolvers import RegexPattern  # noqa: E402
+
+from diagram_system import urls  # noqa: E402
+
+
+PATHS = [
+    '/api/diagrams/7',
+    '/api/diagrams/7/lock',
+    '/api/diagrams/7/links',
+    '/api/projects/',
+    '/api/projects/3/links',
+    '/api/templates/',
+    '/diagrams/7',
+    '/diagrams/7/save-as-template',
+]
+
+
+def _flat_urlconf():
+    variants = [e.variants for e in urls.api_endpoints]
+    module = types.ModuleType('flat_urls')
+    module.urlpatterns = [
+        *urls.urlpatterns[:-1],
+        *(pattern for v in variants for key, pattern in v.items() if not key[0]),
+        *(pattern for v in variants for key, pattern in v.items() if key[0]),
+    ]
+    return module
+
+
+def _time(resolver, rounds: int) -> float:
+    for p in PATHS:
+        resolver.resolve(p)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for p in PATHS:
+            resolver.resolve(p)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    flat = URLResolver(RegexPattern(r'^/'), _flat_urlconf())
+    tree = URLResolver(RegexPattern(r'^/'), urls)
+    calls = args.rounds * len(PATHS)
+
+    print(f'{"urlconf":<28}{"seconds":>10}{"us/resolve":>12}')
+    for label, resolver in (('flat list', flat), ('route tree', tree)):
+        elapsed = _time(resolver, args.rounds)
+        print(f'{label:<28}{elapsed:>10.3f}{elapsed / calls * 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Routing for the API endpoints.
+
+Every endpoint is served under ``/api/...`` and, for older clients, under the
+same path without the prefix, many of them with and without a trailing
+slash. Written out as ``path()`` entries that is close to a hundred regexes
+Django tries one after another, so the autosave URL pays for every pattern
+above it.
+
+``endpoint()`` declares an endpoint once and expands it into the named
+patterns ``reverse()`` needs (``<name>``, ``legacy_<name>`` and the
+``alt_name`` of the other slash variant). ``RouteTree`` resolves a path by
+stripping the ``api/`` prefix and the trailing slash once and walking a tree
+of path segments; the pattern of the matching variant then builds the
+``ResolverMatch``, so URL names, converters and view kwargs are unchanged.
+Both slash variants of an endpoint resolve.
+"""
+import re
+
+from django.urls import Resolver404, URLResolver, path
+from django.urls.converters import get_converters
+from django.urls.resolvers import RoutePattern
+
+
+API_PREFIX = 'api/'
+
+_PARAMETER = re.compile(r'^<(?:(?P<converter>[^>:]+):)?(?P<name>[^>]+)>$')
+
+
+class Endpoint:
+    def __init__(self, route: str, view, name: str, slash: bool, alt_name):
+        self.route = route
+        # (legacy, trailing slash) -> URLPattern
+        self.variants = {}
+        for legacy in (False, True):
+            prefix = '' if legacy else API_PREFIX
+            names = {slash: name, not slash: alt_name}
+            for has_slash, variant_name in names.items():
+                if variant_name is None:
+                    continue
+                self.variants[legacy, has_slash] = path(
+                    prefix + route + ('/' if has_slash else ''),
+                    view,
+                    name=f'legacy_{variant_name}' if legacy else variant_name,
+                )
+
+    def match(self, legacy: bool, slash: bool):
+        return self.variants.get((legacy, slash)) or self.variants.get((legacy, not slash))
+
+
+def endpoint(route: str, view, name: str, *, slash: bool = False, alt_name=None) -> Endpoint:
+    """
+    ``route`` is given without the ``api/`` prefix and trailing slash;
+    ``slash`` tells whether ``name`` is the variant with the slash.
+    """
+    return Endpoint(route, view, name, slash, alt_name)
+
+
+class _Node:
+    __slots__ = ('literals', 'parameters', 'endpoint')
+
+    def __init__(self):
+        self.literals = {}
+        # [(compiled converter regex, node)]
+        self.parameters = []
+        self.endpoint = None
+
+
+class RouteTree(URLResolver):
+    """Resolver for a list of endpoints, used as an entry of ``urlpatterns``."""
+
+    def __init__(self, endpoints):
+        patterns = [pattern for e in endpoints for pattern in e.variants.values()]
+        super().__init__(RoutePattern(''), patterns)
+        self._root = _Node()
+        for e in endpoints:
+            self._insert(e)
+
+    def _insert(self, e: Endpoint) -> None:
+        node = self._root
+        for segment in e.route.split('/'):
+            parameter = _PARAMETER.match(segment)
+            if parameter is None:
+                node = node.literals.setdefault(segment, _Node())
+                continue
+            regex = re.compile(get_converters()[parameter['converter'] or 'str'].regex)
+            for existing, child in node.parameters:
+                if existing.pattern == regex.pattern:
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.parameters.append((regex, child))
+                node = child
+        if node.endpoint is not None:
+            raise ValueError(f'Duplicate route: {e.route}')
+        node.endpoint = e
+
+    def _lookup(self, node: _Node, segments, index: int):
+        if index == len(segments):
+            return node.endpoint
+        segment = segments[index]
+        child = node.literals.get(segment)
+        if child is not None:
+            found = self._lookup(child, segments, index + 1)
+            if found is not None:
+                return found
+        for regex, child in node.parameters:
+            if regex.fullmatch(segment):
+                found = self._lookup(child, segments, index + 1)
+                if found is not None:
+                    return found
+        return None
+
+    def resolve(self, path):
+        path = str(path)
+        legacy = not path.startswith(API_PREFIX)
+        route = path if legacy else path[len(API_PREFIX):]
+        slash = route.endswith('/')
+        if slash:
+            route = route[:-1]
+
+        found = self._lookup(self._root, route.split('/'), 0) if route else None
+        pattern = found.match(legacy, slash) if found is not None else None
+        if pattern is not None:
+            # The variant's own path, so its pattern matches and names the result
+            variant_path = ('' if legacy else API_PREFIX) + route + ('/' if str(pattern.pattern).endswith('/') else '')
+            match = pattern.resolve(variant_path)
+            if match:
+                return match
+        raise Resolver404({'tried': [[p] for p in self.url_patterns], 'path': path})
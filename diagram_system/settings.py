@@ -43,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'diagrams.metrics.MetricsMiddleware',
+    'diagrams.profiling.RequestProfilingMiddleware',
+    'diagrams.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +75,12 @@ TEMPLATES = [
 WSGI_APPLICATION = 'diagram_system.wsgi.application'
 
 
+# Serve the diagram detail, lock and links endpoints with the async views in
+# diagrams.async_views. Only worth enabling when running under ASGI.
+
+DIAGRAMS_ASYNC_VIEWS = False
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -83,6 +92,19 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# LocMemCache is per process; use a shared backend (FileBasedCache, Redis)
+# when running several workers so response cache invalidation reaches all.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'idms',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -131,5 +153,221 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # JSON bodies go through diagrams.uploads (gzip, size limits, single parse)
+    'DEFAULT_PARSER_CLASSES': [
+        'diagrams.uploads.DiagramJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Reverse proxies in front of the app whose X-Forwarded-For entries are
+    # trusted as client IPs by the throttles; 0 uses REMOTE_ADDR. Left unset,
+    # DRF trusts the header as sent, so clients could pick their own bucket.
+    'NUM_PROXIES': 0,
+    # Token bucket sizes for diagrams.throttling (refilled at the same rate)
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': '20/min',
+        'auth_username': '10/min',
+        'guest_ip': '5/min',
+        'invite_accept': '30/min',
+    },
+}
+
+# Signed access tokens (diagrams.access_tokens), usually verified from the cache.
+# ISSUE makes login endpoints hand them out by default; clients can also ask
+# for one with `token_format: "signed"`. DRF tokens keep working either way.
+
+DIAGRAMS_SIGNED_TOKENS = {
+    'ISSUE': False,
+    'LIFETIME': 3600,
+    'REFRESH_GRACE': 7 * 24 * 3600,
+    'CACHE_ALIAS': 'default',
+    # Seconds a revocation or deactivation may take to reach other workers
+    'CACHE_TTL': 30,
+}
+
+# Admission control for expensive anonymous/auth endpoints (per process).
+# They are answered with 503 once EXPENSIVE_CONCURRENCY requests are running
+# or while SHED_ABOVE_EDITOR_WRITES autosave/lock requests are in flight.
+
+DIAGRAMS_ADMISSION = {
+    'EXPENSIVE_CONCURRENCY': 4,
+    'SHED_ABOVE_EDITOR_WRITES': 8,
+    'RETRY_AFTER': 1,
+}
+
+
+# Per-request profiling (Server-Timing header + structured log line).
+# Disabled by default; the middleware removes itself unless ENABLED is set.
+
+DIAGRAMS_PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'SLOW_REQUEST_MS': 500,
+    'MAX_LOGGED_QUERIES': 50,
+}
+
+# In-process metrics exposed at /metrics in Prometheus text format.
+# Set MULTIPROCESS_DIR to a directory shared by all workers (emptied on start)
+# to aggregate metrics across processes.
+
+DIAGRAMS_METRICS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+# Versioned response cache for read-heavy endpoints (see diagrams.response_cache).
+
+DIAGRAMS_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Spatial index for viewport loading of large diagrams (see diagrams.spatial).
+# Diagrams with at least MIN_NODES nodes are indexed on save; run
+# `manage.py reindex_diagrams` after changing it.
+
+DIAGRAMS_SPATIAL_INDEX = {
+    'ENABLED': True,
+    'MIN_NODES': 2000,
+    'MAX_VIEWPORT_NODES': 2000,
+    'DEFAULT_TILE_SIZE': 1000,
+}
+
+# What happens to element links when a save removes their element
+# (see diagrams.link_reconciliation): 'flag', 'delete' or 'keep'.
+
+DIAGRAMS_LINK_RECONCILIATION = {
+    'ON_REMOVED': 'flag',
+    'RELABEL': True,
+}
+
+# Server-side automatic layout (see diagrams.layout).
+
+DIAGRAMS_LAYOUT = {
+    'MAX_NODES': 20000,
+    'NODE_GAP': 40,
+    'LAYER_GAP': 120,
+    'ORDERING_SWEEPS': 4,
+    'FORCE_ITERATIONS': 50,
+    'FORCE_WORK_BUDGET': 250000,
+}
+
+# Project/diagram deletes only mark the rows and return 202; the rows are
+# purged CHUNK_SIZE at a time by a thread of the accepting process, or by the
+# job worker when RUN_IN_PROCESS is off (see diagrams.deletion).
+
+DIAGRAMS_DELETION = {
+    'CHUNK_SIZE': 500,
+    'RUN_IN_PROCESS': True,
+    'STALE_AFTER': 300,
+}
+
+# Background jobs (see diagrams.jobs), run by `manage.py run_jobs`, which has
+# to run next to the application servers: thumbnails are only rendered there,
+# and deferred deletion runs there when DIAGRAMS_DELETION['RUN_IN_PROCESS'] is
+# off. A guest login runs the guest cleanup itself once the queued cleanup has
+# waited UNCLAIMED_AFTER seconds. With EAGER jobs run in the process that
+# queues them, after the transaction commits (no worker needed).
+
+DIAGRAMS_JOBS = {
+    'EAGER': False,
+    'POLL_INTERVAL': 1.0,
+    'VISIBILITY_TIMEOUT': 600,
+    'BACKOFF_BASE': 5,
+    'BACKOFF_MAX': 3600,
+    'MAX_ATTEMPTS': 5,
+    'KEEP_FINISHED': 7 * 24 * 3600,
+    'UNCLAIMED_AFTER': 300,
+}
+
+# Project activity feed (see diagrams.activity). Entries are buffered per
+# process and written in batches once FLUSH_SIZE are pending or FLUSH_INTERVAL
+# seconds have passed; autosaves within COLLAPSE_WINDOW seconds share an entry.
+
+DIAGRAMS_ACTIVITY = {
+    'ENABLED': True,
+    'FLUSH_SIZE': 200,
+    'FLUSH_INTERVAL': 5,
+    'COLLAPSE_WINDOW': 300,
+    'PAGE_SIZE': 50,
 }
 
+# Limits on request bodies and diagram documents (see diagrams.uploads);
+# violations are answered with 413. The editor may gzip request bodies.
+
+DIAGRAMS_UPLOADS = {
+    'MAX_BODY_BYTES': 20 * 1024 * 1024,
+    'MAX_NODES': 50000,
+    'MAX_EDGES': 100000,
+    'MAX_DEPTH': 32,
+    'ACCEPT_GZIP': True,
+}
+
+# Compression of JSON responses (see diagrams.compression). Levels drop as
+# bodies grow; compressed diagram bodies are cached per ETag. brotli is used
+# for clients that accept it when the module is installed.
+
+DIAGRAMS_COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+    'GZIP_LEVELS': [(64 * 1024, 6), (1024 * 1024, 4), (None, 1)],
+    'BROTLI_LEVELS': [(64 * 1024, 5), (1024 * 1024, 4), (None, 1)],
+    'BROTLI': True,
+    'CACHE_ALIAS': 'default',
+    'CACHE_MIN_SIZE': 16 * 1024,
+    'CACHE_TIMEOUT': 600,
+}
+
+# Opt-in coalescing of autosaves (see diagrams.coalescing): data-only updates
+# are journaled and acknowledged, and the latest document of each diagram is
+# written every FLUSH_INTERVAL seconds or when its lock is released. Only for
+# a single application process.
+
+DIAGRAMS_WRITE_COALESCING = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL': 2.0,
+    'JOURNAL_DIR': BASE_DIR / 'var' / 'write-journal',
+    'FSYNC': True,
+}
+
+# Presence of users on diagrams (see diagrams.presence). 'memory' keeps it in
+# the process; 'cache' keeps it in the cache ALIAS, which has to be shared by
+# the workers (e.g. Redis) when there are several. Clients send a heartbeat
+# every TTL/3 seconds.
+
+DIAGRAMS_PRESENCE = {
+    'BACKEND': 'memory',
+    'ALIAS': 'default',
+    'TTL': 30,
+}
+
+# Server-rendered thumbnails (see diagrams.thumbnails). FORMATS are rendered
+# DELAY seconds after a save, so a burst of autosaves renders once; other
+# formats ('svg', 'png') are rendered on their first request.
+
+DIAGRAMS_THUMBNAILS = {
+    'ENABLED': True,
+    'WIDTH': 320,
+    'HEIGHT': 200,
+    'FORMATS': ['svg'],
+    'DELAY': 30,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'diagrams': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
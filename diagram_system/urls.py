@@ -14,19 +14,30 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 
+from diagram_system.routing import RouteTree, endpoint
 from diagrams.views import (
     AcceptInviteView,
     CurrentUserView,
     DiagramApiView,
+    DeletionTaskView,
     DiagramDetailApiView,
+    DiagramDiffView,
+    DiagramLinkBulkView,
     DiagramLinkDetailView,
+    DiagramLayoutView,
     DiagramLinksView,
     DiagramLockView,
+    DiagramOpenView,
+    DiagramOverviewView,
+    DiagramPatchView,
+    DiagramPresenceView,
     DiagramTemplateDetailView,
     DiagramTemplateListView,
+    DiagramViewportView,
     ElementLinksView,
     guest_login,
     InviteInfoView,
@@ -37,95 +48,86 @@ from diagrams.views import (
     ProjectInviteCreateView,
     ProjectInviteDetailView,
     ProjectInviteListView,
+    ProjectActivityView,
+    ProjectPresenceView,
     ProjectLinksView,
+    refresh_token,
     register_user,
+    revoke_token,
     SaveDiagramAsTemplateView,
 )
+from diagrams.batch import batch_view
+from diagrams.metrics import metrics_view
+from diagrams.thumbnails import thumbnail_view
 
+if settings.DIAGRAMS_ASYNC_VIEWS:
+    from diagrams.async_views import (
+        AsyncDiagramDetailApiView as DiagramDetailApiView,
+        AsyncDiagramLinksView as DiagramLinksView,
+        AsyncDiagramLockView as DiagramLockView,
+    )
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
 
-    # Auth
-    path('api/auth/register', register_user, name='register'),
-    path('api/auth/token', obtain_token, name='token'),
-    path('api/auth/guest', guest_login, name='guest_login'),
-    path('api/auth/me', CurrentUserView.as_view(), name='current_user'),
+# Each endpoint is served under /api/ and, as a legacy alias, without the
+# prefix (``legacy_<name>``); see diagram_system.routing.
+api_endpoints = [
+    # Batch (several API calls in one round trip)
+    endpoint('batch', batch_view, 'batch'),
 
-    # Legacy aliases (no /api prefix) for backward compatibility
-    path('auth/register', register_user, name='legacy_register'),
-    path('auth/token', obtain_token, name='legacy_token'),
-    path('auth/guest', guest_login, name='legacy_guest_login'),
-    path('auth/me', CurrentUserView.as_view(), name='legacy_current_user'),
+    # Auth
+    endpoint('auth/register', register_user, 'register'),
+    endpoint('auth/token', obtain_token, 'token'),
+    endpoint('auth/guest', guest_login, 'guest_login'),
+    endpoint('auth/token/refresh', refresh_token, 'token_refresh'),
+    endpoint('auth/token/revoke', revoke_token, 'token_revoke'),
+    endpoint('auth/me', CurrentUserView.as_view(), 'current_user'),
 
     # Projects
-    path('api/projects/', ProjectApiView.as_view(), name='projects'),
-    path('api/projects/<int:project_id>/', ProjectDetailApiView.as_view(), name='project_detail'),
-    path('api/projects/<int:project_id>', ProjectDetailApiView.as_view(), name='project_detail_no_slash'),
-
-    # Legacy project aliases
-    path('projects/', ProjectApiView.as_view(), name='legacy_projects'),
-    path('projects/<int:project_id>/', ProjectDetailApiView.as_view(), name='legacy_project_detail'),
-    path('projects/<int:project_id>', ProjectDetailApiView.as_view(), name='legacy_project_detail_no_slash'),
+    endpoint('projects', ProjectApiView.as_view(), 'projects', slash=True),
+    endpoint('projects/<int:project_id>', ProjectDetailApiView.as_view(), 'project_detail', slash=True, alt_name='project_detail_no_slash'),
 
     # Diagrams
-    path('api/projects/<int:project_id>/diagrams/', DiagramApiView.as_view(), name='diagrams'),
-    path('api/diagrams/<int:diagram_id>/', DiagramDetailApiView.as_view(), name='diagram_detail'),
-    path('api/diagrams/<int:diagram_id>', DiagramDetailApiView.as_view(), name='diagram_detail_no_slash'),
-    path('api/diagrams/<int:diagram_id>/lock', DiagramLockView.as_view(), name='diagram_lock'),
-
-    # Legacy diagram aliases
-    path('projects/<int:project_id>/diagrams/', DiagramApiView.as_view(), name='legacy_diagrams'),
-    path('diagrams/<int:diagram_id>/', DiagramDetailApiView.as_view(), name='legacy_diagram_detail'),
-    path('diagrams/<int:diagram_id>', DiagramDetailApiView.as_view(), name='legacy_diagram_detail_no_slash'),
-    path('diagrams/<int:diagram_id>/lock', DiagramLockView.as_view(), name='legacy_diagram_lock'),
+    endpoint('projects/<int:project_id>/diagrams', DiagramApiView.as_view(), 'diagrams', slash=True),
+    endpoint('diagrams/<int:diagram_id>', DiagramDetailApiView.as_view(), 'diagram_detail', slash=True, alt_name='diagram_detail_no_slash'),
+    endpoint('diagrams/<int:diagram_id>/lock', DiagramLockView.as_view(), 'diagram_lock'),
+    endpoint('deletions/<int:task_id>', DeletionTaskView.as_view(), 'deletion_task'),
+    endpoint('diagrams/<int:diagram_id>/open', DiagramOpenView.as_view(), 'diagram_open'),
+    endpoint('diagrams/<int:diagram_id>/viewport', DiagramViewportView.as_view(), 'diagram_viewport'),
+    endpoint('diagrams/<int:diagram_id>/overview', DiagramOverviewView.as_view(), 'diagram_overview'),
+    endpoint('diagrams/<int:diagram_id>/layout', DiagramLayoutView.as_view(), 'diagram_layout'),
+    endpoint('diagrams/<int:diagram_id>/diff', DiagramDiffView.as_view(), 'diagram_diff'),
+    endpoint('diagrams/<int:diagram_id>/patch', DiagramPatchView.as_view(), 'diagram_patch'),
+    endpoint('diagrams/<int:diagram_id>/presence', DiagramPresenceView.as_view(), 'diagram_presence'),
 
     # Invites
-    path('api/projects/<int:project_id>/invite', ProjectInviteCreateView.as_view(), name='project_invite_create'),
-    path('api/projects/<int:project_id>/invites', ProjectInviteListView.as_view(), name='project_invite_list'),
-    path('api/projects/<int:project_id>/invites/<int:invite_id>', ProjectInviteDetailView.as_view(), name='project_invite_delete'),
-    path('api/invite/<str:token>', InviteInfoView.as_view(), name='invite_info'),
-    path('api/invite/<str:token>/accept', AcceptInviteView.as_view(), name='invite_accept'),
-
-    # Legacy invite aliases
-    path('projects/<int:project_id>/invite', ProjectInviteCreateView.as_view(), name='legacy_project_invite_create'),
-    path('projects/<int:project_id>/invites', ProjectInviteListView.as_view(), name='legacy_project_invite_list'),
-    path('projects/<int:project_id>/invites/<int:invite_id>', ProjectInviteDetailView.as_view(), name='legacy_project_invite_delete'),
-    path('invite/<str:token>', InviteInfoView.as_view(), name='legacy_invite_info'),
-    path('invite/<str:token>/accept', AcceptInviteView.as_view(), name='legacy_invite_accept'),
+    endpoint('projects/<int:project_id>/invite', ProjectInviteCreateView.as_view(), 'project_invite_create'),
+    endpoint('projects/<int:project_id>/invites', ProjectInviteListView.as_view(), 'project_invite_list'),
+    endpoint('projects/<int:project_id>/invites/<int:invite_id>', ProjectInviteDetailView.as_view(), 'project_invite_delete'),
+    endpoint('invite/<str:token>', InviteInfoView.as_view(), 'invite_info'),
+    endpoint('invite/<str:token>/accept', AcceptInviteView.as_view(), 'invite_accept'),
 
     # Diagram Links
-    path('api/diagrams/<int:diagram_id>/links', DiagramLinksView.as_view(), name='diagram_links'),
-    path('api/diagrams/<int:diagram_id>/links/', DiagramLinksView.as_view(), name='diagram_links_slash'),
-    path('api/diagrams/<int:diagram_id>/elements/<str:element_id>/links', ElementLinksView.as_view(), name='element_links'),
-    path('api/links/<int:link_id>', DiagramLinkDetailView.as_view(), name='link_detail'),
-    path('api/links/<int:link_id>/', DiagramLinkDetailView.as_view(), name='link_detail_slash'),
-    path('api/diagrams-for-linking', ProjectDiagramsForLinkingView.as_view(), name='diagrams_for_linking'),
-    path('api/diagrams-for-linking/', ProjectDiagramsForLinkingView.as_view(), name='diagrams_for_linking_slash'),
-    path('api/projects/<int:project_id>/links', ProjectLinksView.as_view(), name='project_links'),
-    path('api/projects/<int:project_id>/links/', ProjectLinksView.as_view(), name='project_links_slash'),
-
-    # Legacy diagram link aliases  
-    path('diagrams/<int:diagram_id>/links', DiagramLinksView.as_view(), name='legacy_diagram_links'),
-    path('diagrams/<int:diagram_id>/links/', DiagramLinksView.as_view(), name='legacy_diagram_links_slash'),
-    path('diagrams/<int:diagram_id>/elements/<str:element_id>/links', ElementLinksView.as_view(), name='legacy_element_links'),
-    path('links/<int:link_id>', DiagramLinkDetailView.as_view(), name='legacy_link_detail'),
-    path('diagrams-for-linking', ProjectDiagramsForLinkingView.as_view(), name='legacy_diagrams_for_linking'),
-    path('projects/<int:project_id>/links', ProjectLinksView.as_view(), name='legacy_project_links'),
-    path('projects/<int:project_id>/links/', ProjectLinksView.as_view(), name='legacy_project_links_slash'),
+    endpoint('diagrams/<int:diagram_id>/links', DiagramLinksView.as_view(), 'diagram_links', alt_name='diagram_links_slash'),
+    endpoint('diagrams/<int:diagram_id>/elements/<str:element_id>/links', ElementLinksView.as_view(), 'element_links'),
+    endpoint('links/bulk', DiagramLinkBulkView.as_view(), 'link_bulk'),
+    endpoint('links/<int:link_id>', DiagramLinkDetailView.as_view(), 'link_detail', alt_name='link_detail_slash'),
+    endpoint('diagrams-for-linking', ProjectDiagramsForLinkingView.as_view(), 'diagrams_for_linking', alt_name='diagrams_for_linking_slash'),
+    endpoint('projects/<int:project_id>/activity', ProjectActivityView.as_view(), 'project_activity'),
+    endpoint('projects/<int:project_id>/presence', ProjectPresenceView.as_view(), 'project_presence'),
+    endpoint('projects/<int:project_id>/links', ProjectLinksView.as_view(), 'project_links', alt_name='project_links_slash'),
 
     # Diagram Templates
-    path('api/templates/', DiagramTemplateListView.as_view(), name='templates_list'),
-    path('api/templates', DiagramTemplateListView.as_view(), name='templates_list_no_slash'),
-    path('api/templates/<int:template_id>/', DiagramTemplateDetailView.as_view(), name='template_detail'),
-    path('api/templates/<int:template_id>', DiagramTemplateDetailView.as_view(), name='template_detail_no_slash'),
-    path('api/diagrams/<int:diagram_id>/save-as-template', SaveDiagramAsTemplateView.as_view(), name='save_as_template'),
-    path('api/diagrams/<int:diagram_id>/save-as-template/', SaveDiagramAsTemplateView.as_view(), name='save_as_template_slash'),
+    endpoint('templates', DiagramTemplateListView.as_view(), 'templates_list', slash=True, alt_name='templates_list_no_slash'),
+    endpoint('templates/<int:template_id>', DiagramTemplateDetailView.as_view(), 'template_detail', slash=True, alt_name='template_detail_no_slash'),
+    endpoint('diagrams/<int:diagram_id>/save-as-template', SaveDiagramAsTemplateView.as_view(), 'save_as_template', alt_name='save_as_template_slash'),
+
+    # Thumbnails, public: the content hash in the file name stands in for authentication
+    endpoint('thumbnails/<str:kind>/<int:object_id>/<str:filename>', thumbnail_view, 'thumbnail'),
+]
 
-    # Legacy template aliases
-    path('templates/', DiagramTemplateListView.as_view(), name='legacy_templates_list'),
-    path('templates', DiagramTemplateListView.as_view(), name='legacy_templates_list_no_slash'),
-    path('templates/<int:template_id>/', DiagramTemplateDetailView.as_view(), name='legacy_template_detail'),
-    path('templates/<int:template_id>', DiagramTemplateDetailView.as_view(), name='legacy_template_detail_no_slash'),
-    path('diagrams/<int:diagram_id>/save-as-template', SaveDiagramAsTemplateView.as_view(), name='legacy_save_as_template'),
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    RouteTree(api_endpoints),
 ]
@@ -0,0 +1,166 @@
+"""
+Stateless signed access tokens.
+
+A signed token carries the user id, its expiry, the user's revocation
+generation and a random token id, signed with HMAC-SHA256 through
+``django.core.signing``. Revocations are kept in the database: the
+generation in ``TokenGeneration`` and revoked token ids in ``RevokedToken``,
+until the token could no longer be refreshed. Verifying a token usually
+needs no database access: the current generation, the token's revocation
+state and the user object are read from the cache in a single ``get_many``
+and only loaded from the database on a miss. They are cached for
+``CACHE_TTL`` seconds, so a revocation or deactivation on one worker reaches
+the others within that time; refreshing a token reads them fresh.
+Signed tokens contain ``:`` separators, which tell them apart from DRF's
+hex ``Token`` keys; those keep working unchanged.
+"""
+from datetime import datetime, timezone
+import secrets
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from rest_framework import exceptions
+
+from .models import RevokedToken, TokenGeneration
+
+
+SIGNED_TOKEN_DEFAULTS = {
+    'ISSUE': False,
+    'LIFETIME': 3600,
+    'REFRESH_GRACE': 7 * 24 * 3600,
+    'CACHE_ALIAS': 'default',
+    'CACHE_TTL': 30,
+}
+
+SALT = 'diagrams.access_tokens'
+
+
+def get_signed_token_settings() -> dict:
+    return {**SIGNED_TOKEN_DEFAULTS, **getattr(settings, 'DIAGRAMS_SIGNED_TOKENS', {})}
+
+
+def _cache():
+    return caches[get_signed_token_settings()['CACHE_ALIAS']]
+
+
+def _generation_key(user_id) -> str:
+    return f'diagrams:tokgen:{user_id}'
+
+
+def _revoked_key(token_id) -> str:
+    return f'diagrams:tokrev:{token_id}'
+
+
+def _user_key(user_id) -> str:
+    return f'diagrams:tokuser:{user_id}'
+
+
+def is_signed_token(token: str) -> bool:
+    return ':' in token
+
+
+def _load_generation(user_id) -> int:
+    generation = (
+        TokenGeneration.objects.filter(user_id=user_id).values_list('generation', flat=True).first() or 0
+    )
+    _cache().set(_generation_key(user_id), generation, timeout=get_signed_token_settings()['CACHE_TTL'])
+    return generation
+
+
+def _load_revoked(token_id) -> bool:
+    revoked = RevokedToken.objects.filter(jti=token_id).exists()
+    _cache().set(_revoked_key(token_id), revoked, timeout=get_signed_token_settings()['CACHE_TTL'])
+    return revoked
+
+
+def _load_user(user_id):
+    user = User.objects.filter(id=user_id).first()
+    if user is not None:
+        _cache().set(_user_key(user_id), user, timeout=get_signed_token_settings()['CACHE_TTL'])
+    return user
+
+
+def issue(user) -> dict:
+    """Return a new signed access token for `user` and its expiry (unix time)."""
+    cached = _cache().get(_generation_key(user.id))
+    generation = cached if cached is not None else _load_generation(user.id)
+    expires_at = int(time.time()) + get_signed_token_settings()['LIFETIME']
+    payload = {'uid': user.id, 'exp': expires_at, 'gen': generation, 'jti': secrets.token_urlsafe(9)}
+    return {'token': signing.dumps(payload, salt=SALT), 'expires_at': expires_at}
+
+
+def verify(token: str, leeway: int = 0, fresh: bool = False):
+    """
+    Return ``(user, payload)`` for a valid token or raise AuthenticationFailed.
+    `leeway` accepts tokens that expired at most that many seconds ago;
+    `fresh` reads the revocation state and the user from the database.
+    """
+    try:
+        payload = signing.loads(token, salt=SALT)
+        user_id, expires_at, generation, token_id = (
+            payload['uid'], payload['exp'], payload['gen'], payload['jti']
+        )
+    except (signing.BadSignature, KeyError, TypeError):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+
+    if expires_at + leeway < time.time():
+        raise exceptions.AuthenticationFailed('Token has expired.')
+
+    found = {} if fresh else _cache().get_many(
+        [_generation_key(user_id), _revoked_key(token_id), _user_key(user_id)]
+    )
+
+    current_generation = found.get(_generation_key(user_id))
+    if current_generation is None:
+        current_generation = _load_generation(user_id)
+    revoked = found.get(_revoked_key(token_id))
+    if revoked is None:
+        revoked = _load_revoked(token_id)
+    if generation != current_generation or revoked:
+        raise exceptions.AuthenticationFailed('Token has been revoked.')
+
+    user = found.get(_user_key(user_id)) or _load_user(user_id)
+    if user is None or not user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return user, payload
+
+
+def revoke(payload: dict) -> bool:
+    """
+    Record one token as revoked until it could no longer be refreshed anyway.
+    Returns False if it already was, so a token is exchanged at most once.
+    """
+    now = time.time()
+    expires_at = payload['exp'] + get_signed_token_settings()['REFRESH_GRACE']
+    if expires_at <= now:
+        return True
+    # Records of tokens past their refresh grace are no longer needed
+    RevokedToken.objects.filter(expires_at__lt=datetime.fromtimestamp(now, timezone.utc)).delete()
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(
+                jti=payload['jti'],
+                user_id=payload['uid'],
+                expires_at=datetime.fromtimestamp(expires_at, timezone.utc),
+            )
+    except IntegrityError:
+        return False
+    _cache().set(_revoked_key(payload['jti']), True, timeout=get_signed_token_settings()['CACHE_TTL'])
+    return True
+
+
+def revoke_all(user) -> None:
+    """Invalidate every signed token of `user` by bumping the revocation generation."""
+    state, _ = TokenGeneration.objects.get_or_create(user=user)
+    state.generation += 1
+    state.save(update_fields=['generation'])
+    _cache().set(_generation_key(user.id), state.generation, timeout=get_signed_token_settings()['CACHE_TTL'])
+
+
+def forget_user(user_id) -> None:
+    """Drop the cached user object, e.g. after the user row changed."""
+    _cache().delete(_user_key(user_id))
@@ -0,0 +1,161 @@
+"""
+Write-behind activity log of projects.
+
+Views call ``record()``, which only appends to a per-process buffer. The
+buffer is written with one ``bulk_create`` after the response of a request
+that finds ``FLUSH_SIZE`` entries pending or the last flush older than
+``FLUSH_INTERVAL`` seconds, and at exit. Consecutive autosaves (and lock
+refreshes) of a diagram by the same user within ``COLLAPSE_WINDOW`` seconds
+become one entry whose ``count`` grows, also when the entry was already
+written. Inside a transaction entries are buffered once it commits, so a
+rolled back batch leaves nothing in the log. Entries still buffered when a process is killed are lost; the log
+is for people, not for recovery.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ActivityEntry
+
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_DEFAULTS = {
+    'ENABLED': True,
+    'FLUSH_SIZE': 200,
+    'FLUSH_INTERVAL': 5,
+    'COLLAPSE_WINDOW': 300,
+    'PAGE_SIZE': 50,
+}
+
+# Actions repeated by the same user on the same diagram that collapse into one entry
+COLLAPSIBLE = frozenset({'diagram.update', 'lock.acquire'})
+
+
+def get_activity_settings() -> dict:
+    return {**ACTIVITY_DEFAULTS, **getattr(settings, 'DIAGRAMS_ACTIVITY', {})}
+
+
+class ActivityBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._pending_ids = set()
+        # id(entry) -> [entry, saves, last_at] for written entries that absorbed more saves
+        self._increments = {}
+        # diagram id -> (entry, user_id, action, details) of the latest entry about it
+        self._latest = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, project_id, user, action, target_id=None, target_name='', details=None) -> None:
+        config = get_activity_settings()
+        if not config['ENABLED']:
+            return
+        now = timezone.now()
+        details = details or {}
+        user_id = user.id if user is not None and user.is_authenticated else None
+        diagram_id = target_id if action.split('.')[0] in ('diagram', 'lock') else None
+
+        with self._lock:
+            latest = self._latest.get(diagram_id) if diagram_id is not None else None
+            if (action in COLLAPSIBLE and latest is not None
+                    and latest[1:] == (user_id, action, details)
+                    and now - latest[0].updated_at <= timedelta(seconds=config['COLLAPSE_WINDOW'])):
+                entry = latest[0]
+                entry.updated_at = now
+                if id(entry) in self._pending_ids:
+                    entry.count += 1
+                else:
+                    increment = self._increments.setdefault(id(entry), [entry, 0, now])
+                    increment[1] += 1
+                    increment[2] = now
+                return
+
+            entry = ActivityEntry(
+                project_id=project_id,
+                user_id=user_id,
+                username=getattr(user, 'username', '') or '',
+                action=action,
+                target_id=target_id,
+                target_name=(target_name or '')[:255],
+                details=details,
+                created_at=now,
+                updated_at=now,
+            )
+            self._pending.append(entry)
+            self._pending_ids.add(id(entry))
+            if diagram_id is not None:
+                self._latest[diagram_id] = (entry, user_id, action, details)
+
+    def due(self) -> bool:
+        config = get_activity_settings()
+        return bool(self._pending or self._increments) and (
+            len(self._pending) >= config['FLUSH_SIZE']
+            or time.monotonic() - self._last_flush >= config['FLUSH_INTERVAL']
+        )
+
+    def flush(self) -> int:
+        """Write buffered entries and collapsed saves; returns the number of new rows."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._pending_ids = self._pending, [], set()
+                # Entries written by an earlier flush; without their pk (no RETURNING) the saves are dropped
+                increments = [item for item in self._increments.values() if item[0].pk is not None]
+                self._increments = {}
+                window = timedelta(seconds=get_activity_settings()['COLLAPSE_WINDOW'])
+                cutoff = timezone.now() - window
+                self._latest = {key: value for key, value in self._latest.items() if value[0].updated_at >= cutoff}
+                self._last_flush = time.monotonic()
+
+            if pending:
+                ActivityEntry.objects.bulk_create(pending, batch_size=500)
+            for entry, saves, last_at in increments:
+                ActivityEntry.objects.filter(pk=entry.pk).update(count=F('count') + saves, updated_at=last_at)
+            return len(pending)
+
+
+buffer = ActivityBuffer()
+flush = buffer.flush
+
+
+def record(project_id, user, action, target=None, details=None) -> None:
+    """Log ``action`` by ``user`` in a project; ``target`` is the diagram, link or invite concerned."""
+    target_name = getattr(target, 'name', '') if target is not None else ''
+    if not target_name and hasattr(target, 'source_element_label'):
+        target_name = target.source_element_label
+    write = partial(buffer.record, project_id, user, action, getattr(target, 'id', None), target_name, details)
+    # Checked here rather than left to on_commit(), which would connect from async views
+    if connection.in_atomic_block:
+        transaction.on_commit(write)
+    else:
+        write()
+
+
+def _flush_if_due(sender, **kwargs):
+    # Runs once the response has been handed to the server
+    if buffer.due():
+        try:
+            buffer.flush()
+        except Exception:
+            logger.exception('Writing the activity log failed')
+
+
+request_finished.connect(_flush_if_due, dispatch_uid='diagrams_activity_flush')
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        pass
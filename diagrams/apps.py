@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DiagramsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'diagrams'
+
+    def ready(self):
+        # query_observers hooks into every connection opened from now on
+        from . import query_observers, signals, tasks  # noqa: F401
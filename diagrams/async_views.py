@@ -0,0 +1,153 @@
+"""
+Async implementations of the hot diagram endpoints for ASGI deployments.
+
+They mirror DiagramDetailApiView, DiagramLockView and DiagramLinksView and
+are routed instead of them when ``DIAGRAMS_ASYNC_VIEWS`` is enabled. Lookups
+and lock updates use Django's async ORM; code paths that go through DRF
+serializer saves or the response cache run via ``sync_to_async``.
+"""
+import inspect
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import activity, coalescing, compression, deletion, metrics
+from .models import Diagram, ProjectMembership
+from .serializers import DiagramSerializer
+from .throttling import editor_write
+from .views import (
+    LOCK_FIELDS,
+    _apply_lock,
+    _changed_by_update,
+    _coalesce_update,
+    _create_diagram_link,
+    _diagram_links_data,
+    _prepare_diagram_update,
+    _release_lock,
+    _serialize_lock,
+)
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView with coroutine handlers. Authentication, permission and throttle
+    checks run through DRF's regular (sync) `initial()` in a worker thread;
+    the handler itself runs on the event loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+async def _aget_diagram(diagram_id, user) -> Diagram:
+    try:
+        diagram = await Diagram.objects.select_related('locked_by__guest_profile').aget(id=diagram_id)
+    except Diagram.DoesNotExist:
+        raise Http404
+    if not await ProjectMembership.objects.filter(project_id=diagram.project_id, user=user).aexists():
+        raise PermissionDenied("You do not have access to this project.")
+    return diagram
+
+
+class AsyncDiagramDetailApiView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request, diagram_id):
+        diagram = await _aget_diagram(diagram_id, request.user)
+        etag = compression.diagram_etag(diagram, request.accepted_media_type)
+        if compression.etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(DiagramSerializer(diagram).data, status=status.HTTP_200_OK, headers={'ETag': etag})
+
+    async def put(self, request, diagram_id):
+        with editor_write():
+            diagram = await _aget_diagram(diagram_id, request.user)
+            metrics.observe('diagram_autosave_bytes', int(request.META.get('CONTENT_LENGTH') or 0))
+
+            data_to_update = _prepare_diagram_update(request.data)
+            changed = _changed_by_update(diagram, data_to_update)
+            if not changed:
+                metrics.inc('diagram_saves_total', outcome='unchanged')
+                return Response(DiagramSerializer(diagram).data, status=status.HTTP_200_OK)
+            if await sync_to_async(_coalesce_update)(diagram, data_to_update, changed):
+                metrics.inc('diagram_saves_total', outcome='coalesced')
+                activity.record(diagram.project_id, request.user, 'diagram.update', diagram)
+                return Response(DiagramSerializer(diagram).data, status=status.HTTP_200_OK)
+            serializer = DiagramSerializer(diagram, data=data_to_update, partial=True)
+            if serializer.is_valid():
+                await sync_to_async(serializer.save)(revision=coalescing.next_revision(diagram))
+                metrics.inc('diagram_saves_total', outcome='saved')
+                activity.record(diagram.project_id, request.user, 'diagram.update', diagram)
+                return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    async def delete(self, request, diagram_id):
+        diagram = await _aget_diagram(diagram_id, request.user)
+        task = await sync_to_async(deletion.delete_diagram)(diagram, request.user)
+        activity.record(diagram.project_id, request.user, 'diagram.delete', diagram)
+        return Response(deletion.serialize_task(task), status=status.HTTP_202_ACCEPTED)
+
+
+class AsyncDiagramLockView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request, diagram_id):
+        diagram = await _aget_diagram(diagram_id, request.user)
+        return Response(_serialize_lock(diagram), status=status.HTTP_200_OK)
+
+    async def post(self, request, diagram_id):
+        with editor_write():
+            diagram = await _aget_diagram(diagram_id, request.user)
+            if _apply_lock(diagram, request.user):
+                await diagram.asave(update_fields=LOCK_FIELDS)
+                activity.record(diagram.project_id, request.user, 'lock.acquire', diagram)
+            # request.user comes without its guest profile, serializing it may query
+            data = await sync_to_async(_serialize_lock)(diagram)
+            return Response(data, status=status.HTTP_200_OK)
+
+    async def delete(self, request, diagram_id):
+        diagram = await _aget_diagram(diagram_id, request.user)
+        _release_lock(diagram, request.user)
+        await diagram.asave(update_fields=LOCK_FIELDS)
+        await sync_to_async(coalescing.flush)(diagram.id)
+        activity.record(diagram.project_id, request.user, 'lock.release', diagram)
+        return Response(_serialize_lock(diagram), status=status.HTTP_200_OK)
+
+
+class AsyncDiagramLinksView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request, diagram_id):
+        data = await sync_to_async(_diagram_links_data)(diagram_id, request.user)
+        return Response(data, status=status.HTTP_200_OK)
+
+    async def post(self, request, diagram_id):
+        diagram = await _aget_diagram(diagram_id, request.user)
+        return await sync_to_async(_create_diagram_link)(request, diagram)
@@ -1,10 +1,16 @@
 from rest_framework.authentication import TokenAuthentication, get_authorization_header
 
+from . import access_tokens
+from .profiling import span
+
 
 class FlexibleTokenAuthentication(TokenAuthentication):
     """
     Accept both `Token <key>` and `Bearer <key>` headers so the frontend
     can keep using the more common Bearer schema.
+
+    The key is either a DRF token (looked up in the database) or a signed
+    access token from `diagrams.access_tokens` (verified without it).
     """
 
     def authenticate(self, request):
@@ -23,5 +29,7 @@ class FlexibleTokenAuthentication(TokenAuthentication):
             return None
 
         token = auth[1].decode()
-        return self.authenticate_credentials(token)
-
+        with span('auth'):
+            if access_tokens.is_signed_token(token):
+                return access_tokens.verify(token)
+            return self.authenticate_credentials(token)
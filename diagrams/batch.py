@@ -0,0 +1,155 @@
+"""
+Batch API: run several API calls in one HTTP round trip.
+
+    POST /api/batch
+    {
+        "atomic": false,
+        "requests": [
+            {"id": "lock", "method": "POST", "path": "/api/diagrams/7/lock"},
+            {"id": "diagram", "method": "GET", "path": "/api/diagrams/7"},
+            {"id": "links", "method": "GET", "path": "/api/diagrams/7/links"}
+        ]
+    }
+
+Each sub-request is resolved against the regular URLconf and dispatched to
+its view in-process; only DRF views under ``/api/`` can be called, since
+sub-requests do not pass through the middleware (no session). The caller is authenticated once and the sub-requests
+reuse that user; project memberships are resolved once for the whole batch.
+With ``"atomic": true`` the batch runs in one transaction, stops at the first
+sub-request answering with a 4xx/5xx status and rolls everything back.
+"""
+import io
+import json
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .views import membership_scope
+
+
+BATCH_MAX_REQUESTS = 50
+BATCH_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+# Request headers passed on to the sub-requests.
+BATCH_FORWARDED_META = (
+    'HTTP_AUTHORIZATION',
+    'HTTP_ACCEPT_LANGUAGE',
+    'HTTP_HOST',
+    'HTTP_USER_AGENT',
+    'REMOTE_ADDR',
+    'SERVER_NAME',
+    'SERVER_PORT',
+    'wsgi.url_scheme',
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _build_subrequest(parent, method: str, path: str, body) -> HttpRequest:
+    url = urlsplit(path)
+    payload = b'' if body is None else json.dumps(body).encode()
+
+    sub = HttpRequest()
+    sub.method = method
+    sub.path = sub.path_info = url.path
+    sub.META = {key: parent.META[key] for key in BATCH_FORWARDED_META if key in parent.META}
+    sub.META.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+    })
+    sub.GET = QueryDict(url.query)
+    sub._stream = io.BytesIO(payload)
+    sub._read_started = False
+
+    # Picked up by DRF's Request: skip re-running token authentication.
+    sub._force_auth_user = parent.user
+    sub._force_auth_token = parent.auth
+    return sub
+
+
+def _dispatch(parent, item) -> dict:
+    result = {'id': item.get('id')}
+    method = str(item.get('method', 'GET')).upper()
+    path = item.get('path')
+
+    if method not in BATCH_METHODS or not isinstance(path, str) or not path.startswith('/'):
+        result.update(status=status.HTTP_400_BAD_REQUEST, body={"detail": "Each request needs a method and an absolute path."})
+        return result
+
+    url_path = urlsplit(path).path
+    try:
+        match = resolve(url_path)
+    except Resolver404:
+        result.update(status=status.HTTP_404_NOT_FOUND, body={"detail": "Not found."})
+        return result
+    if not url_path.startswith('/api/') or not issubclass(getattr(match.func, 'cls', object), APIView):
+        result.update(status=status.HTTP_400_BAD_REQUEST, body={"detail": "Only API endpoints can be batched."})
+        return result
+    if match.func is batch_view:
+        result.update(status=status.HTTP_400_BAD_REQUEST, body={"detail": "Batches cannot be nested."})
+        return result
+
+    sub = _build_subrequest(parent, method, path, item.get('body'))
+    sub.resolver_match = match
+    view = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+    response = view(sub, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+
+    body = None
+    if response.content:
+        if response.get('Content-Type', '').startswith('application/json'):
+            body = json.loads(response.content)
+        else:
+            body = response.content.decode(response.charset or 'utf-8', errors='replace')
+    result.update(status=response.status_code, body=body)
+    return result
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_view(request):
+    items = request.data.get('requests') if hasattr(request.data, 'get') else None
+    atomic = bool(request.data.get('atomic', False)) if hasattr(request.data, 'get') else False
+    max_requests = getattr(settings, 'DIAGRAMS_BATCH_MAX_REQUESTS', BATCH_MAX_REQUESTS)
+
+    if not isinstance(items, list) or not items:
+        return Response({"detail": "requests must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > max_requests:
+        return Response(
+            {"detail": f"A batch can contain at most {max_requests} requests."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if not all(isinstance(item, dict) for item in items):
+        return Response({"detail": "Each request must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+
+    responses = []
+    rolled_back = False
+    with membership_scope(request.user):
+        if not atomic:
+            responses = [_dispatch(request, item) for item in items]
+        else:
+            try:
+                with transaction.atomic():
+                    for item in items:
+                        result = _dispatch(request, item)
+                        responses.append(result)
+                        if result['status'] >= 400:
+                            raise _Rollback
+            except _Rollback:
+                rolled_back = True
+
+    return Response({"responses": responses, "rolled_back": rolled_back}, status=status.HTTP_200_OK)
@@ -0,0 +1,318 @@
+"""
+Opt-in write coalescing for diagram autosaves.
+
+With ``DIAGRAMS_WRITE_COALESCING['ENABLED']`` a ``data``-only update made
+outside a transaction is acknowledged once it has been appended to a local journal and put into the
+diagram's pending slot; the row is written by a flusher thread every
+``FLUSH_INTERVAL`` seconds with the latest document only, when the editor
+releases the lock, and at exit. Every diagram loaded through the ORM gets the
+pending ``data``, ``data_hash``, ``revision`` and ``updated_at`` laid over the
+stored ones (``Diagram.load_hooks``), so reads see the pending state and any
+other save of the diagram writes it and supersedes the slot. Revisions of
+every diagram write are allocated here (``next_revision``), under the same
+lock as the slots, so a pending write and a direct save never publish the
+same revision; a save with a newer revision drops an older slot.
+
+Slots live in the process, so this only fits deployments with a single
+application process (the same restriction as LocMemCache). After a crash
+the journals of processes that are no longer running are replayed by the
+next process on its first request; an entry is only applied when its
+revision is newer than the stored one.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import metrics, response_cache
+from .models import Diagram
+
+
+logger = logging.getLogger(__name__)
+
+WRITE_COALESCING_DEFAULTS = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL': 2.0,
+    'JOURNAL_DIR': None,
+    'FSYNC': True,
+}
+
+# Fields flushed from a pending slot, and laid over loaded diagrams
+PENDING_FIELDS = ('data', 'data_hash', 'revision', 'updated_at')
+
+
+def get_write_coalescing_settings() -> dict:
+    return {**WRITE_COALESCING_DEFAULTS, **getattr(settings, 'DIAGRAMS_WRITE_COALESCING', {})}
+
+
+def enabled() -> bool:
+    return get_write_coalescing_settings()['ENABLED']
+
+
+def _journal_dir() -> Path:
+    configured = get_write_coalescing_settings()['JOURNAL_DIR']
+    return Path(configured) if configured else Path(settings.BASE_DIR) / 'var' / 'write-journal'
+
+
+class WriteCoalescer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # diagram id -> {'data': ..., 'data_hash': ..., 'revision': ..., 'updated_at': ..., 'project_id': ...}
+        self._slots = {}
+        # diagram id -> highest revision allocated or saved by this process
+        self._revisions = {}
+        self._journal = None
+        self._journal_index = 0
+        # Journals whose entries are all written, deleted after the next complete flush
+        self._retired = []
+        self._worker = None
+
+    # --- Acknowledging ---
+
+    def _allocate(self, diagram: Diagram) -> int:
+        # Called with self._lock held
+        slot = self._slots.get(diagram.id)
+        revision = max(
+            diagram.revision,
+            slot['revision'] if slot is not None else 0,
+            self._revisions.get(diagram.id, 0),
+        ) + 1
+        self._revisions[diagram.id] = revision
+        return revision
+
+    def next_revision(self, diagram: Diagram) -> int:
+        """Revision for a direct save of ``diagram``, newer than any pending or allocated one."""
+        if not enabled():
+            return diagram.revision + 1
+        with self._lock:
+            return self._allocate(diagram)
+
+    def submit(self, diagram: Diagram, document, data_hash: str) -> None:
+        """Take ``document`` as the new content of ``diagram`` and update the instance to match."""
+        config = get_write_coalescing_settings()
+        now = timezone.now()
+        with self._lock:
+            slot = {
+                'data': document,
+                'data_hash': data_hash,
+                'revision': self._allocate(diagram),
+                'updated_at': now,
+                'project_id': diagram.project_id,
+            }
+            self._append(diagram.id, slot, config['FSYNC'])
+            self._slots[diagram.id] = slot
+        diagram.data, diagram.data_hash = document, data_hash
+        diagram.revision, diagram.updated_at = slot['revision'], now
+        # Cached project listings carry the revision
+        response_cache.bump('project', diagram.project_id)
+        self._ensure_worker()
+
+    def _append(self, diagram_id, slot, fsync) -> None:
+        if self._journal is None:
+            directory = _journal_dir()
+            directory.mkdir(parents=True, exist_ok=True)
+            self._journal_index += 1
+            path = directory / f'journal-{os.getpid()}-{self._journal_index}.log'
+            self._journal = open(path, 'a', encoding='utf-8')
+        entry = {
+            'id': diagram_id,
+            'revision': slot['revision'],
+            'data_hash': slot['data_hash'],
+            'data': slot['data'],
+        }
+        self._journal.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._journal.flush()
+        if fsync:
+            os.fsync(self._journal.fileno())
+
+    # --- Reading ---
+
+    def overlay(self, diagram: Diagram) -> None:
+        slot = self._slots.get(diagram.id)
+        if slot is None:
+            return
+        for field in PENDING_FIELDS:
+            if field in diagram.__dict__:
+                diagram.__dict__[field] = slot[field]
+        diagram._hashed_data = slot['data']
+
+    def pending(self, diagram_id) -> bool:
+        return diagram_id in self._slots
+
+    def pending_project_updates(self) -> dict:
+        """Project id -> latest ``updated_at`` of its pending writes."""
+        latest = {}
+        with self._lock:
+            for slot in self._slots.values():
+                current = latest.get(slot['project_id'])
+                if current is None or slot['updated_at'] > current:
+                    latest[slot['project_id']] = slot['updated_at']
+        return latest
+
+    def _written(self, diagram_id, revision) -> None:
+        with self._lock:
+            if revision > self._revisions.get(diagram_id, 0):
+                self._revisions[diagram_id] = revision
+            slot = self._slots.get(diagram_id)
+            if slot is not None and slot['revision'] <= revision:
+                del self._slots[diagram_id]
+
+    def saved(self, diagram: Diagram) -> None:
+        """Drop the slot of ``diagram`` once a revision at least as new as its own has been written."""
+        if not enabled():
+            return
+        self._written(diagram.id, diagram.revision)
+
+    # --- Flushing ---
+
+    def flush(self, diagram_id=None) -> int:
+        """Write pending slots (only that of ``diagram_id`` if given); returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                ids = list(self._slots) if diagram_id is None else [i for i in (diagram_id,) if i in self._slots]
+                if diagram_id is None and self._journal is not None:
+                    # Everything journaled so far is covered by this flush; later saves go to a new file
+                    self._journal.close()
+                    self._retired.append(self._journal.name)
+                    self._journal = None
+            written = 0
+            for pending_id in ids:
+                with transaction.atomic():
+                    stored = (
+                        Diagram.all_objects.select_for_update().filter(id=pending_id)
+                        .values_list('revision', flat=True).first()
+                    )
+                    if stored is None:
+                        with self._lock:
+                            self._slots.pop(pending_id, None)
+                        continue
+                    # Loading lays the pending content over the stored one
+                    diagram = Diagram.all_objects.get(id=pending_id)
+                    if diagram.revision <= stored:
+                        # A direct save wrote a newer revision meanwhile
+                        self._written(pending_id, stored)
+                        continue
+                    # The post_save hook drops the slot unless a newer save replaced it meanwhile
+                    diagram.save(update_fields=list(PENDING_FIELDS))
+                    written += 1
+            if written:
+                metrics.inc('diagram_coalesced_flushes_total', written)
+            if diagram_id is None:
+                while self._retired:
+                    os.remove(self._retired.pop())
+            return written
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name='diagrams-coalescing', daemon=True)
+                self._worker.start()
+
+    def _work(self) -> None:
+        while True:
+            time.sleep(get_write_coalescing_settings()['FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing coalesced diagram writes failed')
+            finally:
+                close_old_connections()
+                if not self._slots:
+                    connection.close()
+
+
+coalescer = WriteCoalescer()
+submit = coalescer.submit
+next_revision = coalescer.next_revision
+pending_project_updates = coalescer.pending_project_updates
+flush = coalescer.flush
+pending = coalescer.pending
+saved = coalescer.saved
+
+Diagram.load_hooks.append(coalescer.overlay)
+
+
+# --- Recovery ---
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover() -> int:
+    """Apply journals left behind by processes that are gone; returns the number of diagrams updated."""
+    directory = _journal_dir()
+    if not directory.is_dir():
+        return 0
+    latest = {}
+    replayed = []
+    for path in sorted(directory.glob('journal-*.log')):
+        try:
+            pid = int(path.name.split('-')[1])
+        except (IndexError, ValueError):
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        with open(path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The line being written when the process died
+                    continue
+                if entry['revision'] > latest.get(entry['id'], {}).get('revision', 0):
+                    latest[entry['id']] = entry
+        replayed.append(path)
+
+    updated = 0
+    for diagram_id, entry in latest.items():
+        diagram = Diagram.all_objects.filter(id=diagram_id, revision__lt=entry['revision']).first()
+        if diagram is None:
+            continue
+        diagram.data, diagram.data_hash, diagram.revision = entry['data'], entry['data_hash'], entry['revision']
+        diagram._hashed_data = diagram.data
+        diagram.save(update_fields=list(PENDING_FIELDS))
+        updated += 1
+    for path in replayed:
+        path.unlink()
+    if updated:
+        logger.warning('Recovered %s coalesced diagram write(s) from journals', updated)
+    return updated
+
+
+_recovered = threading.Event()
+
+
+def _recover_once(sender, **kwargs):
+    if _recovered.is_set() or not enabled():
+        return
+    _recovered.set()
+    try:
+        recover()
+    except Exception:
+        logger.exception('Replaying the write journal failed')
+
+
+request_started.connect(_recover_once, dispatch_uid='diagrams_coalescing_recover')
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        coalescer.flush()
+    except Exception:
+        logger.exception('Flushing coalesced diagram writes at exit failed')
@@ -0,0 +1,237 @@
+"""
+Deferred deletion of projects and diagrams.
+
+Deleting through the ORM makes the collector load every related diagram,
+link, index row, invite and membership before cascading, holding the write
+lock for the whole cascade. Instead a delete request only marks the rows
+(``deleted_at``), which hides them from the default managers right away,
+and records a ``DeletionTask``. The rows are then purged in chunks of
+``CHUNK_SIZE``, one short transaction per chunk, by a worker thread of the
+process that accepted the request (``RUN_IN_PROCESS``) or by a
+``manage.py run_jobs`` worker; ``manage.py purge_deleted`` catches up on
+anything left over. Purging is idempotent, so a task interrupted by
+a restart is simply picked up again.
+"""
+import logging
+import queue
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import jobs, response_cache, spatial
+from .models import (
+    DeletionTask, Diagram, DiagramElementIndex, DiagramLink, Project, ProjectInvite, ProjectMembership,
+)
+
+
+logger = logging.getLogger(__name__)
+
+DELETION_DEFAULTS = {
+    'CHUNK_SIZE': 500,
+    'RUN_IN_PROCESS': True,
+    'STALE_AFTER': 300,
+}
+
+
+def get_deletion_settings() -> dict:
+    return {**DELETION_DEFAULTS, **getattr(settings, 'DIAGRAMS_DELETION', {})}
+
+
+# --- Marking ---
+
+def delete_project(project: Project, user) -> DeletionTask:
+    """Hide ``project`` and its diagrams now and schedule the purge."""
+    now = timezone.now()
+    with transaction.atomic():
+        Project.all_objects.filter(id=project.id).update(deleted_at=now)
+        total = Diagram.all_objects.filter(project_id=project.id).update(deleted_at=now)
+        ProjectInvite.objects.filter(project_id=project.id, is_active=True).update(is_active=False)
+        task = DeletionTask.objects.create(
+            kind=DeletionTask.KIND_PROJECT, object_id=project.id, project_id=project.id,
+            name=project.name, requested_by=user, total=total,
+        )
+        # Members' cached project lists; diagram lookups check project membership
+        response_cache.bump('project', project.id)
+        for member_id in ProjectMembership.objects.filter(project_id=project.id).values_list('user_id', flat=True):
+            response_cache.bump('user', member_id)
+        transaction.on_commit(lambda: schedule(task.id))
+    return task
+
+
+def delete_diagram(diagram: Diagram, user) -> DeletionTask:
+    """Hide ``diagram`` now and schedule the purge."""
+    with transaction.atomic():
+        Diagram.all_objects.filter(id=diagram.id).update(deleted_at=timezone.now())
+        task = DeletionTask.objects.create(
+            kind=DeletionTask.KIND_DIAGRAM, object_id=diagram.id, project_id=diagram.project_id,
+            name=diagram.name, requested_by=user, total=1,
+        )
+        response_cache.bump('project', diagram.project_id)
+        response_cache.bump('diagram', diagram.id)
+        # Links into other projects disappear from their lists too
+        linked = DiagramLink.all_objects.filter(Q(source_diagram_id=diagram.id) | Q(target_diagram_id=diagram.id))
+        for row in linked.values_list('source_diagram__project_id', 'target_diagram__project_id').distinct():
+            for project_id in row:
+                response_cache.bump('project', project_id)
+        transaction.on_commit(lambda: schedule(task.id))
+    return task
+
+
+# --- Purging ---
+
+def _delete_chunks(queryset, chunk_size, delete=None) -> int:
+    """
+    Delete ``queryset`` ``chunk_size`` rows per transaction, through
+    ``delete(ids)`` if given; returns the number of rows.
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        with transaction.atomic(), response_cache.link_invalidation_handled():
+            if delete is not None:
+                delete(ids)
+            else:
+                queryset.model._base_manager.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def purge_diagram(diagram_id, chunk_size) -> int:
+    """Remove a diagram and everything hanging off it; returns the number of rows deleted."""
+    deleted = _delete_chunks(
+        DiagramLink.all_objects.filter(Q(source_diagram_id=diagram_id) | Q(target_diagram_id=diagram_id)),
+        chunk_size,
+    )
+    # With their R*Tree entries, which are found through the rows
+    deleted += _delete_chunks(
+        DiagramElementIndex.objects.filter(diagram_id=diagram_id), chunk_size, spatial.delete_rows,
+    )
+    with transaction.atomic():
+        deleted += Diagram.all_objects.filter(id=diagram_id).delete()[0]
+    return deleted
+
+
+def _advance(task, purged=0, rows=0) -> None:
+    DeletionTask.objects.filter(id=task.id).update(
+        purged=F('purged') + purged, rows_deleted=F('rows_deleted') + rows, updated_at=timezone.now(),
+    )
+
+
+def run_task(task: DeletionTask) -> None:
+    """Purge what ``task`` marked, recording progress after every diagram."""
+    chunk_size = max(1, get_deletion_settings()['CHUNK_SIZE'])
+    if task.kind == DeletionTask.KIND_PROJECT:
+        diagram_ids = Diagram.all_objects.filter(project_id=task.object_id).values_list('id', flat=True)
+    else:
+        diagram_ids = [task.object_id]
+
+    for diagram_id in list(diagram_ids):
+        _advance(task, purged=1, rows=purge_diagram(diagram_id, chunk_size))
+
+    if task.kind == DeletionTask.KIND_PROJECT:
+        rows = _delete_chunks(ProjectInvite.objects.filter(project_id=task.object_id), chunk_size)
+        rows += _delete_chunks(ProjectMembership.objects.filter(project_id=task.object_id), chunk_size)
+        rows += Project.all_objects.filter(id=task.object_id).delete()[0]
+        _advance(task, rows=rows)
+
+
+def claim(task_id) -> DeletionTask | None:
+    """Mark a pending (or stalled running) task as running; None if another worker has it."""
+    stale_before = timezone.now() - timedelta(seconds=get_deletion_settings()['STALE_AFTER'])
+    claimed = DeletionTask.objects.filter(
+        Q(status=DeletionTask.STATUS_PENDING) | Q(status=DeletionTask.STATUS_RUNNING, updated_at__lt=stale_before),
+        id=task_id,
+    ).update(status=DeletionTask.STATUS_RUNNING, updated_at=timezone.now())
+    return DeletionTask.objects.get(id=task_id) if claimed else None
+
+
+def process(task_id) -> DeletionTask | None:
+    """Claim and run one task; failures are recorded on the task."""
+    task = claim(task_id)
+    if task is None:
+        return None
+    try:
+        run_task(task)
+    except Exception as exc:
+        logger.exception('Purging %s %s failed', task.kind, task.object_id)
+        DeletionTask.objects.filter(id=task.id).update(
+            status=DeletionTask.STATUS_FAILED, error=str(exc)[:1000], updated_at=timezone.now(),
+        )
+    else:
+        DeletionTask.objects.filter(id=task.id).update(
+            status=DeletionTask.STATUS_DONE, finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+    task.refresh_from_db()
+    return task
+
+
+def pending_task_ids() -> list:
+    stale_before = timezone.now() - timedelta(seconds=get_deletion_settings()['STALE_AFTER'])
+    return list(
+        DeletionTask.objects.filter(
+            Q(status=DeletionTask.STATUS_PENDING)
+            | Q(status=DeletionTask.STATUS_RUNNING, updated_at__lt=stale_before)
+        ).order_by('id').values_list('id', flat=True)
+    )
+
+
+# --- In-process worker ---
+
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _work() -> None:
+    while True:
+        task_id = _queue.get()
+        try:
+            process(task_id)
+        except Exception:
+            logger.exception('Deletion task %s could not be processed', task_id)
+        finally:
+            close_old_connections()
+            if _queue.empty():
+                # Don't keep a connection (and SQLite file handle) open while idle
+                connection.close()
+            _queue.task_done()
+
+
+def schedule(task_id) -> None:
+    """Hand a task to this process's purge thread, or queue it for the job worker."""
+    global _worker
+    if not get_deletion_settings()['RUN_IN_PROCESS']:
+        jobs.enqueue('deletion.purge', {'task_id': task_id}, priority=-1, dedupe_key=f'deletion.purge:{task_id}')
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name='diagrams-purge', daemon=True)
+            _worker.start()
+    _queue.put(task_id)
+
+
+def wait_idle() -> None:
+    """Block until the purge thread has worked through everything scheduled so far."""
+    _queue.join()
+
+
+def serialize_task(task: DeletionTask) -> dict:
+    return {
+        'id': task.id,
+        'kind': task.kind,
+        'object_id': task.object_id,
+        'name': task.name,
+        'status': task.status,
+        'total': task.total,
+        'purged': task.purged,
+        'progress': round(task.purged / task.total, 3) if task.total else (1.0 if task.status == DeletionTask.STATUS_DONE else 0.0),
+        'rows_deleted': task.rows_deleted,
+        'error': task.error,
+        'created_at': task.created_at,
+        'finished_at': task.finished_at,
+    }
@@ -0,0 +1,261 @@
+"""
+Structural diff and patch of diagram ``data`` documents.
+
+Nodes and edges are matched by ``id`` (one pass over each side), so a diff is
+linear in the size of the documents. Field-level changes are reported as
+key paths into the element; lists are compared as whole values.
+
+A patch is the compact, applicable form of a diff::
+
+    {"base": "<content hash>", "ops": [
+        ["add", "nodes", {...element...}],
+        ["remove", "edges", "e1"],
+        ["set", "nodes", "n1", ["data", "label"], "New label"],
+        ["unset", "nodes", "n1", ["style"]],
+        ["meta", "viewport", {...}]
+    ]}
+
+Top-level keys other than ``nodes`` and ``edges`` are carried by ``meta`` ops
+(value ``None`` removes the key). Elements without an ``id`` and elements
+sharing one are carried over untouched; ops cannot address the latter.
+"""
+from collections import Counter
+import copy
+import hashlib
+import json
+
+from . import response_cache
+
+
+ELEMENT_KINDS = ('nodes', 'edges')
+# Fields that only reflect where an element sits on the canvas.
+POSITION_FIELDS = frozenset({'position', 'positionAbsolute', 'dragging'})
+
+_MISSING = object()
+
+
+class PatchError(ValueError):
+    pass
+
+
+def content_hash(data) -> str:
+    """Hash of the canonical JSON form of ``data``; equal documents hash equally."""
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def _document(data) -> dict:
+    """``data`` checked to be a document; None is an empty one."""
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise PatchError('Diagram data must be an object.')
+    return data
+
+
+def _element_id(item):
+    return str(item['id']) if isinstance(item, dict) and item.get('id') is not None else None
+
+
+def _index(data, kind) -> dict:
+    items = data.get(kind) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return {}
+    return {_element_id(item): item for item in items if _element_id(item) is not None}
+
+
+def _field_changes(old, new, path=()) -> list:
+    """``(path, old, new)`` for every differing leaf; dicts are walked, anything else is a leaf."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in old.keys() | new.keys():
+            before, after = old.get(key, _MISSING), new.get(key, _MISSING)
+            if before != after:
+                changes.extend(_field_changes(before, after, path + (key,)))
+        return changes
+    return [(path, old, new)]
+
+
+def _value(value):
+    return None if value is _MISSING else value
+
+
+def _compare(base, head, kind):
+    """Added elements, removed ids and raw ``(id, changes)`` of modified elements of one kind."""
+    before, after = _index(base, kind), _index(head, kind)
+    added = [element for element_id, element in after.items() if element_id not in before]
+    removed = [element_id for element_id in before if element_id not in after]
+    modified = [
+        (element_id, sorted(_field_changes(before[element_id], element), key=lambda change: change[0]))
+        for element_id, element in after.items()
+        if element_id in before and before[element_id] != element
+    ]
+    return added, removed, modified
+
+
+def _meta(data) -> dict:
+    return {key: value for key, value in data.items() if key not in ELEMENT_KINDS}
+
+
+def diff_data(base, head, ignore_position=False) -> dict:
+    """
+    Compare two documents. Returns per kind the added elements, removed ids
+    and modified elements with their field changes, plus changes to other
+    top-level keys. ``ignore_position`` drops changes to position fields.
+    Raises PatchError unless both are documents.
+    """
+    base, head = _document(base), _document(head)
+    result = {'summary': {}}
+    for kind in ELEMENT_KINDS:
+        added, removed, raw = _compare(base, head, kind)
+        modified = []
+        for element_id, changes in raw:
+            changes = [
+                {'path': list(path), 'old': _value(old), 'new': _value(new)}
+                for path, old, new in changes
+                if not (ignore_position and path and path[0] in POSITION_FIELDS)
+            ]
+            if changes:
+                modified.append({'id': element_id, 'changes': changes})
+        result[kind] = {'added': added, 'removed': removed, 'modified': modified}
+        result['summary'][kind] = {'added': len(added), 'removed': len(removed), 'modified': len(modified)}
+
+    base_meta, head_meta = _meta(base), _meta(head)
+    result['other'] = [
+        {'key': key, 'old': base_meta.get(key), 'new': head_meta.get(key)}
+        for key in sorted(base_meta.keys() | head_meta.keys())
+        if base_meta.get(key, _MISSING) != head_meta.get(key, _MISSING)
+    ]
+    return result
+
+
+def make_patch(base, head) -> dict:
+    """Compact patch turning ``base`` into ``head`` (position changes included)."""
+    base, head = _document(base), _document(head)
+    ops = []
+    for kind in ELEMENT_KINDS:
+        added, removed, modified = _compare(base, head, kind)
+        ops.extend(['remove', kind, element_id] for element_id in removed)
+        for element_id, changes in modified:
+            for path, _, new in changes:
+                if new is _MISSING:
+                    ops.append(['unset', kind, element_id, list(path)])
+                else:
+                    ops.append(['set', kind, element_id, list(path), new])
+        ops.extend(['add', kind, element] for element in added)
+
+    base_meta, head_meta = _meta(base), _meta(head)
+    ops.extend(
+        ['meta', key, head_meta.get(key)]
+        for key in sorted(base_meta.keys() | head_meta.keys())
+        if base_meta.get(key, _MISSING) != head_meta.get(key, _MISSING)
+    )
+    return {'base': content_hash(base), 'ops': ops}
+
+
+def apply_patch(data, patch) -> dict:
+    """Return a new document with ``patch`` applied to ``data``; raises PatchError."""
+    data = _document(data)
+    ops = patch.get('ops') if isinstance(patch, dict) else None
+    if not isinstance(ops, list):
+        raise PatchError('patch must be an object with an ops list.')
+    for kind in ELEMENT_KINDS:
+        if kind in data and not isinstance(data[kind], list):
+            raise PatchError(f'{kind} must be a list.')
+
+    result = _meta(data)
+    elements = {kind: _index(data, kind) for kind in ELEMENT_KINDS}
+    duplicates = {
+        kind: {
+            element_id for element_id, count in Counter(map(_element_id, data.get(kind, []))).items()
+            if count > 1 and element_id is not None
+        }
+        for kind in ELEMENT_KINDS
+    }
+    # Per kind: element id -> new element, None when removed
+    changed = {kind: {} for kind in ELEMENT_KINDS}
+    added = {kind: {} for kind in ELEMENT_KINDS}
+    copied = set()
+    touched_kinds = set()
+
+    for op in ops:
+        if not isinstance(op, list) or not op:
+            raise PatchError('Each op must be a non-empty list.')
+        name = op[0]
+        if name == 'meta' and len(op) == 3 and op[1] not in ELEMENT_KINDS:
+            if op[2] is None:
+                result.pop(op[1], None)
+            else:
+                result[op[1]] = op[2]
+            continue
+        if len(op) < 3 or op[1] not in ELEMENT_KINDS:
+            raise PatchError(f'Invalid op: {op!r}')
+        kind = op[1]
+        index = elements[kind]
+        touched_kinds.add(kind)
+        element_id = _element_id(op[2]) if name == 'add' else str(op[2])
+        if element_id in duplicates[kind]:
+            raise PatchError(f'{kind} {element_id} is not unique.')
+
+        if name == 'add' and len(op) == 3 and element_id is not None:
+            if element_id not in index and element_id not in changed[kind]:
+                added[kind][element_id] = True
+            index[element_id] = changed[kind][element_id] = op[2]
+            copied.discard((kind, element_id))
+        elif name == 'remove' and len(op) == 3:
+            if index.pop(element_id, None) is None:
+                raise PatchError(f'{kind} {element_id} does not exist.')
+            changed[kind][element_id] = None
+        elif name in ('set', 'unset') and len(op) == (5 if name == 'set' else 4) and isinstance(op[3], list) and op[3]:
+            if element_id not in index:
+                raise PatchError(f'{kind} {element_id} does not exist.')
+            if (kind, element_id) not in copied:
+                # Copy on first write, the input document and patch are left untouched
+                index[element_id] = changed[kind][element_id] = copy.deepcopy(index[element_id])
+                copied.add((kind, element_id))
+            target = index[element_id]
+            for key in op[3][:-1]:
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                target = target[key]
+            if name == 'set':
+                target[op[3][-1]] = op[4]
+            else:
+                target.pop(op[3][-1], None)
+        else:
+            raise PatchError(f'Invalid op: {op!r}')
+
+    for kind in ELEMENT_KINDS:
+        if kind not in data and kind not in touched_kinds:
+            continue
+        items = []
+        for item in data.get(kind, []):
+            element_id = _element_id(item)
+            if element_id in changed[kind] and element_id not in added[kind]:
+                if changed[kind][element_id] is not None:
+                    items.append(changed[kind][element_id])
+            else:
+                items.append(item)
+        items.extend(elements[kind][element_id] for element_id in added[kind] if element_id in elements[kind])
+        result[kind] = items
+    return result
+
+
+def cached_diff(base, head, ignore_position=False, output='full') -> dict:
+    """
+    ``diff_data`` (or ``make_patch`` for ``output='patch'``) cached per pair of
+    content hashes; the result only depends on the two documents.
+    """
+    base, head = _document(base), _document(head)
+    base_hash, head_hash = content_hash(base), content_hash(head)
+
+    def build():
+        if output == 'patch':
+            value = make_patch(base, head)
+        else:
+            value = diff_data(base, head, ignore_position=ignore_position)
+        value.update(base_hash=base_hash, head_hash=head_hash)
+        return value, []
+
+    key = [base_hash, head_hash, output, bool(ignore_position) and output != 'patch']
+    return response_cache.read_through('diagram_diff', key, [], build)
@@ -0,0 +1,260 @@
+"""
+Database-backed background jobs.
+
+Work that should not run inside a request is registered with ``@handler``
+and queued with ``enqueue()``; ``manage.py run_jobs`` executes it and has to
+run next to the application servers, unless ``EAGER`` is set. Jobs are
+claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+supports it; on SQLite, which serializes writers anyway, a conditional
+``UPDATE ... WHERE status = 'queued'`` is the claim. A failing job is retried
+with exponential backoff until ``max_attempts``; a job whose worker died is
+queued again once ``VISIBILITY_TIMEOUT`` has passed, so handlers must be
+idempotent. Handlers are called with the job payload as keyword arguments.
+
+Callers that cannot leave work undone when no worker runs check
+``unclaimed()`` and take the job over with ``run_here()``; a warning is
+logged whenever a ready job has waited ``UNCLAIMED_AFTER`` seconds.
+"""
+import logging
+import os
+import random
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from . import metrics
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+JOBS_DEFAULTS = {
+    'EAGER': False,
+    'POLL_INTERVAL': 1.0,
+    'VISIBILITY_TIMEOUT': 600,
+    'BACKOFF_BASE': 5,
+    'BACKOFF_MAX': 3600,
+    'MAX_ATTEMPTS': 5,
+    'KEEP_FINISHED': 7 * 24 * 3600,
+    'UNCLAIMED_AFTER': 300,
+}
+
+# last_error of a job left to an identical one queued after it
+SUPERSEDED = 'An identical job was queued meanwhile and does the work.'
+
+_handlers = {}
+
+
+def get_jobs_settings() -> dict:
+    return {**JOBS_DEFAULTS, **getattr(settings, 'DIAGRAMS_JOBS', {})}
+
+
+def handler(name: str):
+    """Register the decorated function as the handler of jobs called ``name``."""
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, *, priority=0, delay=0, dedupe_key=None, max_attempts=None):
+    """
+    Queue a job. With ``dedupe_key`` an already queued job with the same key
+    is returned instead of adding another. With ``EAGER`` the handler runs
+    right away (once the current transaction commits) and None is returned.
+    """
+    if name not in _handlers:
+        raise LookupError(f'No job handler registered for {name!r}.')
+    config = get_jobs_settings()
+    payload = payload or {}
+    if config['EAGER']:
+        transaction.on_commit(lambda: _handlers[name](**payload))
+        return None
+
+    fields = {
+        'name': name,
+        'payload': payload,
+        'priority': priority,
+        'run_after': timezone.now() + timedelta(seconds=delay),
+        'max_attempts': max_attempts or config['MAX_ATTEMPTS'],
+        'dedupe_key': dedupe_key,
+    }
+    if dedupe_key is None:
+        return Job.objects.create(**fields)
+    existing = Job.objects.filter(dedupe_key=dedupe_key, status=Job.STATUS_QUEUED).first()
+    if existing is not None:
+        return existing
+    try:
+        with transaction.atomic():
+            return Job.objects.create(**fields)
+    except IntegrityError:
+        # Queued concurrently by someone else
+        return Job.objects.filter(dedupe_key=dedupe_key, status=Job.STATUS_QUEUED).first()
+
+
+# --- Claiming and running ---
+
+def _ready(names=None):
+    ready = Job.objects.filter(status=Job.STATUS_QUEUED, run_after__lte=timezone.now())
+    if names:
+        ready = ready.filter(name__in=names)
+    return ready.order_by('-priority', 'run_after', 'id')
+
+
+def claim(worker_id, limit=1, names=None) -> list:
+    """Take up to ``limit`` ready jobs for ``worker_id``."""
+    claimed = {
+        'status': Job.STATUS_RUNNING,
+        'worker': worker_id,
+        'locked_at': timezone.now(),
+        'attempts': F('attempts') + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(_ready(names).select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(id__in=ids).update(**claimed)
+    else:
+        ids = []
+        for job_id in _ready(names).values_list('id', flat=True)[:limit * 4]:
+            # Lost the race if another worker updated the row first
+            if Job.objects.filter(id=job_id, status=Job.STATUS_QUEUED).update(**claimed):
+                ids.append(job_id)
+                if len(ids) == limit:
+                    break
+    return list(Job.objects.filter(id__in=ids).order_by('-priority', 'run_after', 'id'))
+
+
+def unclaimed(job) -> bool:
+    """True if ``job`` has been ready for UNCLAIMED_AFTER seconds without a worker claiming it."""
+    if job is None or job.status != Job.STATUS_QUEUED:
+        return False
+    waited = (timezone.now() - job.run_after).total_seconds()
+    if waited < get_jobs_settings()['UNCLAIMED_AFTER']:
+        return False
+    logger.warning('Job %s #%s has waited %.0fs for a worker; is manage.py run_jobs running?', job.name, job.id, waited)
+    return True
+
+
+def run_here(job: Job):
+    """Claim ``job`` for this process and run it; None if a worker claimed it first."""
+    claimed = Job.objects.filter(id=job.id, status=Job.STATUS_QUEUED).update(
+        status=Job.STATUS_RUNNING, worker=worker_id(), locked_at=timezone.now(), attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return None
+    return run(Job.objects.get(id=job.id))
+
+
+def backoff(attempts) -> float:
+    config = get_jobs_settings()
+    delay = min(config['BACKOFF_MAX'], config['BACKOFF_BASE'] * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.75, 1.0)
+
+
+def run(job: Job) -> str:
+    """Run a claimed job and record the outcome: 'done', 'retry' or 'failed'."""
+    metrics.observe('job_wait_seconds', max(0.0, (job.locked_at - job.run_after).total_seconds()), job=job.name)
+    start = time.perf_counter()
+    try:
+        func = _handlers.get(job.name)
+        if func is None:
+            raise LookupError(f'No job handler registered for {job.name!r}.')
+        func(**job.payload)
+    except Exception as exc:
+        logger.exception('Job %s #%s failed (attempt %s/%s)', job.name, job.id, job.attempts, job.max_attempts)
+        if job.attempts >= job.max_attempts:
+            outcome = 'failed'
+            Job.objects.filter(id=job.id).update(
+                status=Job.STATUS_FAILED, last_error=str(exc)[:2000], finished_at=timezone.now(),
+            )
+        else:
+            outcome = 'retry'
+            retry = {
+                'status': Job.STATUS_QUEUED,
+                'last_error': str(exc)[:2000],
+                'run_after': timezone.now() + timedelta(seconds=backoff(job.attempts)),
+            }
+            try:
+                with transaction.atomic():
+                    Job.objects.filter(id=job.id).update(**retry)
+            except IntegrityError:
+                # An identical job was queued meanwhile, let that one do the work
+                Job.objects.filter(id=job.id).update(
+                    status=Job.STATUS_FAILED, last_error=SUPERSEDED, finished_at=timezone.now(),
+                )
+    else:
+        outcome = 'done'
+        Job.objects.filter(id=job.id).update(status=Job.STATUS_DONE, finished_at=timezone.now(), last_error='')
+    metrics.observe('job_duration_seconds', time.perf_counter() - start, job=job.name)
+    metrics.inc('jobs_total', job=job.name, outcome=outcome)
+    return outcome
+
+
+def requeue_stale() -> int:
+    """Queue running jobs again whose worker has not finished them within VISIBILITY_TIMEOUT."""
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=get_jobs_settings()['VISIBILITY_TIMEOUT'])
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING, locked_at__lt=stale_before)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.STATUS_FAILED, last_error='Worker did not finish the job.', finished_at=now,
+    )
+    requeued = 0
+    for job_id in stale.values_list('id', flat=True):
+        try:
+            with transaction.atomic():
+                requeued += Job.objects.filter(id=job_id, status=Job.STATUS_RUNNING).update(
+                    status=Job.STATUS_QUEUED, worker='',
+                )
+        except IntegrityError:
+            # An identical job was queued since, that one does the work
+            requeued += Job.objects.filter(id=job_id).update(
+                status=Job.STATUS_FAILED, last_error=SUPERSEDED, finished_at=now,
+            )
+    return failed + requeued
+
+
+def prune(chunk_size=1000) -> int:
+    """Delete finished jobs older than KEEP_FINISHED, a chunk at a time."""
+    cutoff = timezone.now() - timedelta(seconds=get_jobs_settings()['KEEP_FINISHED'])
+    finished = Job.objects.filter(status__in=[Job.STATUS_DONE, Job.STATUS_FAILED], finished_at__lt=cutoff)
+    deleted = 0
+    while ids := list(finished.values_list('id', flat=True)[:chunk_size]):
+        deleted += Job.objects.filter(id__in=ids).delete()[0]
+    return deleted
+
+
+def stats() -> dict:
+    """Queued/running counts and the wait of the oldest ready job, per job name."""
+    now = timezone.now()
+    result = {}
+    rows = (
+        Job.objects.filter(status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING])
+        .values('name', 'status').annotate(count=Count('id')).order_by()
+    )
+    for row in rows:
+        entry = result.setdefault(row['name'], {'queued': 0, 'ready': 0, 'running': 0, 'oldest_wait': 0.0})
+        entry[row['status']] = row['count']
+    ready = _ready().values('name').annotate(count=Count('id'), oldest=Min('run_after')).order_by()
+    for row in ready:
+        entry = result[row['name']]
+        entry['ready'] = row['count']
+        entry['oldest_wait'] = round((now - row['oldest']).total_seconds(), 3)
+    return result
+
+
+@metrics.collector
+def _queue_gauges():
+    for name, entry in stats().items():
+        yield 'jobs_queued', {'job': name, 'state': 'ready'}, entry['ready']
+        yield 'jobs_queued', {'job': name, 'state': 'delayed'}, entry['queued'] - entry['ready']
+        yield 'jobs_queued', {'job': name, 'state': 'running'}, entry['running']
+        yield 'jobs_oldest_wait_seconds', {'job': name}, entry['oldest_wait']
+
+
+def worker_id(suffix='') -> str:
+    return f'{socket.gethostname()}:{os.getpid()}{suffix}'
@@ -0,0 +1,525 @@
+"""
+Server-side automatic layout of ``Diagram.data``.
+
+Only top-level nodes are placed; children of groups (``parentId``) keep their
+relative positions and move with their parent, and their edges count as edges
+of the top-level ancestor. Connected components are laid out separately and
+packed into rows.
+
+* ``layered``: Sugiyama-style layout for BPMN and DFD flows. It breaks cycles
+  with a DFS, assigns longest-path layers, orders each layer with barycenter
+  sweeps and places nodes next to the mean of their predecessors.
+* ``force``: Fruchterman-Reingold for ERDs, seeded with the layered result.
+  Repulsion only looks at nodes in neighbouring grid cells, so an iteration is
+  linear in the number of nodes instead of quadratic.
+
+In incremental mode only nodes without a position and the requested
+``node_ids`` are placed, next to their already placed neighbours; everything
+else keeps its coordinates.
+"""
+from collections import defaultdict, deque
+import math
+
+from django.conf import settings
+
+from .spatial import _elements, _number, node_size
+
+
+LAYOUT_DEFAULTS = {
+    'MAX_NODES': 20000,
+    'NODE_GAP': 40,
+    'LAYER_GAP': 120,
+    'ORDERING_SWEEPS': 4,
+    'FORCE_ITERATIONS': 50,
+    # Upper bound on iterations * nodes, keeps the force layout of big ERDs within seconds
+    'FORCE_WORK_BUDGET': 250000,
+}
+
+ALGORITHMS = ('layered', 'force')
+DIRECTIONS = ('LR', 'TB')
+DEFAULT_ALGORITHMS = {
+    'bpmn': 'layered',
+    'dfd': 'layered',
+    'erd': 'force',
+}
+
+
+class LayoutError(ValueError):
+    pass
+
+
+def get_layout_settings() -> dict:
+    return {**LAYOUT_DEFAULTS, **getattr(settings, 'DIAGRAMS_LAYOUT', {})}
+
+
+class _Graph:
+    """Top-level nodes of a diagram with sizes and deduplicated edges between them."""
+
+    def __init__(self, data):
+        nodes = {str(node['id']): node for node in _elements(data, 'nodes')}
+        self.nodes = nodes
+        self.ids = [node_id for node_id, node in nodes.items() if self._parent(node) not in nodes]
+        self.sizes = {node_id: node_size(nodes[node_id]) for node_id in self.ids}
+
+        top = {}
+        for node_id in nodes:
+            chain, current = [], node_id
+            while current in nodes and current not in top and current not in chain:
+                chain.append(current)
+                current = self._parent(nodes[current])
+            root = top.get(current, chain[-1])
+            for item in chain:
+                top[item] = root
+
+        self.succ = {node_id: [] for node_id in self.ids}
+        self.pred = {node_id: [] for node_id in self.ids}
+        seen = set()
+        for edge in _elements(data, 'edges'):
+            source, target = top.get(str(edge.get('source'))), top.get(str(edge.get('target')))
+            if source not in self.succ or target not in self.succ or source == target or (source, target) in seen:
+                continue
+            seen.add((source, target))
+            self.succ[source].append(target)
+            self.pred[target].append(source)
+
+    @staticmethod
+    def _parent(node):
+        parent = node.get('parentId') or node.get('parentNode')
+        return str(parent) if parent is not None else None
+
+    def neighbours(self, node_id):
+        return self.pred[node_id] + self.succ[node_id]
+
+    def components(self) -> list:
+        seen, components = set(), []
+        for root in self.ids:
+            if root in seen:
+                continue
+            seen.add(root)
+            component, queue = [], deque([root])
+            while queue:
+                node_id = queue.popleft()
+                component.append(node_id)
+                for other in self.neighbours(node_id):
+                    if other not in seen:
+                        seen.add(other)
+                        queue.append(other)
+            components.append(component)
+        return components
+
+
+# --- Layered layout ---
+
+def _acyclic_successors(graph, ids) -> dict:
+    """Successor lists with DFS back edges reversed, which makes the graph acyclic."""
+    succ = {node_id: list(graph.succ[node_id]) for node_id in ids}
+    state = {}
+    reversed_edges = []
+    for root in ids:
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(graph.succ[root]))]
+        while stack:
+            node_id, children = stack[-1]
+            for child in children:
+                if state.get(child) == 1:
+                    reversed_edges.append((node_id, child))
+                elif child not in state:
+                    state[child] = 1
+                    stack.append((child, iter(graph.succ[child])))
+                    break
+            else:
+                state[node_id] = 2
+                stack.pop()
+
+    for source, target in reversed_edges:
+        succ[source].remove(target)
+        succ[target].append(source)
+    return succ
+
+
+def _layers(ids, succ) -> list:
+    indegree = {node_id: 0 for node_id in ids}
+    for node_id in ids:
+        for child in succ[node_id]:
+            indegree[child] += 1
+    sources = [node_id for node_id in ids if indegree[node_id] == 0]
+    rank = {node_id: 0 for node_id in ids}
+    order = []
+    queue = deque(sources)
+    while queue:
+        node_id = queue.popleft()
+        order.append(node_id)
+        for child in succ[node_id]:
+            rank[child] = max(rank[child], rank[node_id] + 1)
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+
+    # Longest-path layering puts every source in the first layer; move them next to their successors
+    for node_id in sources:
+        if succ[node_id]:
+            rank[node_id] = min(rank[child] for child in succ[node_id]) - 1
+
+    layers = defaultdict(list)
+    for node_id in order:
+        layers[rank[node_id]].append(node_id)
+    return [layers[index] for index in sorted(layers)]
+
+
+def _order_layers(layers, succ, sweeps) -> None:
+    pred = defaultdict(list)
+    for node_id, children in succ.items():
+        for child in children:
+            pred[child].append(node_id)
+
+    position = {}
+    for layer in layers:
+        for index, node_id in enumerate(layer):
+            position[node_id] = index / len(layer)
+
+    def sweep(sequence, neighbours):
+        for layer in sequence:
+            def barycenter(node_id):
+                linked = neighbours[node_id]
+                if not linked:
+                    return position[node_id]
+                return sum(position[other] for other in linked) / len(linked)
+
+            layer.sort(key=barycenter)
+            for index, node_id in enumerate(layer):
+                position[node_id] = index / len(layer)
+
+    for _ in range(sweeps):
+        sweep(layers[1:], pred)
+        sweep(list(reversed(layers))[1:], succ)
+
+
+def _layered(graph, ids, config, direction) -> dict:
+    """Centers of ``ids`` relative to the component's top-left corner."""
+    succ = _acyclic_successors(graph, ids)
+    layers = _layers(ids, succ)
+    _order_layers(layers, succ, config['ORDERING_SWEEPS'])
+
+    # "along" runs across layers (x for LR), "across" runs within a layer
+    def along_size(node_id):
+        return graph.sizes[node_id][0 if direction == 'LR' else 1]
+
+    def across_size(node_id):
+        return graph.sizes[node_id][1 if direction == 'LR' else 0]
+
+    pred = defaultdict(list)
+    for node_id, children in succ.items():
+        for child in children:
+            pred[child].append(node_id)
+
+    along, across = {}, {}
+    offset = 0.0
+    for layer in layers:
+        thickness = max(along_size(node_id) for node_id in layer)
+        bottom = None
+        drift = []
+        for node_id in layer:
+            size = across_size(node_id)
+            placed = [across[other] for other in pred[node_id] if other in across]
+            earliest = 0.0 if bottom is None else bottom + config['NODE_GAP']
+            start = earliest
+            if placed:
+                wanted = sum(placed) / len(placed) - size / 2
+                start = wanted if bottom is None else max(wanted, earliest)
+                drift.append(wanted - start)
+            across[node_id] = start + size / 2
+            along[node_id] = offset + thickness / 2
+            bottom = start + size
+        # Shift the layer back so nodes pushed apart straddle their predecessors
+        if drift:
+            shift = sum(drift) / len(drift)
+            for node_id in layer:
+                across[node_id] += shift
+        offset += thickness + config['LAYER_GAP']
+
+    top = min(across[node_id] - across_size(node_id) / 2 for node_id in ids)
+    if direction == 'LR':
+        return {node_id: (along[node_id], across[node_id] - top) for node_id in ids}
+    return {node_id: (across[node_id] - top, along[node_id]) for node_id in ids}
+
+
+# --- Force-directed layout ---
+
+def _force(graph, centers, movable, config, ideal) -> None:
+    """Improve ``centers`` in place, only moving nodes in ``movable``."""
+    ids = list(centers)
+    if not movable or len(ids) < 2:
+        return
+    iterations = max(1, min(config['FORCE_ITERATIONS'], config['FORCE_WORK_BUDGET'] // len(ids)))
+    edges = [(node_id, child) for node_id in ids for child in graph.succ.get(node_id, ()) if child in centers]
+
+    cell = 2 * ideal
+    cutoff = cell * cell
+    ideal_sq = ideal * ideal
+    temperature = ideal * 2
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        grid = defaultdict(list)
+        for node_id in ids:
+            x, y = centers[node_id]
+            grid[(int(x // cell), int(y // cell))].append(node_id)
+
+        shift = {node_id: [0.0, 0.0] for node_id in movable}
+        for (cx, cy), members in grid.items():
+            nearby = [
+                other
+                for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                for other in grid.get((cx + dx, cy + dy), ())
+            ]
+            for node_id in members:
+                if node_id not in shift:
+                    continue
+                x, y = centers[node_id]
+                delta = shift[node_id]
+                for other in nearby:
+                    if other == node_id:
+                        continue
+                    ox, oy = centers[other]
+                    dx, dy = x - ox, y - oy
+                    distance_sq = dx * dx + dy * dy
+                    if distance_sq >= cutoff:
+                        continue
+                    if distance_sq < 0.01:
+                        dx, dy, distance_sq = 0.1, 0.0, 0.01
+                    # Repulsion k^2/d along the unit vector
+                    factor = ideal_sq / distance_sq
+                    delta[0] += dx * factor
+                    delta[1] += dy * factor
+
+        for source, target in edges:
+            sx, sy = centers[source]
+            tx, ty = centers[target]
+            dx, dy = sx - tx, sy - ty
+            # Attraction d^2/k along the unit vector
+            factor = math.sqrt(dx * dx + dy * dy) / ideal
+            if source in shift:
+                shift[source][0] -= dx * factor
+                shift[source][1] -= dy * factor
+            if target in shift:
+                shift[target][0] += dx * factor
+                shift[target][1] += dy * factor
+
+        for node_id, (dx, dy) in shift.items():
+            length = math.sqrt(dx * dx + dy * dy)
+            if length > 0:
+                step = min(length, temperature) / length
+                x, y = centers[node_id]
+                centers[node_id] = (x + dx * step, y + dy * step)
+        temperature -= cooling
+
+
+def _ideal_distance(graph, ids, config) -> float:
+    diagonal = sum(math.hypot(*graph.sizes[node_id]) for node_id in ids) / len(ids)
+    return diagonal + config['NODE_GAP']
+
+
+# --- Placement helpers ---
+
+def _separate(graph, centers, movable, config) -> None:
+    """Move nodes in ``movable`` down until they no longer overlap any other node."""
+    gap = config['NODE_GAP']
+    cell = max(max(graph.sizes[node_id]) for node_id in centers) + gap
+    grid = defaultdict(list)
+
+    def box(node_id):
+        (x, y), (width, height) = centers[node_id], graph.sizes[node_id]
+        return x - width / 2, y - height / 2, x + width / 2, y + height / 2
+
+    def cells(bounds):
+        for cx in range(int(bounds[0] // cell), int(bounds[2] // cell) + 1):
+            for cy in range(int(bounds[1] // cell), int(bounds[3] // cell) + 1):
+                yield cx, cy
+
+    def blocker(bounds):
+        for key in cells(bounds):
+            for other in grid[key]:
+                ob = box(other)
+                if bounds[0] < ob[2] + gap and ob[0] < bounds[2] + gap and bounds[1] < ob[3] + gap and ob[1] < bounds[3] + gap:
+                    return ob
+        return None
+
+    for node_id in centers:
+        if node_id not in movable:
+            for key in cells(box(node_id)):
+                grid[key].append(node_id)
+    for node_id in sorted(movable, key=lambda item: (centers[item][1], centers[item][0])):
+        while (hit := blocker(box(node_id))) is not None:
+            x, _ = centers[node_id]
+            centers[node_id] = (x, hit[3] + gap + graph.sizes[node_id][1] / 2)
+        for key in cells(box(node_id)):
+            grid[key].append(node_id)
+
+
+def _snap_to_grid(graph, centers, config) -> None:
+    """
+    Snap ``centers`` to a grid of uniform cells, each node taking the free cell
+    nearest to the right of where it landed. Free cells are found with a
+    union-find per row, which keeps dense clusters linear to resolve.
+    """
+    gap = config['NODE_GAP']
+    cell_width = max(size[0] for size in map(graph.sizes.get, centers)) + gap
+    cell_height = max(size[1] for size in map(graph.sizes.get, centers)) + gap
+    next_free = defaultdict(dict)
+
+    def find(row, column):
+        parents = next_free[row]
+        root = column
+        while root in parents:
+            root = parents[root]
+        while column in parents and parents[column] != root:
+            parents[column], column = root, parents[column]
+        return root
+
+    for node_id in sorted(centers, key=lambda item: (centers[item][1], centers[item][0])):
+        x, y = centers[node_id]
+        row = round(y / cell_height)
+        column = find(row, round(x / cell_width))
+        next_free[row][column] = column + 1
+        centers[node_id] = (column * cell_width, row * cell_height)
+
+
+def _pack(graph, parts, config) -> dict:
+    """Place independently laid out components in rows, largest first."""
+    gap = config['LAYER_GAP']
+    measured = []
+    for centers in parts:
+        min_x = min(x - graph.sizes[node_id][0] / 2 for node_id, (x, _) in centers.items())
+        min_y = min(y - graph.sizes[node_id][1] / 2 for node_id, (_, y) in centers.items())
+        max_x = max(x + graph.sizes[node_id][0] / 2 for node_id, (x, _) in centers.items())
+        max_y = max(y + graph.sizes[node_id][1] / 2 for node_id, (_, y) in centers.items())
+        measured.append((max_y - min_y, max_x - min_x, min_x, min_y, centers))
+    measured.sort(key=lambda item: (-item[0], -item[1]))
+
+    total_area = sum((height + gap) * (width + gap) for height, width, *_ in measured)
+    row_width = max(math.sqrt(total_area) * 1.5, max(width for _, width, *_ in measured))
+
+    placed = {}
+    x = y = row_height = 0.0
+    for height, width, min_x, min_y, centers in measured:
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0.0, y + row_height + gap, 0.0
+        for node_id, (cx, cy) in centers.items():
+            placed[node_id] = (cx - min_x + x, cy - min_y + y)
+        x += width + gap
+        row_height = max(row_height, height)
+    return placed
+
+
+def _full_layout(graph, algorithm, direction, config) -> dict:
+    parts = []
+    for component in graph.components():
+        centers = _layered(graph, component, config, direction)
+        if algorithm == 'force' and len(component) > 2:
+            _force(graph, centers, set(component), config, _ideal_distance(graph, component, config))
+            _snap_to_grid(graph, centers, config)
+        parts.append(centers)
+    return _pack(graph, parts, config)
+
+
+def _incremental_layout(graph, free, algorithm, direction, config) -> dict:
+    centers = {}
+    for node_id in graph.ids:
+        if node_id not in free:
+            position = graph.nodes[node_id]['position']
+            width, height = graph.sizes[node_id]
+            centers[node_id] = (_number(position['x'], 0.0) + width / 2, _number(position['y'], 0.0) + height / 2)
+
+    right = max((x + graph.sizes[node_id][0] / 2 for node_id, (x, _) in centers.items()), default=0.0)
+    along = 0 if direction == 'LR' else 1
+    # Breadth-first from placed nodes so chains of new nodes follow their anchors
+    order = []
+    queue = deque(
+        node_id for node_id in graph.ids
+        if node_id in free and any(other in centers for other in graph.neighbours(node_id))
+    )
+    seen = set(queue)
+    for seed in [None] + graph.ids:
+        if seed is not None and (seed not in free or seed in seen):
+            continue
+        if seed is not None:
+            seen.add(seed)
+            queue.append(seed)
+        while queue:
+            node_id = queue.popleft()
+            order.append(node_id)
+            for other in graph.neighbours(node_id):
+                if other in free and other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+
+    for node_id in order:
+        preds = [other for other in graph.pred[node_id] if other in centers]
+        succs = [other for other in graph.succ[node_id] if other in centers]
+        size = graph.sizes[node_id]
+        linked = preds or succs
+        if linked:
+            mean = [sum(centers[other][axis] for other in linked) / len(linked) for axis in (0, 1)]
+            reach = max(graph.sizes[other][along] for other in linked) / 2 + config['LAYER_GAP'] + size[along] / 2
+            mean[along] += reach if preds else -reach
+            centers[node_id] = tuple(mean)
+        else:
+            centers[node_id] = (right + config['LAYER_GAP'] + size[0] / 2, size[1] / 2)
+            right += config['LAYER_GAP'] + size[0]
+
+    if algorithm == 'force':
+        ids = list(centers)
+        _force(graph, centers, set(free), config, _ideal_distance(graph, ids, config))
+    _separate(graph, centers, set(free), config)
+    return centers
+
+
+def _has_position(node) -> bool:
+    position = node.get('position')
+    return (
+        isinstance(position, dict)
+        and _number(position.get('x')) is not None
+        and _number(position.get('y')) is not None
+    )
+
+
+def layout_data(data, diagram_type, algorithm=None, direction='LR', incremental=False, node_ids=None):
+    """
+    Return ``(new_data, placed)``: a copy of ``data`` with new top-left
+    positions for the placed top-level nodes, and how many were placed.
+    """
+    config = get_layout_settings()
+    algorithm = algorithm or DEFAULT_ALGORITHMS.get(diagram_type, 'layered')
+    if algorithm not in ALGORITHMS:
+        raise LayoutError(f'algorithm must be one of: {", ".join(ALGORITHMS)}.')
+    if direction not in DIRECTIONS:
+        raise LayoutError(f'direction must be one of: {", ".join(DIRECTIONS)}.')
+
+    graph = _Graph(data)
+    if len(graph.ids) > config['MAX_NODES']:
+        raise LayoutError(f'Diagrams with more than {config["MAX_NODES"]} nodes cannot be laid out.')
+    if not graph.ids:
+        return data, 0
+
+    requested = {str(node_id) for node_id in node_ids or ()}
+    free = {
+        node_id for node_id in graph.ids
+        if node_id in requested or not _has_position(graph.nodes[node_id])
+    }
+    if incremental and len(free) < len(graph.ids):
+        centers = _incremental_layout(graph, free, algorithm, direction, config)
+    else:
+        centers = _full_layout(graph, algorithm, direction, config)
+        free = set(graph.ids)
+
+    nodes = []
+    for node in data['nodes']:
+        node_id = str(node.get('id')) if isinstance(node, dict) else None
+        if node_id in free:
+            x, y = centers[node_id]
+            width, height = graph.sizes[node_id]
+            node = {**node, 'position': {'x': round(x - width / 2, 1), 'y': round(y - height / 2, 1)}}
+        nodes.append(node)
+    return {**data, 'nodes': nodes}, len(free)
@@ -0,0 +1,147 @@
+"""
+Keep DiagramLink element references in step with diagram content.
+
+``source_element_id``/``target_element_id`` are free strings pointing into
+``Diagram.data``. When a diagram is saved, the element ids removed, restored
+or relabeled since the loaded revision are worked out in one pass over both
+documents; only links referencing those ids are loaded and updated in bulk.
+A save that does not touch linked elements costs no queries.
+
+What happens to links whose element disappeared is set by
+``DIAGRAMS_LINK_RECONCILIATION['ON_REMOVED']``:
+
+* ``flag``: mark them ``is_dangling`` (cleared again if the element comes back)
+* ``delete``: delete them
+* ``keep``: leave them alone
+
+``source_element_label`` follows the element's label when ``RELABEL`` is set.
+"""
+from django.conf import settings
+from django.db.models import Q
+
+from . import response_cache
+from .models import DiagramLink
+
+
+LINK_RECONCILIATION_DEFAULTS = {
+    'ON_REMOVED': 'flag',
+    'RELABEL': True,
+}
+
+POLICIES = ('flag', 'delete', 'keep')
+
+UPDATE_BATCH_SIZE = 500
+
+
+def get_link_reconciliation_settings() -> dict:
+    return {**LINK_RECONCILIATION_DEFAULTS, **getattr(settings, 'DIAGRAMS_LINK_RECONCILIATION', {})}
+
+
+def _label(element) -> str:
+    data = element.get('data') if isinstance(element.get('data'), dict) else {}
+    label = data.get('label', element.get('label', ''))
+    return '' if label is None else str(label)
+
+
+def element_labels(data) -> dict:
+    """``{element_id: label}`` for every node and edge of a diagram document."""
+    labels = {}
+    if not isinstance(data, dict):
+        return labels
+    for kind in ('nodes', 'edges'):
+        items = data.get(kind)
+        if isinstance(items, list):
+            for element in items:
+                if isinstance(element, dict) and element.get('id') is not None:
+                    labels[str(element['id'])] = _label(element)
+    return labels
+
+
+def changed_element_ids(previous, current) -> set:
+    """Ids added, removed or relabeled between two documents."""
+    before, after = element_labels(previous), element_labels(current)
+    changed = before.keys() ^ after.keys()
+    changed.update(element_id for element_id, label in after.items() if before.get(element_id, label) != label)
+    return changed
+
+
+def reconcile_links(diagram_id, project_id, labels, element_ids=None) -> dict:
+    """
+    Bring links into or out of ``diagram_id`` in line with its current
+    ``labels``. With ``element_ids`` only links referencing those ids are
+    considered. Returns counts of flagged, restored, deleted and relabeled links.
+    """
+    config = get_link_reconciliation_settings()
+    if config['ON_REMOVED'] not in POLICIES:
+        raise ValueError(f"DIAGRAMS_LINK_RECONCILIATION['ON_REMOVED'] must be one of {POLICIES}.")
+
+    source_filter, target_filter = Q(source_diagram_id=diagram_id), Q(target_diagram_id=diagram_id)
+    if element_ids is not None:
+        if not element_ids:
+            return {}
+        source_filter &= Q(source_element_id__in=element_ids)
+        target_filter &= Q(target_element_id__in=element_ids)
+    rows = DiagramLink.objects.filter(source_filter | target_filter).values_list(
+        'id', 'source_diagram_id', 'source_element_id', 'source_element_label',
+        'target_diagram_id', 'target_element_id', 'is_dangling',
+        'source_diagram__project_id', 'target_diagram__project_id',
+    )
+
+    # A link's ends live in two diagrams; an end in the other diagram counts as present
+    flag, restore, delete, relabel = [], [], [], []
+    projects = set()
+    for (link_id, source_id, source_element, source_label, target_id, target_element, dangling,
+         source_project, target_project) in rows:
+        source_present = source_id != diagram_id or source_element in labels
+        target_present = target_id != diagram_id or not target_element or target_element in labels
+        present = source_present and target_present
+        changed = False
+
+        if not present and config['ON_REMOVED'] == 'delete':
+            delete.append(link_id)
+            projects.update((source_project, target_project))
+            continue
+        if not present and not dangling and config['ON_REMOVED'] == 'flag':
+            flag.append(link_id)
+            changed = True
+        elif present and dangling:
+            restore.append(link_id)
+            changed = True
+
+        if (config['RELABEL'] and source_id == diagram_id and source_element in labels
+                and labels[source_element] != source_label):
+            relabel.append(DiagramLink(id=link_id, source_element_label=labels[source_element][:255]))
+            changed = True
+        if changed:
+            projects.update((source_project, target_project))
+
+    for ids, value in ((flag, True), (restore, False)):
+        for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+            DiagramLink.objects.filter(id__in=ids[start:start + UPDATE_BATCH_SIZE]).update(is_dangling=value)
+    if relabel:
+        DiagramLink.objects.bulk_update(relabel, ['source_element_label'], batch_size=UPDATE_BATCH_SIZE)
+    with response_cache.link_invalidation_handled():
+        for start in range(0, len(delete), UPDATE_BATCH_SIZE):
+            DiagramLink.objects.filter(id__in=delete[start:start + UPDATE_BATCH_SIZE]).delete()
+
+    # update() and bulk_update() send no signals, invalidate the cached link lists here
+    projects.add(project_id)
+    if flag or restore or relabel or delete:
+        for linked_project in projects:
+            response_cache.bump('project', linked_project)
+
+    return {'flagged': len(flag), 'restored': len(restore), 'deleted': len(delete), 'relabeled': len(relabel)}
+
+
+def reconcile_saved_diagram(diagram, previous=None) -> dict:
+    """
+    Reconcile after ``diagram`` was saved. ``previous`` is the document it was
+    loaded with; only elements changed since then are checked. Without it
+    (e.g. `data` was deferred) all links of the diagram are checked.
+    """
+    if previous is diagram.data:
+        return {}
+    labels = element_labels(diagram.data)
+    if previous is None:
+        return reconcile_links(diagram.id, diagram.project_id, labels)
+    return reconcile_links(diagram.id, diagram.project_id, labels, changed_element_ids(previous, diagram.data))
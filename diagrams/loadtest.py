@@ -0,0 +1,389 @@
+"""
+Load generator replaying editor traffic against a running server.
+
+Used by the ``loadtest`` management command. Everything goes through the
+public API routes over HTTP, so the server under test runs as deployed
+(runserver, gunicorn or an ASGI server) with its own database:
+
+- a guest owner creates a project with ``diagrams`` diagrams and an invite
+  for every user joining it (invites are single-use);
+- ``editors`` virtual users log in as guests and accept an invite, then
+  repeatedly pick a diagram, take its lock, autosave every
+  ``autosave_interval`` seconds ``saves_per_session`` times, release the lock
+  and think for ``think_time`` seconds (+-50%). With more editors than
+  diagrams they contend for locks; a lock held by someone else counts as a
+  conflict and the editor polls it like the frontend does;
+- every ``burst_interval`` seconds (once if 0) a burst of ``guests`` visitors
+  logs in as guests, looks at an invite and accepts it.
+
+Each virtual user keeps one HTTP/1.1 keep-alive connection. All of them
+come from this machine's address, so per-IP throttles see one client and
+guest bursts beyond the ``guest_ip`` rate are answered with 429. With
+``forwarded_for`` every user sends its own ``X-Forwarded-For`` address
+instead; the server only uses it when it is configured to trust one proxy
+(``REST_FRAMEWORK['NUM_PROXIES'] = 1``), which a test server can be. Editors
+whose login is throttled retry after their think time.
+Only the standard library is used.
+"""
+import asyncio
+import gzip
+import json
+import random
+import ssl
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from urllib.parse import urlsplit
+
+
+@dataclass
+class LoadTestConfig:
+    base_url: str = 'http://127.0.0.1:8000'
+    editors: int = 10
+    diagrams: int = 3
+    nodes: int = 200
+    duration: float = 60.0
+    autosave_interval: float = 0.4
+    saves_per_session: int = 10
+    think_time: float = 2.0
+    guests: int = 20
+    burst_interval: float = 0.0
+    timeout: float = 30.0
+    forwarded_for: bool = False
+    seed: int = None
+
+
+class LoadTestError(Exception):
+    pass
+
+
+class _Connection:
+    """One keep-alive HTTP/1.1 connection, reopened when the server closes it."""
+
+    def __init__(self, base_url: str, timeout: float):
+        url = urlsplit(base_url)
+        self.host = url.hostname or '127.0.0.1'
+        self.ssl = ssl.create_default_context() if url.scheme == 'https' else None
+        self.port = url.port or (443 if self.ssl else 80)
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.headers = {}
+        self._reader = self._writer = None
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._reader = self._writer = None
+
+    async def request(self, method: str, path: str, body=None):
+        """Return ``(status, payload)``; ``payload`` is the decoded JSON body or None."""
+        payload = b'' if body is None else json.dumps(body).encode()
+        head = [
+            f'{method} {self.prefix}{path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Accept: application/json',
+            'Accept-Encoding: gzip',
+            f'Content-Length: {len(payload)}',
+            *(f'{name}: {value}' for name, value in self.headers.items()),
+        ]
+        if payload:
+            head.append('Content-Type: application/json')
+        raw = ('\r\n'.join(head) + '\r\n\r\n').encode() + payload
+
+        reused = self._writer is not None
+        try:
+            return await asyncio.wait_for(self._exchange(raw, method), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            if not reused:
+                raise
+        # The server dropped an idle keep-alive connection; retry once on a fresh one
+        return await asyncio.wait_for(self._exchange(raw, method), self.timeout)
+
+    async def _exchange(self, raw: bytes, method: str):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        self._writer.write(raw)
+        await self._writer.drain()
+
+        status_line, *header_lines = (await self._reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        for line in header_lines:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            content = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = await self._read_chunked()
+        elif 'content-length' in headers:
+            content = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            content = await self._reader.read()
+            headers['connection'] = 'close'
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+
+        if headers.get('content-encoding') == 'gzip':
+            content = gzip.decompress(content)
+        data = None
+        if content and headers.get('content-type', '').startswith('application/json'):
+            data = json.loads(content)
+        return status, data
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            size = int((await self._reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                await self._reader.readuntil(b'\r\n')
+                return b''.join(chunks)
+            chunks.append(await self._reader.readexactly(size))
+            await self._reader.readexactly(2)
+
+
+class Stats:
+    def __init__(self):
+        # operation -> [seconds]
+        self.latencies = defaultdict(list)
+        # operation -> Counter of status codes (0 for connection errors)
+        self.statuses = defaultdict(Counter)
+        self.lock_acquired = 0
+        self.lock_conflicts = 0
+
+    def record(self, operation: str, status: int, seconds: float) -> None:
+        self.latencies[operation].append(seconds)
+        self.statuses[operation][status] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        operations = {}
+        for operation, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            statuses = self.statuses[operation]
+            errors = sum(count for code, count in statuses.items() if code == 0 or code >= 400)
+            operations[operation] = {
+                'requests': len(ordered),
+                'rps': len(ordered) / elapsed if elapsed else 0.0,
+                'p50': _percentile(ordered, 50),
+                'p90': _percentile(ordered, 90),
+                'p99': _percentile(ordered, 99),
+                'max': ordered[-1],
+                'errors': errors,
+                'error_rate': errors / len(ordered),
+                'statuses': dict(sorted(statuses.items())),
+            }
+        total = sum(entry['requests'] for entry in operations.values())
+        errors = sum(entry['errors'] for entry in operations.values())
+        attempts = self.lock_acquired + self.lock_conflicts
+        return {
+            'elapsed': elapsed,
+            'requests': total,
+            'rps': total / elapsed if elapsed else 0.0,
+            'errors': errors,
+            'error_rate': errors / total if total else 0.0,
+            'lock_acquired': self.lock_acquired,
+            'lock_conflicts': self.lock_conflicts,
+            'lock_conflict_rate': self.lock_conflicts / attempts if attempts else 0.0,
+            'operations': operations,
+        }
+
+
+def _percentile(ordered, percent: float) -> float:
+    # Nearest rank
+    index = max(0, min(len(ordered) - 1, -(-len(ordered) * percent // 100) - 1))
+    return ordered[int(index)]
+
+
+def diagram_document(nodes: int, rng: random.Random) -> dict:
+    """A document shaped like the editor's: positioned, labelled nodes and edges between them."""
+    return {
+        'nodes': [
+            {
+                'id': f'n{i}',
+                'type': 'task',
+                'position': {'x': (i % 20) * 180, 'y': (i // 20) * 120},
+                'data': {'label': f'Task {i}'},
+            }
+            for i in range(nodes)
+        ],
+        'edges': [
+            {'id': f'e{i}', 'source': f'n{i}', 'target': f'n{i + 1}'}
+            for i in range(nodes - 1) if rng.random() < 0.8
+        ],
+    }
+
+
+class LoadTest:
+    def __init__(self, config: LoadTestConfig):
+        self.config = config
+        self.stats = Stats()
+        self.rng = random.Random(config.seed)
+        self.project_id = None
+        self.diagrams = {}
+        self._owner = None
+        self._owner_lock = asyncio.Lock()
+        self._clients = 0
+        self._deadline = 0.0
+
+    def _connection(self) -> _Connection:
+        conn = _Connection(self.config.base_url, self.config.timeout)
+        if self.config.forwarded_for:
+            self._clients += 1
+            conn.headers['X-Forwarded-For'] = f'10.{self._clients >> 16 & 255}.{self._clients >> 8 & 255}.{self._clients & 255}'
+        return conn
+
+    async def _call(self, conn: _Connection, operation: str, method: str, path: str, body=None):
+        start = time.perf_counter()
+        try:
+            status, data = await conn.request(method, path, body)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            await conn.close()
+            status, data = 0, None
+        self.stats.record(operation, status, time.perf_counter() - start)
+        return status, data
+
+    async def _login(self, conn: _Connection, operation: str = 'guest_login'):
+        """Log ``conn`` in as a new guest; returns the username or None."""
+        status, data = await self._call(conn, operation, 'POST', '/api/auth/guest')
+        if status != 201:
+            return None
+        conn.headers['Authorization'] = f"Bearer {data['access_token']}"
+        status, data = await self._call(conn, 'current_user', 'GET', '/api/auth/me')
+        return data['username'] if status == 200 else None
+
+    # --- Scenarios ---
+
+    async def setup(self) -> None:
+        conn = self._owner = self._connection()
+        if await self._login(conn) is None:
+            raise LoadTestError('Could not log in the owner as a guest (is the server running?).')
+        status, data = await self._call(conn, 'project_create', 'POST', '/api/projects/', {
+            'name': f'Load test {time.strftime("%Y-%m-%d %H:%M:%S")}',
+            'description': 'Created by manage.py loadtest.',
+        })
+        if status != 201:
+            raise LoadTestError(f'Creating the project failed with status {status}.')
+        self.project_id = data['id']
+        for index in range(max(1, self.config.diagrams)):
+            document = diagram_document(self.config.nodes, self.rng)
+            status, data = await self._call(conn, 'diagram_create', 'POST', f'/api/projects/{self.project_id}/diagrams/', {
+                'name': f'Diagram {index + 1}', 'diagram_type': 'bpmn', 'data': document,
+            })
+            if status != 201:
+                raise LoadTestError(f'Creating a diagram failed with status {status}.')
+            self.diagrams[data['id']] = document
+        if await self._invite() is None:
+            raise LoadTestError('Creating an invite failed.')
+
+    async def _invite(self):
+        """A fresh invite token from the owner, or None."""
+        async with self._owner_lock:
+            status, data = await self._call(self._owner, 'invite_create', 'POST', f'/api/projects/{self.project_id}/invite', {
+                'expires_in_hours': 24,
+            })
+        return data['token'] if status == 201 else None
+
+    async def _join(self, conn: _Connection) -> bool:
+        token = await self._invite()
+        if token is None:
+            return False
+        await self._call(conn, 'invite_info', 'GET', f'/api/invite/{token}')
+        status, _ = await self._call(conn, 'invite_accept', 'POST', f'/api/invite/{token}/accept')
+        return status == 200
+
+    async def _think(self, seconds: float) -> None:
+        await asyncio.sleep(min(seconds * self.rng.uniform(0.5, 1.5), max(0.0, self._deadline - time.monotonic())))
+
+    async def editor(self, index: int) -> None:
+        conn = self._connection()
+        try:
+            # Spread logins over the first autosave interval rather than a single spike
+            await asyncio.sleep(self.rng.uniform(0, self.config.autosave_interval))
+            username = await self._login(conn)
+            while username is None:
+                if time.monotonic() >= self._deadline:
+                    return
+                await self._think(self.config.think_time)
+                username = await self._login(conn)
+            if not await self._join(conn):
+                return
+            while time.monotonic() < self._deadline:
+                diagram_id = self.rng.choice(list(self.diagrams))
+                status, lock = await self._call(conn, 'lock_acquire', 'POST', f'/api/diagrams/{diagram_id}/lock')
+                if status != 200:
+                    await self._think(self.config.think_time)
+                    continue
+                if (lock.get('user') or {}).get('username') != username:
+                    self.stats.lock_conflicts += 1
+                    # Read-only view while waiting, polling the lock like the editor
+                    await self._call(conn, 'diagram_get', 'GET', f'/api/diagrams/{diagram_id}')
+                    await self._think(self.config.think_time)
+                    await self._call(conn, 'lock_status', 'GET', f'/api/diagrams/{diagram_id}/lock')
+                    continue
+                self.stats.lock_acquired += 1
+                await self._edit(conn, diagram_id)
+                await self._call(conn, 'lock_release', 'DELETE', f'/api/diagrams/{diagram_id}/lock')
+                await self._think(self.config.think_time)
+        finally:
+            await conn.close()
+
+    async def _edit(self, conn: _Connection, diagram_id: int) -> None:
+        await self._call(conn, 'diagram_get', 'GET', f'/api/diagrams/{diagram_id}')
+        await self._call(conn, 'diagram_links', 'GET', f'/api/diagrams/{diagram_id}/links')
+        document = self.diagrams[diagram_id]
+        for _ in range(max(1, self.config.saves_per_session)):
+            if time.monotonic() >= self._deadline:
+                return
+            await asyncio.sleep(self.config.autosave_interval)
+            if document['nodes']:
+                # A drag: one node moves a little
+                node = self.rng.choice(document['nodes'])
+                node['position'] = {
+                    'x': node['position']['x'] + self.rng.randint(-40, 40),
+                    'y': node['position']['y'] + self.rng.randint(-40, 40),
+                }
+            await self._call(conn, 'diagram_save', 'PUT', f'/api/diagrams/{diagram_id}', {'data': document})
+
+    async def guest_bursts(self) -> None:
+        while True:
+            visitors = [self._visitor() for _ in range(self.config.guests)]
+            await asyncio.gather(*visitors)
+            if self.config.burst_interval <= 0 or time.monotonic() + self.config.burst_interval >= self._deadline:
+                return
+            await asyncio.sleep(self.config.burst_interval)
+
+    async def _visitor(self) -> None:
+        conn = self._connection()
+        try:
+            if await self._login(conn) is not None:
+                await self._join(conn)
+        finally:
+            await conn.close()
+
+    async def run(self) -> dict:
+        try:
+            await self.setup()
+            # Setup requests are not part of the measured traffic
+            self.stats = Stats()
+            start = time.monotonic()
+            self._deadline = start + self.config.duration
+            await asyncio.gather(
+                *(self.editor(index) for index in range(self.config.editors)),
+                self.guest_bursts(),
+            )
+        finally:
+            if self._owner is not None:
+                await self._owner.close()
+        summary = self.stats.summary(time.monotonic() - start)
+        summary['project_id'] = self.project_id
+        return summary
+
+
+def run(config: LoadTestConfig) -> dict:
+    return asyncio.run(LoadTest(config).run())
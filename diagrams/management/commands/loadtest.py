@@ -0,0 +1,70 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from diagrams import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay editor traffic against a running server (see diagrams.loadtest): editors '
+        'autosaving under diagram locks and bursts of guest logins and invite acceptances. '
+        'Reports throughput, latency percentiles, error rates and lock conflicts.'
+    )
+
+    def add_arguments(self, parser):
+        defaults = loadtest.LoadTestConfig()
+        parser.add_argument('--base-url', default=defaults.base_url, help='Server to test.')
+        parser.add_argument('--editors', type=int, default=defaults.editors, help='Concurrent editors.')
+        parser.add_argument('--diagrams', type=int, default=defaults.diagrams, help='Diagrams the editors share.')
+        parser.add_argument('--nodes', type=int, default=defaults.nodes, help='Nodes per diagram.')
+        parser.add_argument('--duration', type=float, default=defaults.duration, help='Seconds to run.')
+        parser.add_argument('--autosave-interval', type=float, default=defaults.autosave_interval, help='Seconds between autosaves.')
+        parser.add_argument('--saves-per-session', type=int, default=defaults.saves_per_session, help='Autosaves per lock held.')
+        parser.add_argument('--think-time', type=float, default=defaults.think_time, help='Mean seconds between editing sessions.')
+        parser.add_argument('--guests', type=int, default=defaults.guests, help='Guests per login burst.')
+        parser.add_argument('--burst-interval', type=float, default=defaults.burst_interval, help='Seconds between guest bursts, 0 for one.')
+        parser.add_argument('--timeout', type=float, default=defaults.timeout, help='Seconds before a request counts as failed.')
+        parser.add_argument(
+            '--forwarded-for', action='store_true',
+            help='Give every user its own X-Forwarded-For address (the server has to trust one proxy).',
+        )
+        parser.add_argument('--seed', type=int, default=None, help='Seed for repeatable runs.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        config = loadtest.LoadTestConfig(**{
+            field: options[field] for field in loadtest.LoadTestConfig.__dataclass_fields__
+        })
+        self.stdout.write(
+            f'{config.editors} editor(s) on {config.diagrams} diagram(s), {config.guests} guest(s) per burst, '
+            f'{config.duration:g}s against {config.base_url}'
+        )
+        try:
+            summary = loadtest.run(config)
+        except loadtest.LoadTestError as exc:
+            raise CommandError(str(exc))
+
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write(
+            f'{"operation":<16}{"requests":>9}{"req/s":>9}{"p50 ms":>9}{"p90 ms":>9}'
+            f'{"p99 ms":>9}{"max ms":>9}{"errors":>8}  statuses'
+        )
+        for operation, entry in summary['operations'].items():
+            statuses = ' '.join(f'{code}:{count}' for code, count in entry['statuses'].items())
+            self.stdout.write(
+                f"{operation:<16}{entry['requests']:>9}{entry['rps']:>9.1f}{entry['p50'] * 1000:>9.1f}"
+                f"{entry['p90'] * 1000:>9.1f}{entry['p99'] * 1000:>9.1f}{entry['max'] * 1000:>9.1f}"
+                f"{entry['error_rate']:>8.1%}  {statuses}"
+            )
+        self.stdout.write(
+            f"Lock acquisitions: {summary['lock_acquired']}, conflicts: {summary['lock_conflicts']} "
+            f"({summary['lock_conflict_rate']:.1%})"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['requests']} requests in {summary['elapsed']:.1f}s: {summary['rps']:.1f} req/s, "
+            f"error rate {summary['error_rate']:.1%} (project {summary['project_id']})"
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from diagrams import deletion
+from diagrams.models import DeletionTask
+
+
+class Command(BaseCommand):
+    help = (
+        'Purge projects and diagrams marked as deleted: pending tasks, tasks stalled '
+        'for longer than STALE_AFTER and, with --retry-failed, failed ones (see DIAGRAMS_DELETION).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Run failed tasks again.')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            DeletionTask.objects.filter(status=DeletionTask.STATUS_FAILED).update(
+                status=DeletionTask.STATUS_PENDING, error='',
+            )
+
+        done = failed = 0
+        for task_id in deletion.pending_task_ids():
+            task = deletion.process(task_id)
+            if task is None:
+                continue
+            if task.status == DeletionTask.STATUS_DONE:
+                done += 1
+            else:
+                failed += 1
+            self.stdout.write(
+                f'{task.kind} {task.object_id} ({task.name}): {task.status}, '
+                f'{task.purged}/{task.total} diagrams, {task.rows_deleted} rows'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Purged: {done}, failed: {failed}.'))
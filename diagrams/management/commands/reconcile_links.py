@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from diagrams import link_reconciliation
+from diagrams.models import Diagram, DiagramLink
+
+
+class Command(BaseCommand):
+    help = (
+        'Check element links of existing diagrams against their content and flag, '
+        'delete or relabel them (see DIAGRAMS_LINK_RECONCILIATION).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, action='append', help='Only diagrams of this project (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=100, help='Diagrams loaded per batch.')
+
+    def handle(self, *args, **options):
+        # Only diagrams that are referenced by an element of some link need a look
+        diagram_ids = set(DiagramLink.objects.values_list('source_diagram_id', flat=True))
+        diagram_ids.update(
+            DiagramLink.objects.exclude(target_element_id__isnull=True)
+            .exclude(target_element_id='')
+            .values_list('target_diagram_id', flat=True)
+        )
+        diagrams = Diagram.objects.filter(id__in=diagram_ids)
+        if options['project']:
+            diagrams = diagrams.filter(project_id__in=options['project'])
+        ids = sorted(diagrams.values_list('id', flat=True))
+
+        totals = {'flagged': 0, 'restored': 0, 'deleted': 0, 'relabeled': 0}
+        batch_size = max(1, options['batch_size'])
+        for start in range(0, len(ids), batch_size):
+            batch = Diagram.objects.filter(id__in=ids[start:start + batch_size]).only('id', 'project_id', 'data')
+            with transaction.atomic():
+                for diagram in batch:
+                    counts = link_reconciliation.reconcile_links(
+                        diagram.id, diagram.project_id, link_reconciliation.element_labels(diagram.data)
+                    )
+                    for key, value in counts.items():
+                        totals[key] += value
+            self.stdout.write(f'Checked {min(start + batch_size, len(ids))}/{len(ids)} diagrams')
+
+        self.stdout.write(self.style.SUCCESS(
+            'Links flagged: {flagged}, restored: {restored}, deleted: {deleted}, relabeled: {relabeled}.'.format(**totals)
+        ))
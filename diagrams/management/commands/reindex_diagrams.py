@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from diagrams import spatial
+from diagrams.models import Diagram
+
+
+class Command(BaseCommand):
+    help = 'Build or refresh the spatial index of diagrams (see DIAGRAMS_SPATIAL_INDEX).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('diagram_ids', nargs='*', type=int, help='Only reindex these diagrams.')
+
+    def handle(self, *args, **options):
+        diagrams = Diagram.objects.order_by('id')
+        if options['diagram_ids']:
+            diagrams = diagrams.filter(id__in=options['diagram_ids'])
+
+        written = 0
+        for diagram_id in diagrams.values_list('id', flat=True):
+            # One diagram in memory at a time
+            written += spatial.reindex_diagram(Diagram.objects.get(id=diagram_id))
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} index rows.'))
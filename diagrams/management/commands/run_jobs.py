@@ -0,0 +1,110 @@
+import logging
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from diagrams import jobs
+
+
+logger = logging.getLogger('diagrams.jobs')
+
+STATS_INTERVAL = 30
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background jobs (see DIAGRAMS_JOBS): --threads worker threads in each of '
+        '--processes processes. Logs queue depth and wait every 30 seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1, help='Worker threads per process.')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to start.')
+        parser.add_argument('--batch', type=int, default=1, help='Jobs claimed at a time by each thread.')
+        parser.add_argument('--name', action='append', dest='names', help='Only run jobs with this name (repeatable).')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is ready.')
+        parser.add_argument('--stats', action='store_true', help='Print queue depth and wait per job name and exit.')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, entry in sorted(jobs.stats().items()):
+                self.stdout.write(
+                    f"{name}: ready {entry['ready']}, delayed {entry['queued'] - entry['ready']}, "
+                    f"running {entry['running']}, oldest wait {entry['oldest_wait']}s"
+                )
+            return
+        if options['processes'] > 1:
+            return self._supervise(options)
+
+        self.stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.stop.set())
+
+        threads = [
+            threading.Thread(target=self._work, args=(index, options), name=f'jobs-{index}', daemon=True)
+            for index in range(max(1, options['threads']))
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'Running {len(threads)} job worker thread(s) as {jobs.worker_id()}')
+
+        last_stats = last_maintenance = 0.0
+        while any(thread.is_alive() for thread in threads):
+            now = time.monotonic()
+            if now - last_maintenance >= MAINTENANCE_INTERVAL:
+                last_maintenance = now
+                jobs.requeue_stale()
+                jobs.prune()
+            if now - last_stats >= STATS_INTERVAL:
+                last_stats = now
+                for name, entry in jobs.stats().items():
+                    logger.info(
+                        'jobs %s: ready=%s running=%s oldest_wait=%.1fs',
+                        name, entry['ready'], entry['running'], entry['oldest_wait'],
+                    )
+            close_old_connections()
+            self.stop.wait(1)
+        connection.close()
+
+    def _work(self, index, options) -> None:
+        worker_id = jobs.worker_id(f'/{index}')
+        poll_interval = jobs.get_jobs_settings()['POLL_INTERVAL']
+        try:
+            while not self.stop.is_set():
+                claimed = jobs.claim(worker_id, limit=max(1, options['batch']), names=options['names'])
+                for job in claimed:
+                    # A job is finished even when asked to stop, unclaimed ones stay queued
+                    jobs.run(job)
+                if not claimed:
+                    if options['once']:
+                        return
+                    self.stop.wait(poll_interval)
+        finally:
+            connection.close()
+
+    def _supervise(self, options) -> None:
+        """Start one child per process and forward termination to them."""
+        argv = [sys.executable, '-m', 'django', 'run_jobs', '--threads', str(options['threads']),
+                '--batch', str(options['batch'])]
+        for name in options['names'] or []:
+            argv += ['--name', name]
+        if options['once']:
+            argv.append('--once')
+        # Children inherit DJANGO_SETTINGS_MODULE from manage.py
+        children = [subprocess.Popen(argv) for _ in range(options['processes'])]
+
+        def terminate(*_):
+            for child in children:
+                if child.poll() is None:
+                    child.send_signal(signal.SIGTERM)
+
+        signal.signal(signal.SIGINT, terminate)
+        signal.signal(signal.SIGTERM, terminate)
+        for child in children:
+            child.wait()
@@ -0,0 +1,369 @@
+"""
+In-process metrics with a Prometheus text-format endpoint.
+
+Counters and fixed-bucket histograms are kept in a per-process registry
+guarded by a single lock, so recording a value is a dict update. When
+``DIAGRAMS_METRICS['MULTIPROCESS_DIR']`` is set every worker also writes a
+snapshot of its registry to ``<dir>/metrics-<pid>.json`` (at most once per
+``FLUSH_INTERVAL`` seconds and at exit; a failed write is logged, never
+raised to the code recording a value) and the endpoint sums the snapshots
+of all workers. As with prometheus_client's multiprocess mode, the directory
+should be emptied when the service is (re)started.
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+
+from . import query_observers
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'HTTP requests by URL name, method and status code.', None,
+    ),
+    'http_request_duration_seconds': (
+        'histogram', 'Request latency by URL name and method.', LATENCY_BUCKETS,
+    ),
+    'http_request_db_queries': (
+        'histogram', 'Database queries per request by URL name.', QUERY_COUNT_BUCKETS,
+    ),
+    'diagram_lock_acquisitions_total': (
+        'counter', 'Diagram locks acquired or refreshed by their holder.', None,
+    ),
+    'diagram_lock_conflicts_total': (
+        'counter', 'Lock requests rejected because another user holds the lock.', None,
+    ),
+    'diagram_autosave_bytes': (
+        'histogram', 'Size of diagram update request bodies.', SIZE_BUCKETS,
+    ),
+    'diagram_saves_total': (
+        'counter', 'Diagram updates by outcome: saved, coalesced (written later) or unchanged (nothing written).', None,
+    ),
+    'diagram_coalesced_flushes_total': (
+        'counter', 'Diagram rows written by the write coalescer.', None,
+    ),
+    'cache_requests_total': (
+        'counter', 'Response cache lookups by cache name and result (hit/miss).', None,
+    ),
+    'response_compression_total': (
+        'counter', 'Compressed responses by encoding and cache result (hit/miss/none).', None,
+    ),
+    'response_compressed_bytes': (
+        'histogram', 'Size of response bodies after compression.', SIZE_BUCKETS,
+    ),
+    'jobs_total': (
+        'counter', 'Background jobs run by job name and outcome (done/retry/failed).', None,
+    ),
+    'job_wait_seconds': (
+        'histogram', 'Time background jobs waited between becoming ready and being claimed.', LATENCY_BUCKETS,
+    ),
+    'job_duration_seconds': (
+        'histogram', 'Background job run time by job name.', LATENCY_BUCKETS,
+    ),
+    'jobs_queued': (
+        'gauge', 'Background jobs by job name and state (ready/delayed/running).', None,
+    ),
+    'jobs_oldest_wait_seconds': (
+        'gauge', 'How long the oldest ready job of each name has been waiting.', None,
+    ),
+}
+
+# Functions yielding (name, labels, value) gauge samples, called on every scrape
+_collectors = []
+
+
+def get_metrics_settings() -> dict:
+    return {**METRICS_DEFAULTS, **getattr(settings, 'DIAGRAMS_METRICS', {})}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # (directory, interval), read from the settings on first use
+        self._flush_settings = None
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = METRICS[name][2]
+        key = (name, _label_key(labels))
+        index = len(buckets)
+        for position, bound in enumerate(buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket (non-cumulative) counts followed by the sum.
+                histogram = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += value
+        self._maybe_flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self._histograms.items()],
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    # --- multi-process support ---
+
+    def _snapshot_path(self, directory) -> str:
+        return os.path.join(directory, f'metrics-{os.getpid()}.json')
+
+    def _maybe_flush(self) -> None:
+        if self._flush_settings is None:
+            config = get_metrics_settings()
+            self._flush_settings = (config['MULTIPROCESS_DIR'], config['FLUSH_INTERVAL'])
+        directory, interval = self._flush_settings
+        if not directory or time.monotonic() - self._last_flush < interval:
+            return
+        # One thread writes the snapshot, the others go on without waiting
+        if not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self._last_flush >= interval:
+                self._write_snapshot(directory)
+        except Exception:
+            logger.exception('Writing the metrics snapshot failed')
+        finally:
+            self._flush_lock.release()
+
+    def flush(self) -> None:
+        directory = get_metrics_settings()['MULTIPROCESS_DIR']
+        if not directory:
+            return
+        with self._flush_lock:
+            self._write_snapshot(directory)
+
+    def _write_snapshot(self, directory) -> None:
+        # Called with self._flush_lock held
+        self._last_flush = time.monotonic()
+        path = self._snapshot_path(directory)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(tmp_path, path)
+
+    def collect(self) -> dict:
+        """Return counters and histograms summed over all worker processes."""
+        snapshots = [self.snapshot()]
+        directory = get_metrics_settings()['MULTIPROCESS_DIR']
+        if directory:
+            own_path = self._snapshot_path(directory)
+            for filename in os.listdir(directory):
+                path = os.path.join(directory, filename)
+                if not filename.endswith('.json') or path == own_path:
+                    continue
+                try:
+                    with open(path) as fh:
+                        snapshots.append(json.load(fh))
+                except (OSError, ValueError):
+                    continue
+
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+                else:
+                    histograms[key] = list(values)
+        return {'counters': counters, 'histograms': histograms}
+
+
+registry = MetricsRegistry()
+inc = registry.inc
+observe = registry.observe
+
+
+def _forget_flush_settings(setting, **kwargs):
+    if setting == 'DIAGRAMS_METRICS':
+        registry._flush_settings = None
+
+
+setting_changed.connect(_forget_flush_settings, dispatch_uid='diagrams_metrics_settings')
+
+
+def collector(func):
+    """Register ``func`` to provide gauge samples read at scrape time (e.g. from the database)."""
+    _collectors.append(func)
+    return func
+
+
+def collect_gauges() -> dict:
+    gauges = {}
+    for func in _collectors:
+        for name, labels, value in func():
+            gauges[(name, _label_key(labels))] = value
+    return gauges
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        registry.flush()
+    except Exception:
+        pass
+
+
+# --- Prometheus exposition ---
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{key}="' + value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') + '"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus(collected: dict) -> str:
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if metric_type in ('counter', 'gauge'):
+            samples = collected['counters'] if metric_type == 'counter' else collected.get('gauges', {})
+            for (metric, labels), value in sorted(samples.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            continue
+
+        for (metric, labels), values in sorted(collected['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + [math.inf], values[:-1]):
+                cumulative += count
+                bucket_labels = labels + (('le', _format_value(float(bound))),)
+                lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(values[-1])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    config = get_metrics_settings()
+    if not config['ENABLED']:
+        return HttpResponseNotFound()
+    allowed_ips = config['ALLOWED_IPS']
+    if allowed_ips is not None and request.META.get('REMOTE_ADDR') not in allowed_ips:
+        return HttpResponseForbidden()
+    collected = registry.collect()
+    # Gauges describe shared state (e.g. the job table), every process reports the same values
+    collected['gauges'] = collect_gauges()
+    return HttpResponse(
+        render_prometheus(collected),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+# --- Middleware ---
+
+class _QueryCounter:
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Record request count, latency and DB query count per URL name."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_metrics_settings()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with query_observers.observe(counter):
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, counter.count)
+        return response
+
+    async def __acall__(self, request):
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with query_observers.observe(counter):
+            response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, counter.count)
+        return response
+
+    def _record(self, request, response, duration: float, query_count: int) -> None:
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        if view == 'metrics':
+            return
+
+        registry.inc('http_requests_total', view=view, method=request.method, status=response.status_code)
+        registry.observe('http_request_duration_seconds', duration, view=view, method=request.method)
+        registry.observe('http_request_db_queries', query_count, view=view)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagrams', '0006_guest_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagram',
+            name='revision',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_rtree(apps, schema_editor):
+    # Only SQLite has the R*Tree module; other backends query the bbox columns.
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS diagrams_element_rtree '
+            'USING rtree(id, min_d, max_d, min_x, max_x, min_y, max_y)'
+        )
+
+
+def drop_rtree(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS diagrams_element_rtree')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagrams', '0009_revoked_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagramElementIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('node', 'Node'), ('edge', 'Edge')], max_length=4)),
+                ('element_id', models.CharField(max_length=100)),
+                ('source', models.CharField(blank=True, default='', max_length=100)),
+                ('target', models.CharField(blank=True, default='', max_length=100)),
+                ('payload', models.TextField()),
+                ('min_x', models.FloatField(blank=True, null=True)),
+                ('min_y', models.FloatField(blank=True, null=True)),
+                ('max_x', models.FloatField(blank=True, null=True)),
+                ('max_y', models.FloatField(blank=True, null=True)),
+                ('digest', models.CharField(max_length=40)),
+                ('diagram', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='element_index', to='diagrams.diagram')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['diagram', 'kind', 'element_id'], name='diagrams_di_diagram_83fd66_idx'), models.Index(fields=['diagram', 'kind', 'source'], name='diagrams_di_diagram_8d674a_idx'), models.Index(fields=['diagram', 'kind', 'target'], name='diagrams_di_diagram_b6dab6_idx')],
+            },
+        ),
+        migrations.RunPython(create_rtree, drop_rtree),
+    ]
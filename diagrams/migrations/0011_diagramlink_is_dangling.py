@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagrams', '0010_diagram_element_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagramlink',
+            name='is_dangling',
+            field=models.BooleanField(default=False),
+        ),
+    ]
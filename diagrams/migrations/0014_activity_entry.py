@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagrams', '0013_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.BigIntegerField()),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('username', models.CharField(blank=True, default='', max_length=150)),
+                ('action', models.CharField(choices=[('project.update', 'Project updated'), ('project.delete', 'Project deleted'), ('diagram.create', 'Diagram created'), ('diagram.update', 'Diagram updated'), ('diagram.delete', 'Diagram deleted'), ('lock.acquire', 'Diagram locked'), ('lock.release', 'Diagram unlocked'), ('link.create', 'Link created'), ('link.update', 'Link updated'), ('link.delete', 'Link deleted'), ('invite.create', 'Invite created'), ('invite.revoke', 'Invite revoked'), ('invite.accept', 'Invite accepted')], max_length=30)),
+                ('target_id', models.BigIntegerField(blank=True, null=True)),
+                ('target_name', models.CharField(blank=True, default='', max_length=255)),
+                ('details', models.JSONField(blank=True, default=dict)),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['project_id', '-id'], name='diagrams_ac_project_4e7aed_idx')],
+            },
+        ),
+    ]
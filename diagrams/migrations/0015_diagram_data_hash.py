@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagrams', '0014_activity_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagram',
+            name='data_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagrams', '0015_diagram_data_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagramThumbnail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=40)),
+                ('format', models.CharField(choices=[('svg', 'SVG'), ('png', 'PNG')], max_length=3)),
+                ('content', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'format'), name='diagrams_thumbnail_hash_format')],
+            },
+        ),
+    ]
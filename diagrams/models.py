@@ -1,16 +1,39 @@
 import secrets
 
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 from django.utils import timezone
 
 
+class LiveManager(models.Manager):
+    """Leaves out rows marked as deleted; they stay reachable through `all_objects` until purged."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class LiveLinkManager(models.Manager):
+    """Leaves out links with an end in a diagram marked as deleted."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            source_diagram__deleted_at__isnull=True,
+            target_diagram__deleted_at__isnull=True,
+        )
+
+
 class Project(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(max_length=255, blank=True, null=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_projects')
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
+    # Set when deletion was requested; the rows are purged in the background (see diagrams.deletion)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.name
@@ -88,12 +111,33 @@ class Diagram(models.Model):
     description = models.TextField(max_length=255, blank=True, null=True)
     diagram_type = models.CharField(max_length=10, choices=DIAGRAM_TYPES, default="bpmn")
     data = models.JSONField(default=dict, blank=True)
+    # Incremented on every content save, lets clients skip re-downloading `data`
+    revision = models.PositiveIntegerField(default=1)
+    # diffing.content_hash of `data`, kept up to date on save; empty for rows not saved since it was added
+    data_hash = models.CharField(max_length=40, blank=True, default='')
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='diagrams')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_locked = models.BooleanField(default=False)
     locked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='locked_diagrams')
     locked_at = models.DateTimeField(null=True, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    # Called with every diagram loaded from the database (see diagrams.coalescing)
+    load_hooks = []
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stored document and its hash, let post-save hooks see what a save changed
+        instance._saved_data = instance.__dict__.get('data')
+        instance._saved_hash = instance.__dict__.get('data_hash')
+        for hook in cls.load_hooks:
+            hook(instance)
+        return instance
 
 
 class DiagramLink(models.Model):
@@ -126,6 +170,8 @@ class DiagramLink(models.Model):
     
     link_type = models.CharField(max_length=50, choices=LINK_TYPES, default='reference')
     description = models.TextField(blank=True, default='')
+    # Set when the source or target element was removed from its diagram
+    is_dangling = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(
         User,
@@ -134,6 +180,9 @@ class DiagramLink(models.Model):
         related_name='created_links'
     )
 
+    objects = LiveLinkManager()
+    all_objects = models.Manager()
+
     class Meta:
         ordering = ['-created_at']
 
@@ -141,6 +190,176 @@ class DiagramLink(models.Model):
         return f'{self.source_diagram.name}:{self.source_element_id} → {self.target_diagram.name}'
 
 
+class DiagramElementIndex(models.Model):
+    """
+    Per-element rows of large diagrams, maintained from `Diagram.data` on save.
+    Node bounding boxes are mirrored into an SQLite R*Tree (see diagrams.spatial).
+    """
+    KIND_NODE = 'node'
+    KIND_EDGE = 'edge'
+
+    KIND_CHOICES = [
+        (KIND_NODE, 'Node'),
+        (KIND_EDGE, 'Edge'),
+    ]
+
+    diagram = models.ForeignKey(Diagram, on_delete=models.CASCADE, related_name='element_index')
+    kind = models.CharField(max_length=4, choices=KIND_CHOICES)
+    element_id = models.CharField(max_length=100)
+    source = models.CharField(max_length=100, blank=True, default='')
+    target = models.CharField(max_length=100, blank=True, default='')
+    payload = models.TextField()  # The element as JSON
+    min_x = models.FloatField(null=True, blank=True)
+    min_y = models.FloatField(null=True, blank=True)
+    max_x = models.FloatField(null=True, blank=True)
+    max_y = models.FloatField(null=True, blank=True)
+    digest = models.CharField(max_length=40)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['diagram', 'kind', 'element_id']),
+            models.Index(fields=['diagram', 'kind', 'source']),
+            models.Index(fields=['diagram', 'kind', 'target']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.element_id} of diagram {self.diagram_id}'
+
+
+class DeletionTask(models.Model):
+    """
+    Background purge of a project or diagram marked as deleted.
+    `total`/`purged` count diagrams, `rows_deleted` every row removed so far.
+    """
+    KIND_PROJECT = 'project'
+    KIND_DIAGRAM = 'diagram'
+
+    KIND_CHOICES = [
+        (KIND_PROJECT, 'Project'),
+        (KIND_DIAGRAM, 'Diagram'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Plain ids, the rows are gone once the purge finishes
+    object_id = models.BigIntegerField()
+    project_id = models.BigIntegerField()
+    name = models.CharField(max_length=100, blank=True, default='')
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='deletion_tasks')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    total = models.PositiveIntegerField(default=0)
+    purged = models.PositiveIntegerField(default=0)
+    rows_deleted = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Delete {self.kind} {self.object_id} ({self.status})'
+
+
+class Job(models.Model):
+    """
+    Deferred work run by `manage.py run_jobs` (see diagrams.jobs).
+    Higher `priority` runs first; a queued job's `dedupe_key` is unique.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'priority', 'run_after']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=Q(status='queued'),
+                name='diagrams_job_queued_dedupe_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.id} ({self.status})'
+
+
+class ActivityEntry(models.Model):
+    """
+    One line of a project's activity feed, written behind by diagrams.activity.
+    Plain ids and name snapshots, so the log outlives what it describes.
+    `count` > 1 means consecutive autosaves (or lock refreshes) collapsed into one entry.
+    """
+    ACTION_CHOICES = [
+        ('project.update', 'Project updated'),
+        ('project.delete', 'Project deleted'),
+        ('diagram.create', 'Diagram created'),
+        ('diagram.update', 'Diagram updated'),
+        ('diagram.delete', 'Diagram deleted'),
+        ('lock.acquire', 'Diagram locked'),
+        ('lock.release', 'Diagram unlocked'),
+        ('link.create', 'Link created'),
+        ('link.update', 'Link updated'),
+        ('link.delete', 'Link deleted'),
+        ('invite.create', 'Invite created'),
+        ('invite.revoke', 'Invite revoked'),
+        ('invite.accept', 'Invite accepted'),
+    ]
+
+    project_id = models.BigIntegerField()
+    user_id = models.BigIntegerField(null=True, blank=True)
+    username = models.CharField(max_length=150, blank=True, default='')
+    action = models.CharField(max_length=30, choices=ACTION_CHOICES)
+    target_id = models.BigIntegerField(null=True, blank=True)
+    target_name = models.CharField(max_length=255, blank=True, default='')
+    details = models.JSONField(default=dict, blank=True)
+    count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['project_id', '-id']),
+        ]
+
+    def __str__(self):
+        return f'{self.username} {self.action} {self.target_name} (project {self.project_id})'
+
+
 class GuestProfile(models.Model):
     """Marks a user as a temporary guest. Guest users are cleaned up periodically."""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='guest_profile')
@@ -150,6 +369,29 @@ class GuestProfile(models.Model):
         return f'Guest: {self.user.username}'
 
 
+class TokenGeneration(models.Model):
+    """
+    Revocation generation for a user's signed access tokens.
+    Bumping it invalidates every signed token issued before.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='token_generation')
+    generation = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user.username}: generation {self.generation}'
+
+
+class RevokedToken(models.Model):
+    """A revoked signed access token, kept until it could no longer be refreshed."""
+    jti = models.CharField(max_length=32, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='revoked_tokens')
+    # exp + REFRESH_GRACE of the token
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.jti}'
+
+
 class DiagramTemplate(models.Model):
     """
     User-created diagram templates.
@@ -185,3 +427,30 @@ class DiagramTemplate(models.Model):
     def __str__(self):
         return f'{self.name} ({self.diagram_type}) by {self.user.username}'
 
+
+
+class DiagramThumbnail(models.Model):
+    """
+    Rendered preview of a diagram or template document (see diagrams.thumbnails).
+    Keyed by the content hash of the document, so equal documents share one.
+    """
+    FORMAT_SVG = 'svg'
+    FORMAT_PNG = 'png'
+
+    FORMAT_CHOICES = [
+        (FORMAT_SVG, 'SVG'),
+        (FORMAT_PNG, 'PNG'),
+    ]
+
+    content_hash = models.CharField(max_length=40)
+    format = models.CharField(max_length=3, choices=FORMAT_CHOICES)
+    content = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'format'], name='diagrams_thumbnail_hash_format'),
+        ]
+
+    def __str__(self):
+        return f'{self.content_hash}.{self.format}'
@@ -0,0 +1,164 @@
+"""
+Presence: who is viewing or editing which diagram.
+
+An open diagram sends a heartbeat (``touch()``) every few seconds with its
+mode, ``viewing`` or ``editing``; the entry disappears ``TTL`` seconds after
+the last heartbeat, or on ``leave()``. A heartbeat that changes nothing and
+finds more than half of the TTL left is not written, so with the usual
+interval of a third of the TTL most heartbeats only read.
+
+Entries are kept per project, so one read returns the presence of every
+diagram in it. ``BACKEND`` picks the store: ``memory`` keeps entries in the
+process (a single application process), ``cache`` keeps them in the Django
+cache ``ALIAS`` under one key per project, so a backend shared by the workers
+(Redis, memcached, file) serves multi-worker deployments. Heartbeats of
+different processes can overwrite each other there; a lost one reappears
+with the next heartbeat of that user, well within the TTL.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+PRESENCE_DEFAULTS = {
+    'BACKEND': 'memory',
+    'ALIAS': 'default',
+    'TTL': 30,
+}
+
+VIEWING = 'viewing'
+EDITING = 'editing'
+MODES = (VIEWING, EDITING)
+
+
+def get_presence_settings() -> dict:
+    return {**PRESENCE_DEFAULTS, **getattr(settings, 'DIAGRAMS_PRESENCE', {})}
+
+
+class PresenceStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def _load(self, project_id) -> dict:
+        raise NotImplementedError
+
+    def _store(self, project_id, entries: dict, ttl: int) -> None:
+        raise NotImplementedError
+
+    def _live(self, project_id, now: float) -> dict:
+        return {key: entry for key, entry in self._load(project_id).items() if entry['expires'] > now}
+
+    def touch(self, project_id, diagram_id, user, mode: str, ttl: int) -> None:
+        now = time.time()
+        key = f'{diagram_id}:{user.id}'
+        with self._lock:
+            entries = self._live(project_id, now)
+            current = entries.get(key)
+            if current is not None and current['mode'] == mode and current['expires'] - now > ttl / 2:
+                return
+            entries[key] = {
+                'diagram_id': diagram_id,
+                'user_id': user.id,
+                'username': user.username,
+                'mode': mode,
+                'since': current['since'] if current is not None else now,
+                'expires': now + ttl,
+            }
+            self._store(project_id, entries, ttl)
+
+    def leave(self, project_id, diagram_id, user, ttl: int) -> None:
+        with self._lock:
+            entries = self._live(project_id, time.time())
+            if entries.pop(f'{diagram_id}:{user.id}', None) is not None:
+                self._store(project_id, entries, ttl)
+
+    def entries(self, project_id) -> list:
+        return list(self._live(project_id, time.time()).values())
+
+
+class MemoryPresenceStore(PresenceStore):
+    def __init__(self):
+        super().__init__()
+        self._projects = {}
+
+    def _load(self, project_id) -> dict:
+        return self._projects.get(project_id, {})
+
+    def _store(self, project_id, entries: dict, ttl: int) -> None:
+        if entries:
+            self._projects[project_id] = entries
+        else:
+            self._projects.pop(project_id, None)
+
+
+class CachePresenceStore(PresenceStore):
+    def __init__(self, alias: str):
+        super().__init__()
+        self.alias = alias
+
+    def _key(self, project_id) -> str:
+        return f'diagrams:presence:{project_id}'
+
+    def _load(self, project_id) -> dict:
+        return caches[self.alias].get(self._key(project_id)) or {}
+
+    def _store(self, project_id, entries: dict, ttl: int) -> None:
+        if entries:
+            caches[self.alias].set(self._key(project_id), entries, timeout=ttl)
+        else:
+            caches[self.alias].delete(self._key(project_id))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store() -> PresenceStore:
+    config = get_presence_settings()
+    key = (config['BACKEND'], config['ALIAS'])
+    with _stores_lock:
+        if key not in _stores:
+            if config['BACKEND'] == 'memory':
+                _stores[key] = MemoryPresenceStore()
+            elif config['BACKEND'] == 'cache':
+                _stores[key] = CachePresenceStore(config['ALIAS'])
+            else:
+                raise ValueError(f"Unknown DIAGRAMS_PRESENCE backend: {config['BACKEND']!r}")
+        return _stores[key]
+
+
+def touch(project_id, diagram_id, user, mode: str = VIEWING) -> None:
+    get_store().touch(project_id, diagram_id, user, mode, get_presence_settings()['TTL'])
+
+
+def leave(project_id, diagram_id, user) -> None:
+    get_store().leave(project_id, diagram_id, user, get_presence_settings()['TTL'])
+
+
+def _serialize_entry(entry: dict) -> dict:
+    return {
+        'id': entry['user_id'],
+        'username': entry['username'],
+        'since': datetime.fromtimestamp(entry['since'], timezone.utc),
+    }
+
+
+def diagram_presence(project_id, diagram_id) -> dict:
+    """Viewers and editors of one diagram."""
+    return project_presence(project_id, diagram_ids={diagram_id}).get(diagram_id) or {
+        'diagram_id': diagram_id, VIEWING: [], EDITING: [],
+    }
+
+
+def project_presence(project_id, diagram_ids=None) -> dict:
+    """Diagram id -> ``{'diagram_id', 'viewing', 'editing'}`` for diagrams of the project with anyone present."""
+    diagrams = {}
+    for entry in sorted(get_store().entries(project_id), key=lambda e: e['since']):
+        if diagram_ids is not None and entry['diagram_id'] not in diagram_ids:
+            continue
+        presence = diagrams.setdefault(entry['diagram_id'], {'diagram_id': entry['diagram_id'], VIEWING: [], EDITING: []})
+        presence[entry['mode']].append(_serialize_entry(entry))
+    return diagrams
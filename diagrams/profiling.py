@@ -0,0 +1,208 @@
+"""
+Opt-in per-request profiling.
+
+For a sampled fraction of requests the middleware records SQL count and time,
+authentication, permission, view, serializer and render timings and the
+request/response body sizes. They are reported in a ``Server-Timing`` header
+and as one JSON log line on the ``diagrams.profiling`` logger. Requests slower
+than ``SLOW_REQUEST_MS`` are logged at WARNING level with their query list.
+
+Enable it with ``DIAGRAMS_PROFILING = {'ENABLED': True}`` in settings.
+"""
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import query_observers
+
+
+logger = logging.getLogger('diagrams.profiling')
+
+PROFILING_DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,
+    'SLOW_REQUEST_MS': 500,
+    'MAX_LOGGED_QUERIES': 50,
+}
+
+# Order in which spans are reported in the Server-Timing header.
+SPAN_ORDER = ('auth', 'perm', 'serializer', 'view', 'render')
+
+_current_profile = contextvars.ContextVar('diagrams_request_profile', default=None)
+
+
+def get_profiling_settings() -> dict:
+    return {**PROFILING_DEFAULTS, **getattr(settings, 'DIAGRAMS_PROFILING', {})}
+
+
+def current_profile():
+    """Return the profile of the request being handled, or None if it is not sampled."""
+    return _current_profile.get()
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.view_started = None
+        self.render_started = None
+        self.spans = {}
+        self.queries = []
+        self.query_time = 0.0
+        self._depth = {}
+
+    def add_span(self, name: str, duration: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_time += duration
+            self.queries.append((context['connection'].alias, sql, duration))
+
+    def finish(self) -> None:
+        self.finished = time.perf_counter()
+        if self.view_started is not None:
+            view_end = self.render_started if self.render_started is not None else self.finished
+            self.add_span('view', view_end - self.view_started)
+        if self.render_started is not None:
+            self.add_span('render', self.finished - self.render_started)
+
+    @property
+    def total(self) -> float:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+
+@contextmanager
+def span(name: str):
+    """
+    Attribute the time spent in the block to ``name`` on the current profile.
+    Nested spans with the same name are only counted once.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    depth = profile._depth.get(name, 0)
+    profile._depth[name] = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile._depth[name] = depth
+        if depth == 0:
+            profile.add_span(name, time.perf_counter() - start)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+class RequestProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_profiling_settings()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = float(config['SAMPLE_RATE'])
+        self.slow_request_ms = config['SLOW_REQUEST_MS']
+        self.max_logged_queries = config['MAX_LOGGED_QUERIES']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            with query_observers.observe(profile):
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        profile.finish()
+        self._report(request, response, profile)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            with query_observers.observe(profile):
+                response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        profile.finish()
+        self._report(request, response, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered by the handler after this hook returns.
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+        return response
+
+    def _report(self, request, response, profile: RequestProfile) -> None:
+        timings = [f'db;dur={_ms(profile.query_time)};desc="{len(profile.queries)} queries"']
+        for name in SPAN_ORDER:
+            if name in profile.spans:
+                timings.append(f'{name};dur={_ms(profile.spans[name])}')
+        timings.append(f'total;dur={_ms(profile.total)}')
+        response['Server-Timing'] = ', '.join(timings)
+
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'url_name': match.url_name if match else None,
+            'status': response.status_code,
+            'total_ms': _ms(profile.total),
+            'db_queries': len(profile.queries),
+            'db_ms': _ms(profile.query_time),
+            'spans_ms': {name: _ms(value) for name, value in profile.spans.items()},
+            'request_bytes': int(request.META.get('CONTENT_LENGTH') or 0),
+            'response_bytes': None if response.streaming else len(response.content),
+        }
+
+        if self.slow_request_ms is not None and record['total_ms'] >= self.slow_request_ms:
+            record['slow'] = True
+            record['queries'] = [
+                {'db': alias, 'sql': sql, 'ms': _ms(duration)}
+                for alias, sql, duration in profile.queries[:self.max_logged_queries]
+            ]
+            logger.warning(json.dumps(record, default=str))
+        else:
+            logger.info(json.dumps(record, default=str))
@@ -0,0 +1,52 @@
+"""
+Per-request observers of database queries, on whichever thread runs them.
+
+Connections are per thread. Under ASGI the middleware runs on the event
+loop thread while sync views and ``sync_to_async`` ORM calls query on
+connections of other threads, so an ``execute_wrapper`` installed around
+the request by the middleware sees none of them. Instead every connection
+gets one wrapper when it is created, which calls the observers of the
+current context; ``sync_to_async`` and ``async_to_sync`` carry the context
+over to the threads they run on.
+
+An observer has the signature of an execute wrapper:
+``observer(execute, sql, params, many, context)``.
+"""
+from contextlib import contextmanager
+import contextvars
+import functools
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+_observers = contextvars.ContextVar('diagrams_query_observers', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    observers = _observers.get()
+    for observer in reversed(observers):
+        execute = functools.partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install(connection, **kwargs) -> None:
+    """Add the dispatching wrapper to ``connection``, once."""
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_dispatch)
+
+
+connection_created.connect(install, dispatch_uid='diagrams.query_observers')
+
+
+@contextmanager
+def observe(observer):
+    """Pass the queries run in the current context, on any thread, through ``observer``."""
+    # Connections of this thread may have been opened before the signal was connected
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+    token = _observers.set(_observers.get() + (observer,))
+    try:
+        yield
+    finally:
+        _observers.reset(token)
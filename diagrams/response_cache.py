@@ -0,0 +1,147 @@
+"""
+Versioned read-through cache for read-heavy endpoints.
+
+Every cached value remembers the versions of the scopes it was built from
+(``('user', id)``, ``('project', id)``, ``('diagram', id)``, ``('templates', 'all')``).
+Model signals bump those versions after commit (see ``diagrams.signals``), so
+a lookup only returns a value whose dependencies are all unchanged; nothing
+has to be deleted explicitly. Version counters live in the same Django cache
+as the values, so any backend shared by the workers (file, Redis, memcached)
+keeps invalidation consistent across processes. LocMemCache is only correct
+for a single process.
+"""
+from contextlib import contextmanager
+import contextvars
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics
+from .models import Diagram, ProjectMembership
+
+
+RESPONSE_CACHE_DEFAULTS = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+
+def get_response_cache_settings() -> dict:
+    return {**RESPONSE_CACHE_DEFAULTS, **getattr(settings, 'DIAGRAMS_RESPONSE_CACHE', {})}
+
+
+def _cache():
+    return caches[get_response_cache_settings()['ALIAS']]
+
+
+def _version_key(scope: str, ident) -> str:
+    return f'diagrams:ver:{scope}:{ident}'
+
+
+def _entry_key(name: str, key_parts) -> str:
+    return 'diagrams:resp:' + ':'.join([name, *map(str, key_parts)])
+
+
+def get_versions(version_keys) -> dict:
+    version_keys = list(version_keys)
+    if not version_keys:
+        return {}
+    cache = _cache()
+    versions = cache.get_many(version_keys)
+    missing = [key for key in version_keys if key not in versions]
+    if missing:
+        # A fresh, time-based start value keeps an evicted counter from
+        # coming back at a version that older entries were built with.
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+def _bump_now(scope: str, ident) -> None:
+    cache = _cache()
+    key = _version_key(scope, ident)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump(scope: str, ident) -> None:
+    """Invalidate every cached value built from ``(scope, ident)`` once the current transaction commits."""
+    transaction.on_commit(lambda: _bump_now(scope, ident))
+
+
+_link_invalidation_handled = contextvars.ContextVar('diagrams_link_invalidation_handled', default=False)
+
+
+@contextmanager
+def link_invalidation_handled():
+    """
+    Skip the per-link signal invalidation inside the block, for bulk link
+    changes that bump the affected projects once themselves.
+    """
+    token = _link_invalidation_handled.set(True)
+    try:
+        yield
+    finally:
+        _link_invalidation_handled.reset(token)
+
+
+def link_invalidation_is_handled() -> bool:
+    return _link_invalidation_handled.get()
+
+
+def read_through(name: str, key_parts, deps, build):
+    """
+    Return the cached value for ``name``/``key_parts`` if all of its recorded
+    dependency versions are current, otherwise call ``build()`` and cache it.
+
+    ``deps`` are the ``(scope, ident)`` pairs known up front; ``build`` returns
+    ``(value, extra_deps)`` for dependencies discovered while building. A
+    ``None`` value is returned but never cached.
+    """
+    config = get_response_cache_settings()
+    if not config['ENABLED']:
+        return build()[0]
+
+    cache = _cache()
+    key = _entry_key(name, key_parts)
+    entry = cache.get(key)
+    if entry is not None and get_versions(entry['deps']) == entry['deps']:
+        metrics.inc('cache_requests_total', cache=name, result='hit')
+        return entry['value']
+
+    metrics.inc('cache_requests_total', cache=name, result='miss')
+    # Read known versions before building so a concurrent write makes the new entry stale.
+    versions = get_versions(_version_key(*dep) for dep in deps)
+    value, extra_deps = build()
+    if value is None:
+        return None
+    versions.update(get_versions(
+        _version_key(*dep) for dep in extra_deps if _version_key(*dep) not in versions
+    ))
+    cache.set(key, {'deps': versions, 'value': value}, config['TIMEOUT'])
+    return value
+
+
+# --- Cached lookups used for permission checks ---
+
+def get_user_project_ids(user) -> set:
+    def build():
+        memberships = ProjectMembership.objects.filter(user=user, project__deleted_at__isnull=True)
+        return set(memberships.values_list('project_id', flat=True)), []
+
+    return read_through('user_projects', [user.id], [('user', user.id)], build)
+
+
+def get_diagram_project_id(diagram_id):
+    """Return the project id of a diagram, or None if it does not exist."""
+    def build():
+        project_id = Diagram.objects.filter(id=diagram_id).values_list('project_id', flat=True).first()
+        return project_id, []
+
+    return read_through('diagram_project', [diagram_id], [('diagram', diagram_id)], build)
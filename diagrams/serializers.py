@@ -1,12 +1,28 @@
 from rest_framework import serializers
+from rest_framework.fields import empty
 from django.contrib.auth import get_user_model
 
-from .models import Project, Diagram, ProjectInvite, ProjectMembership, DiagramLink, DiagramTemplate
+from .models import ActivityEntry, Project, Diagram, ProjectInvite, ProjectMembership, DiagramLink, DiagramTemplate
+from . import thumbnails
+from .profiling import span
+from .uploads import ParsedDocument, check_document
 
 
 User = get_user_model()
 
 
+class ProfiledSerializerMixin:
+    """Attribute (de)serialization time to the ``serializer`` span of the request profile."""
+
+    def to_representation(self, instance):
+        with span('serializer'):
+            return super().to_representation(instance)
+
+    def run_validation(self, data=empty):
+        with span('serializer'):
+            return super().run_validation(data)
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=6)
     password2 = serializers.CharField(write_only=True)
@@ -37,7 +53,7 @@ class UserSerializer(serializers.ModelSerializer):
         return hasattr(obj, 'guest_profile')
 
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     owner = serializers.CharField(source="user.username", read_only=True)
 
     class Meta:
@@ -54,10 +70,60 @@ class ProjectSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'owner', 'created_at', 'updated_at']
 
 
-class DiagramSerializer(serializers.ModelSerializer):
+class ProjectListSerializer(ProjectSerializer):
+    """Project with the dashboard aggregates annotated by ``ProjectApiView``."""
+    diagram_count = serializers.SerializerMethodField()
+    diagram_counts = serializers.SerializerMethodField()
+    member_count = serializers.IntegerField(read_only=True)
+    link_count = serializers.IntegerField(read_only=True)
+    last_diagram_update = serializers.DateTimeField(read_only=True)
+
+    class Meta(ProjectSerializer.Meta):
+        fields = ProjectSerializer.Meta.fields + [
+            'diagram_count',
+            'diagram_counts',
+            'member_count',
+            'link_count',
+            'last_diagram_update',
+        ]
+
+    def get_diagram_counts(self, obj):
+        return {diagram_type: getattr(obj, f'{diagram_type}_count') for diagram_type, _ in Diagram.DIAGRAM_TYPES}
+
+    def get_diagram_count(self, obj):
+        return sum(self.get_diagram_counts(obj).values())
+
+
+class DiagramDataField(serializers.JSONField):
+    """
+    Diagram `data`. Documents already parsed and checked by DiagramJSONParser are
+    taken as is; anything else is validated by JSONField and checked for size.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, ParsedDocument):
+            return data
+        data = super().to_internal_value(data)
+        check_document(data)
+        return data
+
+
+class ThumbnailField(serializers.Field):
+    """Read-only URL of the SVG thumbnail of a diagram or template (see diagrams.thumbnails)."""
+
+    def __init__(self, kind, **kwargs):
+        self.kind = kind
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, obj):
+        return thumbnails.thumbnail_url(self.kind, obj)
+
+
+class DiagramSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     locked_by = UserSerializer(read_only=True)
     # Explicitly define data field to ensure DRF handles the JSON payload correctly
-    data = serializers.JSONField(binary=False, default=dict)
+    data = DiagramDataField(binary=False, default=dict)
+    thumbnail = ThumbnailField('diagram')
 
     class Meta:
         model = Diagram
@@ -66,14 +132,17 @@ class DiagramSerializer(serializers.ModelSerializer):
             'name',
             'diagram_type',
             'data',
+            'revision',
             'is_locked',
             'locked_by',
+            'thumbnail',
             'project',
             'created_at',
             'updated_at',
         ]
         read_only_fields = [
             'id',
+            'revision',
             'is_locked',
             'locked_by',
             'project',
@@ -82,6 +151,34 @@ class DiagramSerializer(serializers.ModelSerializer):
         ]
 
 
+class DiagramMetaSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    """Diagram without its `data`, for clients that already hold the current revision."""
+    locked_by = UserSerializer(read_only=True)
+    thumbnail = ThumbnailField('diagram')
+
+    class Meta:
+        model = Diagram
+        fields = [field for field in DiagramSerializer.Meta.fields if field != 'data']
+        read_only_fields = fields
+
+
+class ActivityEntrySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ActivityEntry
+        fields = [
+            'id',
+            'user_id',
+            'username',
+            'action',
+            'target_id',
+            'target_name',
+            'details',
+            'count',
+            'created_at',
+            'updated_at',
+        ]
+
+
 class ProjectInviteSerializer(serializers.ModelSerializer):
     invited_by = serializers.CharField(source='invited_by.username', read_only=True)
     is_expired = serializers.SerializerMethodField()
@@ -129,7 +226,7 @@ class ProjectMembershipSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'project', 'user', 'role', 'created_at']
 
 
-class DiagramLinkSerializer(serializers.ModelSerializer):
+class DiagramLinkSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     source_diagram_name = serializers.CharField(source='source_diagram.name', read_only=True)
     source_diagram_type = serializers.CharField(source='source_diagram.diagram_type', read_only=True)
     target_diagram_name = serializers.CharField(source='target_diagram.name', read_only=True)
@@ -153,12 +250,14 @@ class DiagramLinkSerializer(serializers.ModelSerializer):
             'target_element_id',
             'link_type',
             'description',
+            'is_dangling',
             'created_at',
             'created_by',
             'created_by_username',
         ]
         read_only_fields = [
             'id',
+            'is_dangling',
             'source_diagram_name',
             'source_diagram_type',
             'target_diagram_name',
@@ -170,7 +269,22 @@ class DiagramLinkSerializer(serializers.ModelSerializer):
         ]
 
 
-class DiagramLinkCreateSerializer(serializers.ModelSerializer):
+class PrefetchedDiagramField(serializers.PrimaryKeyRelatedField):
+    """Resolves ids from ``context['diagrams']`` (id -> Diagram) when given, before querying."""
+
+    def to_internal_value(self, data):
+        diagrams = self.context.get('diagrams')
+        if diagrams is not None and not isinstance(data, bool):
+            try:
+                return diagrams[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class DiagramLinkCreateSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
+    target_diagram = PrefetchedDiagramField(queryset=Diagram.objects.all())
+
     class Meta:
         model = DiagramLink
         fields = [
@@ -230,10 +344,11 @@ class DiagramLinkCreateSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class DiagramTemplateSerializer(serializers.ModelSerializer):
+class DiagramTemplateSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     owner_username = serializers.CharField(source='user.username', read_only=True)
     node_count = serializers.SerializerMethodField()
     edge_count = serializers.SerializerMethodField()
+    thumbnail = ThumbnailField('template')
 
     class Meta:
         model = DiagramTemplate
@@ -248,6 +363,7 @@ class DiagramTemplateSerializer(serializers.ModelSerializer):
             'is_public',
             'node_count',
             'edge_count',
+            'thumbnail',
             'created_at',
             'updated_at',
         ]
@@ -264,7 +380,7 @@ class DiagramTemplateSerializer(serializers.ModelSerializer):
         return len(edges) if isinstance(edges, list) else 0
 
 
-class DiagramTemplateCreateSerializer(serializers.ModelSerializer):
+class DiagramTemplateCreateSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = DiagramTemplate
         fields = [
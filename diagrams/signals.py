@@ -0,0 +1,123 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import access_tokens, coalescing, diffing, link_reconciliation, response_cache, spatial, thumbnails, views
+from .models import Diagram, DiagramLink, DiagramTemplate, Project, ProjectMembership
+
+
+# Diagram fields that no cached response depends on.
+DIAGRAM_UNCACHED_FIELDS = frozenset({'is_locked', 'locked_by', 'locked_at'})
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project(sender, instance, **kwargs):
+    response_cache.bump('project', instance.id)
+
+
+@receiver(post_save, sender=ProjectMembership)
+@receiver(post_delete, sender=ProjectMembership)
+def invalidate_membership(sender, instance, **kwargs):
+    response_cache.bump('user', instance.user_id)
+    response_cache.bump('project', instance.project_id)
+    views.forget_memberships(instance.user_id)
+
+
+@receiver(pre_save, sender=Diagram)
+def hash_diagram_data(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Saves listing update_fields have to include 'data_hash' themselves
+    if raw or (update_fields and 'data' not in update_fields):
+        return
+    if instance.__dict__.get('_hashed_data') is not instance.data:
+        instance.data_hash = diffing.content_hash(instance.data)
+        instance._hashed_data = instance.data
+
+
+@receiver(post_save, sender=Diagram)
+def invalidate_saved_diagram(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and DIAGRAM_UNCACHED_FIELDS.issuperset(update_fields):
+        return
+    response_cache.bump('project', instance.project_id)
+    if created:
+        response_cache.bump('diagram', instance.id)
+
+
+@receiver(post_delete, sender=Diagram)
+def invalidate_deleted_diagram(sender, instance, **kwargs):
+    response_cache.bump('project', instance.project_id)
+    response_cache.bump('diagram', instance.id)
+
+
+@receiver(post_save, sender=Diagram)
+def reindex_diagram_elements(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields and 'data' not in update_fields):
+        return
+    spatial.reindex_diagram(instance)
+
+
+@receiver(post_save, sender=Diagram)
+def reconcile_element_links(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if created or raw or (update_fields and 'data' not in update_fields):
+        return
+    link_reconciliation.reconcile_saved_diagram(instance, instance.__dict__.get('_saved_data'))
+    instance._saved_data = instance.data
+
+
+@receiver(post_save, sender=Diagram)
+def supersede_pending_write(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields and 'data' not in update_fields):
+        return
+    coalescing.saved(instance)
+
+
+@receiver(post_save, sender=Diagram)
+def schedule_diagram_thumbnail(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields and 'data' not in update_fields):
+        return
+    # Only saves that change the stored document; coalesced autosaves get here once flushed
+    if instance.data_hash == instance.__dict__.get('_saved_hash'):
+        return
+    instance._saved_hash = instance.data_hash
+    diagram_id = instance.id
+    transaction.on_commit(lambda: thumbnails.schedule('diagram', diagram_id))
+
+
+@receiver(pre_delete, sender=Diagram)
+def drop_diagram_elements(sender, instance, **kwargs):
+    # Before the index rows cascade with the diagram: the R*Tree entries are found through them
+    spatial.drop_index(instance.id)
+
+
+@receiver(post_save, sender=DiagramLink)
+@receiver(post_delete, sender=DiagramLink)
+def invalidate_link(sender, instance, **kwargs):
+    if response_cache.link_invalidation_is_handled():
+        return
+    project_ids = Diagram.objects.filter(
+        id__in=[instance.source_diagram_id, instance.target_diagram_id]
+    ).values_list('project_id', flat=True)
+    for project_id in set(project_ids):
+        response_cache.bump('project', project_id)
+
+
+@receiver(post_save, sender=DiagramTemplate)
+@receiver(post_delete, sender=DiagramTemplate)
+def invalidate_templates(sender, instance, **kwargs):
+    response_cache.bump('templates', 'all')
+
+
+@receiver(post_save, sender=DiagramTemplate)
+def schedule_template_thumbnail(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    template_id = instance.id
+    transaction.on_commit(lambda: thumbnails.schedule('template', template_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_token_user(sender, instance, **kwargs):
+    # Signed token authentication serves users from the cache
+    access_tokens.forget_user(instance.id)
@@ -0,0 +1,368 @@
+"""
+Spatial index for viewport loading of very large diagrams.
+
+Diagrams with at least ``MIN_NODES`` nodes get one DiagramElementIndex row
+per node and edge, kept in sync with ``Diagram.data`` whenever it is saved.
+Node bounding boxes (absolute, i.e. with parent offsets applied) are mirrored
+into the ``diagrams_element_rtree`` R*Tree on SQLite so a viewport query only
+touches the nodes it returns. The diagram id is the R*Tree's first dimension,
+which keeps one shared table for all diagrams; R*Tree coordinates are
+32-bit floats, so large neighbouring ids share a range there and queries
+check the diagram of the index row as well. Other databases fall back to
+range filters on the bounding box columns.
+
+Smaller diagrams are not indexed; their viewport and overview are computed
+from ``Diagram.data`` directly.
+"""
+import hashlib
+import json
+import math
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min
+from django.db.models.functions import Floor
+
+from .models import Diagram, DiagramElementIndex
+
+
+SPATIAL_INDEX_DEFAULTS = {
+    'ENABLED': True,
+    'MIN_NODES': 2000,
+    'MAX_VIEWPORT_NODES': 2000,
+    'DEFAULT_TILE_SIZE': 1000,
+}
+
+RTREE_TABLE = 'diagrams_element_rtree'
+
+# Size assumed for nodes that were never measured by the editor.
+DEFAULT_NODE_WIDTH = 150.0
+DEFAULT_NODE_HEIGHT = 50.0
+
+WRITE_BATCH_SIZE = 500
+
+
+def get_spatial_index_settings() -> dict:
+    return {**SPATIAL_INDEX_DEFAULTS, **getattr(settings, 'DIAGRAMS_SPATIAL_INDEX', {})}
+
+
+def _use_rtree() -> bool:
+    return connection.vendor == 'sqlite'
+
+
+def _number(value, default=None):
+    if isinstance(value, str):
+        value = value.strip().removesuffix('px')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return number if math.isfinite(number) else default
+
+
+def _elements(data, key: str) -> list:
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if isinstance(item, dict) and item.get('id') is not None]
+
+
+def node_size(node) -> tuple:
+    """Rendered ``(width, height)`` of a node: measured size, then style, then shape data."""
+    sizes = [node]
+    for key in ('style', 'data'):
+        if isinstance(node.get(key), dict):
+            sizes.append(node[key])
+    width = next((w for w in (_number(item.get('width')) for item in sizes) if w), DEFAULT_NODE_WIDTH)
+    height = next((h for h in (_number(item.get('height')) for item in sizes) if h), DEFAULT_NODE_HEIGHT)
+    return width, height
+
+
+def node_boxes(data) -> dict:
+    """
+    Return ``{node_id: (min_x, min_y, max_x, max_y)}`` in diagram coordinates.
+    Positions of child nodes (``parentId``) are relative to their parent.
+    """
+    nodes = {str(node['id']): node for node in _elements(data, 'nodes')}
+    origins = {}
+
+    def origin(node_id):
+        # Walk up the parent chain iteratively; cycles and unknown parents end the walk.
+        chain = []
+        current = node_id
+        while current in nodes and current not in origins and current not in chain:
+            chain.append(current)
+            parent = nodes[current].get('parentId') or nodes[current].get('parentNode')
+            current = str(parent) if parent is not None else None
+        base = origins.get(current, (0.0, 0.0))
+        for item in reversed(chain):
+            position = nodes[item].get('position') or {}
+            base = (base[0] + _number(position.get('x'), 0.0), base[1] + _number(position.get('y'), 0.0))
+            origins[item] = base
+        return origins[node_id]
+
+    boxes = {}
+    for node_id, node in nodes.items():
+        x, y = origin(node_id)
+        width, height = node_size(node)
+        boxes[node_id] = (x, y, x + width, y + height)
+    return boxes
+
+
+def _dumps(element) -> str:
+    return json.dumps(element, separators=(',', ':'), sort_keys=True)
+
+
+def _desired_rows(data) -> dict:
+    boxes = node_boxes(data)
+    rows = {}
+    for node in _elements(data, 'nodes'):
+        node_id = str(node['id'])
+        payload = _dumps(node)
+        box = boxes[node_id]
+        rows[(DiagramElementIndex.KIND_NODE, node_id)] = {
+            'payload': payload, 'box': box, 'source': '', 'target': '',
+            'digest': hashlib.sha1(f'{payload}|{box}'.encode()).hexdigest(),
+        }
+    for edge in _elements(data, 'edges'):
+        payload = _dumps(edge)
+        rows[(DiagramElementIndex.KIND_EDGE, str(edge['id']))] = {
+            'payload': payload, 'box': None,
+            'source': str(edge.get('source', '')), 'target': str(edge.get('target', '')),
+            'digest': hashlib.sha1(payload.encode()).hexdigest(),
+        }
+    return rows
+
+
+def _rtree_delete(row_ids) -> None:
+    with connection.cursor() as cursor:
+        for start in range(0, len(row_ids), WRITE_BATCH_SIZE):
+            chunk = row_ids[start:start + WRITE_BATCH_SIZE]
+            cursor.execute(
+                f'DELETE FROM {RTREE_TABLE} WHERE id IN ({", ".join(["%s"] * len(chunk))})', chunk
+            )
+
+
+def _rtree_upsert(diagram_id, rows) -> None:
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {RTREE_TABLE} (id, min_d, max_d, min_x, max_x, min_y, max_y) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+            [
+                (row.id, diagram_id, diagram_id, row.min_x, row.max_x, row.min_y, row.max_y)
+                for row in rows
+            ],
+        )
+
+
+def delete_rows(row_ids) -> None:
+    """Remove index rows and their R*Tree entries by id."""
+    for start in range(0, len(row_ids), WRITE_BATCH_SIZE):
+        DiagramElementIndex.objects.filter(id__in=row_ids[start:start + WRITE_BATCH_SIZE]).delete()
+    if _use_rtree():
+        _rtree_delete(row_ids)
+
+
+def drop_index(diagram_id) -> None:
+    """Remove all index rows of a diagram."""
+    # By row id; the R*Tree's diagram dimension is not exact
+    row_ids = list(DiagramElementIndex.objects.filter(diagram_id=diagram_id).values_list('id', flat=True))
+    with transaction.atomic():
+        delete_rows(row_ids)
+
+
+def reindex_diagram(diagram: Diagram) -> int:
+    """
+    Bring the index of ``diagram`` in line with its data and return the number
+    of rows written. Unchanged elements are detected by digest and left alone,
+    so an autosave that moves a few nodes only rewrites those.
+    """
+    config = get_spatial_index_settings()
+    if not config['ENABLED'] or len(_elements(diagram.data, 'nodes')) < config['MIN_NODES']:
+        if DiagramElementIndex.objects.filter(diagram_id=diagram.id).exists():
+            drop_index(diagram.id)
+        return 0
+
+    desired = _desired_rows(diagram.data)
+    existing = {
+        (kind, element_id): (row_id, digest)
+        for row_id, kind, element_id, digest in DiagramElementIndex.objects.filter(
+            diagram_id=diagram.id
+        ).values_list('id', 'kind', 'element_id', 'digest')
+    }
+
+    stale_ids = [row_id for key, (row_id, _) in existing.items() if key not in desired]
+    to_create, to_update = [], []
+    for key, values in desired.items():
+        current = existing.get(key)
+        if current is not None and current[1] == values['digest']:
+            continue
+        box = values['box'] or (None, None, None, None)
+        row = DiagramElementIndex(
+            id=current[0] if current else None,
+            diagram_id=diagram.id, kind=key[0], element_id=key[1],
+            source=values['source'], target=values['target'], payload=values['payload'],
+            min_x=box[0], min_y=box[1], max_x=box[2], max_y=box[3], digest=values['digest'],
+        )
+        (to_update if current else to_create).append(row)
+
+    with transaction.atomic():
+        if stale_ids:
+            delete_rows(stale_ids)
+        if to_update:
+            DiagramElementIndex.objects.bulk_update(
+                to_update,
+                ['source', 'target', 'payload', 'min_x', 'min_y', 'max_x', 'max_y', 'digest'],
+                batch_size=WRITE_BATCH_SIZE,
+            )
+        if to_create:
+            DiagramElementIndex.objects.bulk_create(to_create, batch_size=WRITE_BATCH_SIZE)
+        if _use_rtree():
+            _rtree_upsert(diagram.id, [row for row in to_update + to_create if row.kind == DiagramElementIndex.KIND_NODE])
+
+    return len(stale_ids) + len(to_update) + len(to_create)
+
+
+def is_indexed(diagram_id) -> bool:
+    return DiagramElementIndex.objects.filter(diagram_id=diagram_id).exists()
+
+
+# --- Queries ---
+
+def _indexed_node_payloads(diagram_id, rect, limit):
+    min_x, min_y, max_x, max_y = rect
+    if _use_rtree():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT e.element_id, e.payload FROM {RTREE_TABLE} r '
+                f'JOIN {DiagramElementIndex._meta.db_table} e ON e.id = r.id AND e.diagram_id = %s '
+                'WHERE r.min_d <= %s AND r.max_d >= %s '
+                'AND r.max_x >= %s AND r.min_x <= %s AND r.max_y >= %s AND r.min_y <= %s '
+                'LIMIT %s',
+                [diagram_id, diagram_id, diagram_id, min_x, max_x, min_y, max_y, limit],
+            )
+            return cursor.fetchall()
+    return list(
+        DiagramElementIndex.objects.filter(
+            diagram_id=diagram_id, kind=DiagramElementIndex.KIND_NODE,
+            max_x__gte=min_x, min_x__lte=max_x, max_y__gte=min_y, min_y__lte=max_y,
+        ).values_list('element_id', 'payload')[:limit]
+    )
+
+
+def _indexed_viewport(diagram_id, rect, limit) -> dict:
+    found = _indexed_node_payloads(diagram_id, rect, limit + 1)
+    truncated = len(found) > limit
+    found = found[:limit]
+    node_ids = [element_id for element_id, _ in found]
+
+    edges = {}
+    for start in range(0, len(node_ids), WRITE_BATCH_SIZE):
+        chunk = node_ids[start:start + WRITE_BATCH_SIZE]
+        for field in ('source', 'target'):
+            edges.update(
+                DiagramElementIndex.objects.filter(
+                    diagram_id=diagram_id, kind=DiagramElementIndex.KIND_EDGE, **{f'{field}__in': chunk}
+                ).values_list('element_id', 'payload')
+            )
+
+    # Off-screen endpoints of the returned edges, so edges can be drawn.
+    visible = set(node_ids)
+    edge_data = [json.loads(payload) for payload in edges.values()]
+    missing = {str(edge.get(end)) for edge in edge_data for end in ('source', 'target')} - visible
+    endpoints = []
+    missing = sorted(missing)
+    for start in range(0, len(missing), WRITE_BATCH_SIZE):
+        endpoints.extend(
+            DiagramElementIndex.objects.filter(
+                diagram_id=diagram_id, kind=DiagramElementIndex.KIND_NODE,
+                element_id__in=missing[start:start + WRITE_BATCH_SIZE],
+            ).values_list('payload', flat=True)
+        )
+
+    return {
+        'nodes': [json.loads(payload) for _, payload in found],
+        'edges': edge_data,
+        'endpoints': [json.loads(payload) for payload in endpoints],
+        'truncated': truncated,
+    }
+
+
+def _intersects(box, rect) -> bool:
+    return box[2] >= rect[0] and box[0] <= rect[2] and box[3] >= rect[1] and box[1] <= rect[3]
+
+
+def _data_viewport(data, rect, limit) -> dict:
+    boxes = node_boxes(data)
+    nodes = {str(node['id']): node for node in _elements(data, 'nodes')}
+    visible = [node_id for node_id, box in boxes.items() if _intersects(box, rect)]
+    truncated = len(visible) > limit
+    visible = set(visible[:limit])
+    edges = [
+        edge for edge in _elements(data, 'edges')
+        if str(edge.get('source')) in visible or str(edge.get('target')) in visible
+    ]
+    missing = {str(edge.get(end)) for edge in edges for end in ('source', 'target')} - visible
+    return {
+        'nodes': [node for node_id, node in nodes.items() if node_id in visible],
+        'edges': edges,
+        'endpoints': [nodes[node_id] for node_id in sorted(missing) if node_id in nodes],
+        'truncated': truncated,
+    }
+
+
+def viewport(diagram: Diagram, rect, limit=None) -> dict:
+    """
+    Nodes intersecting ``rect`` (min_x, min_y, max_x, max_y), edges touching
+    them and the off-screen nodes those edges connect to (``endpoints``).
+    ``diagram.data`` is only read when the diagram is not indexed.
+    """
+    limit = limit or get_spatial_index_settings()['MAX_VIEWPORT_NODES']
+    if is_indexed(diagram.id):
+        return _indexed_viewport(diagram.id, rect, limit)
+    return _data_viewport(diagram.data, rect, limit)
+
+
+def _overview_from_boxes(boxes, tile_size) -> dict:
+    tiles = {}
+    for box in boxes:
+        key = (math.floor(box[0] / tile_size), math.floor(box[1] / tile_size))
+        tiles[key] = tiles.get(key, 0) + 1
+    bounds = None
+    if boxes:
+        bounds = [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+    return {
+        'bounds': bounds,
+        'tiles': [{'x': x, 'y': y, 'count': count} for (x, y), count in sorted(tiles.items())],
+    }
+
+
+def overview(diagram: Diagram, tile_size) -> dict:
+    """
+    Node counts per ``tile_size`` square (keyed by the tile holding each node's
+    top-left corner) and the overall bounds, for drawing a minimap.
+    """
+    if not is_indexed(diagram.id):
+        data = diagram.data
+        result = _overview_from_boxes(list(node_boxes(data).values()), tile_size)
+        result.update(node_count=len(_elements(data, 'nodes')), edge_count=len(_elements(data, 'edges')))
+        return result
+
+    nodes = DiagramElementIndex.objects.filter(diagram_id=diagram.id, kind=DiagramElementIndex.KIND_NODE)
+    tiles = [
+        {'x': int(row['tile_x']), 'y': int(row['tile_y']), 'count': row['count']}
+        for row in nodes.values(
+            tile_x=Floor(F('min_x') / tile_size), tile_y=Floor(F('min_y') / tile_size)
+        ).annotate(count=Count('id')).order_by('tile_x', 'tile_y')
+    ]
+
+    stats = nodes.aggregate(
+        node_count=Count('id'), min_x=Min('min_x'), min_y=Min('min_y'), max_x=Max('max_x'), max_y=Max('max_y')
+    )
+    edge_count = DiagramElementIndex.objects.filter(
+        diagram_id=diagram.id, kind=DiagramElementIndex.KIND_EDGE
+    ).count()
+    bounds = None
+    if stats['node_count']:
+        bounds = [stats['min_x'], stats['min_y'], stats['max_x'], stats['max_y']]
+    return {'bounds': bounds, 'tiles': tiles, 'node_count': stats['node_count'], 'edge_count': edge_count}
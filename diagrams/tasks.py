@@ -0,0 +1,34 @@
+"""Background job handlers (see diagrams.jobs); imported when the app is ready."""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from . import deletion, jobs, thumbnails
+from .models import GuestProfile
+
+
+GUEST_LIFETIME = timedelta(hours=24)
+
+
+@jobs.handler('guests.cleanup')
+def cleanup_guests():
+    """Remove guest users older than GUEST_LIFETIME, with everything they own."""
+    cutoff = timezone.now() - GUEST_LIFETIME
+    old_guest_ids = GuestProfile.objects.filter(created_at__lt=cutoff).values_list('user_id', flat=True)
+    User.objects.filter(id__in=list(old_guest_ids)).delete()
+
+
+@jobs.handler('deletion.purge')
+def purge_deletion(task_id):
+    deletion.process(task_id)
+
+
+@jobs.handler('thumbnails.render')
+def render_thumbnails(kind, object_id):
+    thumbnails.render_object(kind, object_id)
+
+
+@jobs.handler('thumbnails.prune')
+def prune_thumbnails():
+    thumbnails.prune()
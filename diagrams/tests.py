@@ -1,3 +1,1687 @@
-from django.test import TestCase
+from datetime import timedelta
+import gzip
+import io
+import json
+import os
+import random
+import re
+import socket
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncClient, AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, URLResolver, resolve, reverse
+from django.urls.resolvers import RoutePattern
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.test import APIRequestFactory
+
+from diagram_system.routing import RouteTree
+from diagram_system.urls import api_endpoints
+
+from . import (
+    access_tokens,
+    activity,
+    coalescing,
+    compression,
+    deletion,
+    diffing,
+    jobs,
+    layout,
+    link_reconciliation,
+    loadtest,
+    metrics,
+    presence,
+    response_cache,
+    spatial,
+    thumbnails,
+    throttling,
+    views,
+)
+from .async_views import AsyncDiagramDetailApiView, AsyncDiagramLockView
+from .models import (
+    Diagram,
+    DiagramElementIndex,
+    DiagramLink,
+    DiagramThumbnail,
+    GuestProfile,
+    Job,
+    Project,
+    ProjectMembership,
+    RevokedToken,
+    TokenGeneration,
+)
+
+
+def _auth(user) -> dict:
+    token, _ = Token.objects.get_or_create(user=user)
+    return {'Authorization': f'Bearer {token.key}'}
+
+
+def _project(user, name='project') -> Project:
+    project = Project.objects.create(name=name, user=user)
+    ProjectMembership.objects.create(project=project, user=user, role=ProjectMembership.ROLE_OWNER)
+    return project
+
+
+def _diagram(project, data=None, diagram_type='bpmn', name='diagram') -> Diagram:
+    return Diagram.objects.create(name=name, project=project, diagram_type=diagram_type, data=data or {'nodes': []})
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        _project(self.user)
+
+    def test_disabled_by_default(self):
+        response = self.client.get('/api/projects/', headers=_auth(self.user))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(DIAGRAMS_PROFILING={'ENABLED': True})
+    def test_sampled_request_reports_server_timing_and_a_log_line(self):
+        with self.assertLogs('diagrams.profiling', 'INFO') as logs:
+            response = self.client.get('/api/projects/', headers=_auth(self.user))
+        names = [timing.split(';')[0] for timing in response['Server-Timing'].split(', ')]
+        self.assertEqual(names[0], 'db')
+        self.assertEqual(names[-1], 'total')
+        self.assertIn('view', names)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['url_name'], record['status']), ('projects', 200))
+        self.assertEqual(record['response_bytes'], len(response.content))
+        self.assertNotIn('queries', record)
+
+    @override_settings(DIAGRAMS_PROFILING={'ENABLED': True, 'SLOW_REQUEST_MS': 0, 'MAX_LOGGED_QUERIES': 1})
+    def test_slow_request_is_logged_with_its_queries(self):
+        with self.assertLogs('diagrams.profiling', 'WARNING') as logs:
+            self.client.get('/api/projects/', headers=_auth(self.user))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertTrue(record['slow'])
+        self.assertEqual(len(record['queries']), 1)
+
+    @override_settings(DIAGRAMS_PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0})
+    def test_unsampled_request_is_not_profiled(self):
+        with self.assertNoLogs('diagrams.profiling'):
+            response = self.client.get('/api/projects/', headers=_auth(self.user))
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.user = User.objects.create_user('owner')
+        _project(self.user)
+
+    def test_requests_are_counted_per_view(self):
+        self.client.get('/api/projects/', headers=_auth(self.user))
+        self.client.get('/api/projects/', headers=_auth(self.user))
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('http_requests_total{method="GET",status="200",view="projects"} 2', body)
+        self.assertIn('http_request_duration_seconds_count{method="GET",view="projects"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",view="projects",le="+Inf"} 2', body)
+        # Scrapes are not recorded
+        self.assertNotIn('view="metrics"', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics.observe('http_request_db_queries', 1, view='v')
+        metrics.observe('http_request_db_queries', 7, view='v')
+        body = metrics.render_prometheus(metrics.registry.collect())
+        self.assertIn('http_request_db_queries_bucket{view="v",le="1.0"} 1', body)
+        self.assertIn('http_request_db_queries_bucket{view="v",le="5.0"} 1', body)
+        self.assertIn('http_request_db_queries_bucket{view="v",le="10.0"} 2', body)
+        self.assertIn('http_request_db_queries_sum{view="v"} 8', body)
+
+    @override_settings(DIAGRAMS_METRICS={'ALLOWED_IPS': ['10.0.0.1']})
+    def test_endpoint_is_limited_to_allowed_addresses(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_snapshots_of_other_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as snapshot:
+                json.dump({'counters': [['diagram_lock_conflicts_total', [], 2]], 'histograms': []}, snapshot)
+            metrics.inc('diagram_lock_conflicts_total')
+            with override_settings(DIAGRAMS_METRICS={'MULTIPROCESS_DIR': directory}):
+                body = self.client.get('/metrics').content.decode()
+        self.assertIn('diagram_lock_conflicts_total 3', body)
+
+    def test_snapshot_write_failures_do_not_reach_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'MULTIPROCESS_DIR': directory, 'FLUSH_INTERVAL': 0}
+            with override_settings(DIAGRAMS_METRICS=config), \
+                    mock.patch('diagrams.metrics.os.replace', side_effect=FileNotFoundError), \
+                    self.assertLogs('diagrams.metrics', 'ERROR'):
+                response = self.client.get('/api/projects/', headers=_auth(self.user))
+        self.assertEqual(response.status_code, 200)
+
+    def test_concurrent_recording_writes_one_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DIAGRAMS_METRICS={'MULTIPROCESS_DIR': directory, 'FLUSH_INTERVAL': 0}):
+                threads = [
+                    threading.Thread(target=lambda: [metrics.inc('diagram_lock_conflicts_total') for _ in range(200)])
+                    for _ in range(8)
+                ]
+                with self.assertNoLogs('diagrams.metrics', 'ERROR'):
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                metrics.registry.flush()
+            self.assertEqual(os.listdir(directory), [f'metrics-{os.getpid()}.json'])
+
+    def test_settings_are_read_once(self):
+        with override_settings(DIAGRAMS_METRICS={'FLUSH_INTERVAL': 5}), \
+                mock.patch('diagrams.metrics.get_metrics_settings', wraps=metrics.get_metrics_settings) as read:
+            for _ in range(3):
+                metrics.inc('diagram_lock_conflicts_total')
+        self.assertEqual(read.call_count, 1)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+
+    def _names(self):
+        return [project['name'] for project in self.client.get('/api/projects/', headers=_auth(self.user)).json()]
+
+    def test_value_is_rebuilt_once_a_dependency_is_bumped(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return len(builds), [('diagram', 7)]
+
+        self.assertEqual(response_cache.read_through('test', [1], [('project', 1)], build), 1)
+        self.assertEqual(response_cache.read_through('test', [1], [('project', 1)], build), 1)
+        # Dependencies discovered while building count as well
+        with self.captureOnCommitCallbacks(execute=True):
+            response_cache.bump('diagram', 7)
+        self.assertEqual(response_cache.read_through('test', [1], [('project', 1)], build), 2)
+
+    def test_bump_waits_for_the_commit(self):
+        response_cache.read_through('test', [1], [('project', 1)], lambda: ('old', []))
+        with self.captureOnCommitCallbacks() as callbacks:
+            response_cache.bump('project', 1)
+            self.assertEqual(response_cache.read_through('test', [1], [('project', 1)], lambda: ('new', [])), 'old')
+        self.assertEqual(len(callbacks), 1)
+
+    def test_project_listing_follows_writes(self):
+        self.assertEqual(self._names(), ['project'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/projects/{self.project.id}/', {'name': 'renamed'},
+                content_type='application/json', headers=_auth(self.user),
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._names(), ['renamed'])
+
+        other = User.objects.create_user('other')
+        with self.captureOnCommitCallbacks(execute=True):
+            shared = _project(other, 'shared')
+            ProjectMembership.objects.create(project=shared, user=self.user, role=ProjectMembership.ROLE_EDITOR)
+        self.assertCountEqual(self._names(), ['renamed', 'shared'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProjectMembership.objects.filter(project=shared, user=self.user).delete()
+        self.assertEqual(self._names(), ['renamed'])
+
+    @override_settings(DIAGRAMS_RESPONSE_CACHE={'ENABLED': False})
+    def test_disabled_cache_always_builds(self):
+        values = iter([1, 2])
+        self.assertEqual(response_cache.read_through('test', [1], [], lambda: (next(values), [])), 1)
+        self.assertEqual(response_cache.read_through('test', [1], [], lambda: (next(values), [])), 2)
+
+
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _throttle(self, now):
+        throttle = throttling.GuestLoginThrottle()
+        throttle.timer = mock.Mock(return_value=now)
+        return throttle
+
+    def _request(self, **headers):
+        return APIRequestFactory().post('/api/auth/guest', REMOTE_ADDR='192.0.2.1', **headers)
+
+    def test_bucket_refills_over_the_rate_period(self):
+        # guest_ip is 5/min
+        allowed = [self._throttle(0).allow_request(self._request(), None) for _ in range(6)]
+        self.assertEqual(allowed, [True] * 5 + [False])
+
+        # Halfway through the next minute half of the previous one has drained
+        results = [self._throttle(90).allow_request(self._request(), None) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+    def test_denied_request_reports_wait_and_spends_nothing(self):
+        for _ in range(5):
+            self._throttle(0).allow_request(self._request(), None)
+        throttle = self._throttle(30)
+        self.assertFalse(throttle.allow_request(self._request(), None))
+        self.assertGreater(throttle.wait(), 0)
+        self.assertLessEqual(throttle.wait(), 60)
+        # The denials did not count: the next minute starts from 5 drained ones
+        self.assertTrue(self._throttle(72).allow_request(self._request(), None))
+
+    def test_forwarded_for_does_not_pick_the_bucket(self):
+        for i in range(5):
+            self.assertTrue(self._throttle(0).allow_request(self._request(HTTP_X_FORWARDED_FOR=f'10.0.0.{i}'), None))
+        self.assertFalse(self._throttle(0).allow_request(self._request(HTTP_X_FORWARDED_FOR='10.0.0.99'), None))
+
+    def test_guest_login_is_throttled_per_client_address(self):
+        statuses = [
+            self.client.post('/api/auth/guest', HTTP_X_FORWARDED_FOR=f'10.0.0.{i}').status_code
+            for i in range(6)
+        ]
+        self.assertEqual(statuses, [201] * 5 + [429])
+
+    def test_concurrent_requests_do_not_share_tokens(self):
+        barrier = threading.Barrier(20)
+        allowed = []
+
+        def attempt():
+            throttle = self._throttle(0)
+            barrier.wait()
+            allowed.append(throttle.allow_request(self._request(), None))
+
+        threads = [threading.Thread(target=attempt) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(allowed.count(True), 5)
+
+
+class QueryObserverTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        _project(self.user)
+
+    def _db_queries(self, view):
+        for name, labels, values in metrics.registry.snapshot()['histograms']:
+            if name == 'http_request_db_queries' and dict(labels) == {'view': view}:
+                return values[-1]
+        return 0
+
+    async def test_metrics_count_queries_of_async_requests(self):
+        metrics.registry.reset()
+        response = await AsyncClient().get('/api/projects/', headers=await self._async_auth())
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self._db_queries('projects'), 0)
+
+    def test_metrics_count_queries_of_sync_requests(self):
+        metrics.registry.reset()
+        self.assertEqual(self.client.get('/api/projects/', headers=_auth(self.user)).status_code, 200)
+        self.assertGreater(self._db_queries('projects'), 0)
+
+    @override_settings(DIAGRAMS_PROFILING={'ENABLED': True})
+    async def test_server_timing_counts_queries_of_async_requests(self):
+        with self.assertLogs('diagrams.profiling', 'INFO'):
+            response = await AsyncClient().get('/api/projects/', headers=await self._async_auth())
+        queries = re.search(r'db;dur=[\d.]+;desc="(\d+) queries"', response['Server-Timing'])
+        self.assertGreater(int(queries[1]), 0)
+
+    async def _async_auth(self):
+        return await sync_to_async(_auth)(self.user)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        self.diagram = _diagram(self.project, {'nodes': [{'id': 'n1'}]})
+        self.headers = _auth(self.user)
+        self.factory = AsyncRequestFactory()
+
+    async def _call(self, view, method, path='/', data=None, user=None, **headers):
+        headers = {**(await sync_to_async(_auth)(user) if user else self.headers), **headers}
+        if data is not None:
+            request = getattr(self.factory, method)(path, data, content_type='application/json', headers=headers)
+        else:
+            request = getattr(self.factory, method)(path, headers=headers)
+        return await view.as_view()(request, diagram_id=self.diagram.id)
+
+    async def test_detail_get_and_put(self):
+        response = await self._call(AsyncDiagramDetailApiView, 'get')
+        self.assertEqual((response.status_code, response.data['data']), (200, {'nodes': [{'id': 'n1'}]}))
+
+        response = await self._call(AsyncDiagramDetailApiView, 'put', data={'data': {'nodes': []}})
+        self.assertEqual(response.status_code, 200)
+        stored = await Diagram.objects.aget(id=self.diagram.id)
+        self.assertEqual(stored.data, {'nodes': []})
+
+    async def test_puts_bump_the_revision(self):
+        response = await self._call(AsyncDiagramDetailApiView, 'put', data={'data': {'nodes': [{'id': 'n1'}]}})
+        self.assertEqual(response.data['revision'], 1)
+        response = await self._call(AsyncDiagramDetailApiView, 'put', data={'data': {'nodes': []}})
+        self.assertEqual(response.data['revision'], 2)
+        stored = await Diagram.objects.aget(id=self.diagram.id)
+        self.assertEqual((stored.revision, stored.data), (2, {'nodes': []}))
+
+    async def test_detail_answers_if_none_match(self):
+        response = await self._call(AsyncDiagramDetailApiView, 'get')
+        response = await self._call(AsyncDiagramDetailApiView, 'get', if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    async def test_lock_is_taken_once(self):
+        other = await sync_to_async(User.objects.create_user)('other')
+        await ProjectMembership.objects.acreate(project=self.project, user=other, role=ProjectMembership.ROLE_EDITOR)
+        response = await self._call(AsyncDiagramLockView, 'post', user=other)
+        self.assertEqual(response.data['user']['id'], other.id)
+        response = await self._call(AsyncDiagramLockView, 'post')
+        self.assertEqual(response.data['user']['id'], other.id)
+
+    async def test_non_members_are_denied(self):
+        stranger = await sync_to_async(User.objects.create_user)('stranger')
+        response = await self._call(AsyncDiagramDetailApiView, 'get', user=stranger)
+        self.assertEqual(response.status_code, 403)
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+
+    def _batch(self, requests, **options):
+        response = self.client.post(
+            '/api/batch', {'requests': requests, **options}, content_type='application/json', headers=_auth(self.user),
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_runs_requests_in_order(self):
+        project = _project(self.user)
+        result = self._batch([
+            {'id': 'a', 'method': 'GET', 'path': f'/api/projects/{project.id}/'},
+            {'id': 'b', 'method': 'GET', 'path': '/api/projects/999999/'},
+        ])
+        self.assertEqual([(r['id'], r['status']) for r in result['responses']], [('a', 200), ('b', 404)])
+
+    def test_project_created_in_the_batch_is_accessible_later_in_it(self):
+        next_id = _project(self.user).id + 1
+        result = self._batch([
+            {'method': 'POST', 'path': '/api/projects/', 'body': {'name': 'new'}},
+            {'method': 'POST', 'path': f'/api/projects/{next_id}/diagrams/', 'body': {'name': 'd', 'diagram_type': 'bpmn'}},
+        ])
+        self.assertEqual(result['responses'][0]['body']['id'], next_id)
+        self.assertEqual([r['status'] for r in result['responses']], [201, 201])
+
+    def test_atomic_batch_rolls_back_on_failure(self):
+        project = _project(self.user)
+        result = self._batch([
+            {'method': 'PATCH', 'path': f'/api/projects/{project.id}/', 'body': {'name': 'renamed'}},
+            {'method': 'GET', 'path': '/api/projects/999999/'},
+        ], atomic=True)
+        self.assertTrue(result['rolled_back'])
+        project.refresh_from_db()
+        self.assertEqual(project.name, 'project')
+
+    def test_only_api_views_can_be_batched(self):
+        result = self._batch([
+            {'method': 'GET', 'path': '/admin/'},
+            {'method': 'GET', 'path': '/metrics'},
+            {'method': 'GET', 'path': '/projects/'},
+            {'method': 'GET', 'path': '/api/projects/'},
+        ])
+        self.assertEqual([r['status'] for r in result['responses']], [400, 400, 400, 200])
+
+    def test_membership_changes_reach_later_checks(self):
+        project = _project(self.user)
+        other = Project.objects.create(name='other', user=self.user)
+        with views.membership_scope(self.user):
+            with self.assertNumQueries(1):
+                views._ensure_project_member(project, self.user)
+                views._ensure_project_member(project, self.user)
+            with self.assertRaises(PermissionDenied):
+                views._ensure_project_member(other, self.user)
+
+            ProjectMembership.objects.create(project=other, user=self.user)
+            views._ensure_project_member(other, self.user)
+
+            ProjectMembership.objects.filter(project=project, user=self.user).delete()
+            with self.assertRaises(PermissionDenied):
+                views._ensure_project_member(project, self.user)
+
+
+class OpenDiagramTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        self.diagram = _diagram(self.project, {'nodes': [{'id': 'n1'}]})
+        self.url = f'/api/diagrams/{self.diagram.id}/open'
+
+    def test_open_locks_and_returns_diagram_and_links(self):
+        response = self.client.post(self.url, headers=_auth(self.user))
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertFalse(body['data_unchanged'])
+        self.assertEqual(body['diagram']['data'], {'nodes': [{'id': 'n1'}]})
+        self.assertEqual(body['lock']['user']['id'], self.user.id)
+        self.assertEqual(body['links'], {'outgoing': [], 'incoming': []})
+        self.diagram.refresh_from_db()
+        self.assertEqual(self.diagram.locked_by, self.user)
+
+    def test_known_revision_skips_the_data(self):
+        response = self.client.post(
+            self.url, {'revision': self.diagram.revision}, content_type='application/json', headers=_auth(self.user),
+        )
+        body = response.json()
+        self.assertTrue(body['data_unchanged'])
+        self.assertNotIn('data', body['diagram'])
+        response = self.client.post(f'{self.url}?revision=x', headers=_auth(self.user))
+        self.assertEqual(response.status_code, 400)
+        # A body that is not an object is ignored
+        response = self.client.post(self.url, [1], content_type='application/json', headers=_auth(self.user))
+        self.assertFalse(response.json()['data_unchanged'])
+
+    def test_lock_held_by_someone_else_is_reported(self):
+        other = User.objects.create_user('other')
+        ProjectMembership.objects.create(project=self.project, user=other, role=ProjectMembership.ROLE_EDITOR)
+        self.client.post(self.url, headers=_auth(other))
+        body = self.client.post(self.url, headers=_auth(self.user)).json()
+        self.assertEqual(body['lock']['user']['id'], other.id)
+
+    def test_non_members_are_denied(self):
+        stranger = User.objects.create_user('stranger')
+        self.assertEqual(self.client.post(self.url, headers=_auth(stranger)).status_code, 403)
+        self.assertEqual(self.client.post('/api/diagrams/0/open', headers=_auth(stranger)).status_code, 404)
+
+
+class SignedTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+
+    def _get(self, token):
+        return self.client.get('/api/auth/me', headers={'Authorization': f'Bearer {token}'})
+
+    def _refresh(self, token):
+        return self.client.post('/api/auth/token/refresh', headers={'Authorization': f'Bearer {token}'})
+
+    def test_token_is_verified_from_the_cache(self):
+        token = access_tokens.issue(self.user)['token']
+        self.assertEqual(self._get(token).status_code, 200)
+        with self.assertNumQueries(0):
+            user, payload = access_tokens.verify(token)
+        self.assertEqual(user, self.user)
+
+    def test_revoked_token_stays_revoked_without_the_cache(self):
+        token = access_tokens.issue(self.user)['token']
+        access_tokens.revoke(access_tokens.verify(token)[1])
+        cache.clear()
+        self.assertEqual(self._get(token).status_code, 401)
+        self.assertEqual(self._refresh(token).status_code, 403)
+
+    def test_token_is_refreshed_once(self):
+        token = access_tokens.issue(self.user)['token']
+        response = self._refresh(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._get(response.json()['access_token']).status_code, 200)
+        cache.clear()
+        self.assertEqual(self._refresh(token).status_code, 403)
+
+    def test_expired_token_is_refreshed_within_grace(self):
+        issued_at = time.time() - 2 * 3600
+        with mock.patch('diagrams.access_tokens.time.time', return_value=issued_at):
+            token = access_tokens.issue(self.user)['token']
+        self.assertEqual(self._get(token).status_code, 401)
+        self.assertEqual(self._refresh(token).status_code, 200)
+
+    @override_settings(DIAGRAMS_SIGNED_TOKENS={'CACHE_TTL': 0})
+    def test_revocations_from_other_workers_are_seen_after_the_cache_ttl(self):
+        token = access_tokens.issue(self.user)['token']
+        self.assertEqual(self._get(token).status_code, 200)
+        # As written by another worker, without touching this one's cache
+        TokenGeneration.objects.update_or_create(user=self.user, defaults={'generation': 1})
+        self.assertEqual(self._get(token).status_code, 401)
+
+        token = access_tokens.issue(self.user)['token']
+        self.assertEqual(self._get(token).status_code, 200)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self._get(token).status_code, 401)
+
+    def test_revoke_all(self):
+        tokens = [access_tokens.issue(self.user)['token'] for _ in range(2)]
+        response = self.client.post('/api/auth/token/revoke', {'all': True}, content_type='application/json', headers={'Authorization': f'Bearer {tokens[0]}'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual([self._get(token).status_code for token in tokens], [401, 401])
+
+    def test_revoke_ignores_non_object_bodies(self):
+        tokens = [access_tokens.issue(self.user)['token'] for _ in range(2)]
+        response = self.client.post('/api/auth/token/revoke', [1], content_type='application/json', headers={'Authorization': f'Bearer {tokens[0]}'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual([self._get(token).status_code for token in tokens], [401, 200])
+
+    def test_revocation_records_are_pruned_after_the_refresh_grace(self):
+        old = access_tokens.verify(access_tokens.issue(self.user)['token'])[1]
+        access_tokens.revoke({**old, 'jti': 'old', 'exp': 3600 * 24 * 365 * 50})
+        RevokedToken.objects.filter(jti='old').update(expires_at='2000-01-01T00:00:00Z')
+        access_tokens.revoke(old)
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), [old['jti']])
+
+
+class SpatialIndexTests(TestCase):
+    DATA = {
+        'nodes': [
+            {'id': 'a', 'position': {'x': 0, 'y': 0}},
+            {'id': 'b', 'position': {'x': 500, 'y': 0}, 'width': 100, 'height': 100},
+            {'id': 'c', 'position': {'x': 1000, 'y': 1000}, 'style': {'width': 400, 'height': 400}},
+            # Relative to its parent: at 1010,1010 in diagram coordinates
+            {'id': 'd', 'parentId': 'c', 'position': {'x': 10, 'y': 10}},
+        ],
+        'edges': [
+            {'id': 'a-b', 'source': 'a', 'target': 'b'},
+            {'id': 'b-d', 'source': 'b', 'target': 'd'},
+        ],
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+
+    def _viewport(self, diagram, rect, **params):
+        query = {'x1': rect[0], 'y1': rect[1], 'x2': rect[2], 'y2': rect[3], **params}
+        return self.client.get(f'/api/diagrams/{diagram.id}/viewport', query, headers=_auth(self.user))
+
+    def _ids(self, elements):
+        return sorted(element['id'] for element in elements)
+
+    def test_indexed_and_unindexed_viewports_agree(self):
+        small = _diagram(self.project, self.DATA)
+        with override_settings(DIAGRAMS_SPATIAL_INDEX={'MIN_NODES': 2}):
+            large = _diagram(self.project, self.DATA)
+        self.assertFalse(spatial.is_indexed(small.id))
+        self.assertTrue(spatial.is_indexed(large.id))
+
+        for diagram in (small, large):
+            body = self._viewport(diagram, (1005, 1005, 1100, 1100)).json()
+            self.assertEqual(self._ids(body['nodes']), ['c', 'd'])
+            self.assertEqual(self._ids(body['edges']), ['b-d'])
+            self.assertEqual(self._ids(body['endpoints']), ['b'])
+            self.assertFalse(body['truncated'])
+            self.assertEqual(body['revision'], diagram.revision)
+
+            body = self._viewport(diagram, (0, 0, 2000, 2000), limit=2).json()
+            self.assertEqual(len(body['nodes']), 2)
+            self.assertTrue(body['truncated'])
+
+    @override_settings(DIAGRAMS_SPATIAL_INDEX={'MIN_NODES': 2})
+    def test_saves_only_rewrite_changed_elements(self):
+        diagram = _diagram(self.project, self.DATA)
+        data = json.loads(json.dumps(self.DATA))
+        data['nodes'][0]['position'] = {'x': 3000, 'y': 3000}
+        diagram.data = data
+        self.assertEqual(spatial.reindex_diagram(diagram), 1)
+        self.assertEqual(self._ids(self._viewport(diagram, (2900, 2900, 3100, 3100)).json()['nodes']), ['a'])
+
+        # Below MIN_NODES the index is dropped
+        diagram.data = {'nodes': [{'id': 'a'}]}
+        diagram.save()
+        self.assertFalse(spatial.is_indexed(diagram.id))
+
+    def test_overview_counts_nodes_per_tile(self):
+        with override_settings(DIAGRAMS_SPATIAL_INDEX={'MIN_NODES': 2}):
+            large = _diagram(self.project, self.DATA)
+        for diagram in (_diagram(self.project, self.DATA), large):
+            body = self.client.get(
+                f'/api/diagrams/{diagram.id}/overview', {'tile': 1000}, headers=_auth(self.user),
+            ).json()
+            self.assertEqual(body['bounds'], [0, 0, 1400, 1400])
+            self.assertEqual(body['tiles'], [{'x': 0, 'y': 0, 'count': 2}, {'x': 1, 'y': 1, 'count': 2}])
+            self.assertEqual((body['node_count'], body['edge_count']), (4, 2))
+
+    @override_settings(DIAGRAMS_SPATIAL_INDEX={'MIN_NODES': 2})
+    def test_diagrams_with_large_neighbouring_ids_stay_apart(self):
+        # Both ids share a float32 range in the R*Tree's diagram dimension
+        first = Diagram.objects.create(id=2 ** 24 + 1, project=self.project, name='first', data=self.DATA)
+        other_data = json.loads(json.dumps(self.DATA))
+        for node in other_data['nodes']:
+            node['id'] = f'other-{node["id"]}'
+        second = Diagram.objects.create(id=2 ** 24 + 2, project=self.project, name='second', data=other_data)
+
+        rect = (0, 0, 2000, 2000)
+        self.assertEqual(self._ids(self._viewport(first, rect).json()['nodes']), ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(self._viewport(second, rect).json()['nodes']), 4)
+        second.delete()
+        self.assertEqual(self._ids(self._viewport(first, rect).json()['nodes']), ['a', 'b', 'c', 'd'])
+
+    def test_invalid_parameters_are_rejected(self):
+        diagram = _diagram(self.project, self.DATA)
+        response = self.client.get(f'/api/diagrams/{diagram.id}/viewport', {'x1': 0}, headers=_auth(self.user))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/api/diagrams/{diagram.id}/overview', {'tile': 10}, headers=_auth(self.user))
+        self.assertEqual(response.status_code, 400)
+
+
+class LayoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+
+    @staticmethod
+    def _flow(*ids, **positions):
+        return {
+            'nodes': [{'id': node_id, **({'position': positions[node_id]} if node_id in positions else {})} for node_id in ids],
+            'edges': [{'id': f'{a}-{b}', 'source': a, 'target': b} for a, b in zip(ids, ids[1:])],
+        }
+
+    @staticmethod
+    def _positions(data):
+        return {node['id']: (node['position']['x'], node['position']['y']) for node in data['nodes']}
+
+    @staticmethod
+    def _overlapping(data):
+        boxes = spatial.node_boxes(data)
+        return [
+            (a, b) for a in boxes for b in boxes
+            if a < b and boxes[a][2] > boxes[b][0] and boxes[b][2] > boxes[a][0]
+            and boxes[a][3] > boxes[b][1] and boxes[b][3] > boxes[a][1]
+        ]
+
+    def test_layered_layout_follows_the_flow(self):
+        data = self._flow('a', 'b', 'c')
+        data['edges'].append({'id': 'c-a', 'source': 'c', 'target': 'a'})
+        result, placed = layout.layout_data(data, 'bpmn')
+        positions = self._positions(result)
+        self.assertEqual(placed, 3)
+        self.assertLess(positions['a'][0], positions['b'][0])
+        self.assertLess(positions['b'][0], positions['c'][0])
+
+        result, _ = layout.layout_data(data, 'bpmn', direction='TB')
+        positions = self._positions(result)
+        self.assertLess(positions['a'][1], positions['b'][1])
+
+    def test_force_layout_leaves_no_overlaps(self):
+        data = {
+            'nodes': [{'id': f'e{index}'} for index in range(12)],
+            'edges': [{'id': f'r{index}', 'source': 'e0', 'target': f'e{index}'} for index in range(1, 12)],
+        }
+        result, placed = layout.layout_data(data, 'erd')
+        self.assertEqual(placed, 12)
+        self.assertEqual(self._overlapping(result), [])
+
+    def test_incremental_layout_only_places_new_and_requested_nodes(self):
+        data = self._flow('a', 'b', 'c', a={'x': 0, 'y': 0}, b={'x': 300, 'y': 0})
+        result, placed = layout.layout_data(data, 'bpmn', incremental=True)
+        positions = self._positions(result)
+        self.assertEqual(placed, 1)
+        self.assertEqual(positions['a'], (0, 0))
+        self.assertEqual(positions['b'], (300, 0))
+        self.assertEqual(self._overlapping(result), [])
+
+        _, placed = layout.layout_data(data, 'bpmn', incremental=True, node_ids=['a'])
+        self.assertEqual(placed, 2)
+
+    def test_children_keep_their_relative_positions(self):
+        data = self._flow('a', 'b')
+        data['nodes'].append({'id': 'child', 'parentId': 'a', 'position': {'x': 5, 'y': 5}})
+        result, placed = layout.layout_data(data, 'bpmn')
+        self.assertEqual(placed, 2)
+        self.assertEqual(self._positions(result)['child'], (5, 5))
+
+    def test_invalid_options_are_rejected(self):
+        with self.assertRaises(layout.LayoutError):
+            layout.layout_data(self._flow('a'), 'bpmn', algorithm='circular')
+        with self.assertRaises(layout.LayoutError):
+            layout.layout_data(self._flow('a'), 'bpmn', direction='RL')
+
+    def test_endpoint_saves_a_new_revision(self):
+        diagram = _diagram(self.project, self._flow('a', 'b'))
+        url = f'/api/diagrams/{diagram.id}/layout'
+        response = self.client.post(url, {'revision': 0}, content_type='application/json', headers=_auth(self.user))
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.post(url, {'revision': 1}, content_type='application/json', headers=_auth(self.user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['placed'], response.json()['revision']), (2, 2))
+        diagram.refresh_from_db()
+        self.assertEqual(diagram.revision, 2)
+        self.assertIn('position', diagram.data['nodes'][0])
+
+        response = self.client.post(url, {'algorithm': 'circular'}, content_type='application/json', headers=_auth(self.user))
+        self.assertEqual(response.status_code, 400)
+
+        other = User.objects.create_user('other')
+        Diagram.objects.filter(id=diagram.id).update(is_locked=True, locked_by=other)
+        self.assertEqual(self.client.post(url, headers=_auth(self.user)).status_code, 409)
+
+
+class DiffingTests(TestCase):
+    base = {
+        'nodes': [
+            {'id': 'n1', 'position': {'x': 0, 'y': 0}, 'data': {'label': 'A'}},
+            {'id': 'n2', 'position': {'x': 100, 'y': 0}, 'data': {'label': 'B'}},
+        ],
+        'edges': [{'id': 'e1', 'source': 'n1', 'target': 'n2'}],
+        'viewport': {'zoom': 1},
+    }
+
+    def test_patch_turns_base_into_head(self):
+        head = {
+            'nodes': [
+                {'id': 'n1', 'position': {'x': 0, 'y': 50}, 'data': {'label': 'A2'}},
+                {'id': 'n3', 'position': {'x': 0, 'y': 0}},
+            ],
+            'edges': [],
+            'viewport': {'zoom': 2},
+        }
+        patch = diffing.make_patch(self.base, head)
+        self.assertEqual(patch['base'], diffing.content_hash(self.base))
+        self.assertEqual(diffing.apply_patch(self.base, patch), head)
+        self.assertEqual(self.base['nodes'][0]['data']['label'], 'A')
+
+        diff = diffing.diff_data(self.base, head, ignore_position=True)
+        self.assertEqual(diff['summary']['nodes'], {'added': 1, 'removed': 1, 'modified': 1})
+        self.assertEqual(diff['nodes']['modified'][0]['changes'], [{'path': ['data', 'label'], 'old': 'A', 'new': 'A2'}])
+
+    def test_patch_carries_over_elements_without_unique_ids(self):
+        data = {'nodes': [{'label': 'no id'}, {'id': 'd'}, 'text', {'id': 'n1'}, {'id': 'd', 'x': 1}]}
+        patched = diffing.apply_patch(data, {'ops': [['set', 'nodes', 'n1', ['label'], 'A'], ['add', 'nodes', {'id': 'n2'}]]})
+        self.assertEqual(
+            patched['nodes'],
+            [{'label': 'no id'}, {'id': 'd'}, 'text', {'id': 'n1', 'label': 'A'}, {'id': 'd', 'x': 1}, {'id': 'n2'}],
+        )
+        with self.assertRaisesMessage(diffing.PatchError, 'not unique'):
+            diffing.apply_patch(data, {'ops': [['remove', 'nodes', 'd']]})
+
+    def test_documents_must_be_objects(self):
+        for data in ([1, 2], 'text', 3):
+            with self.assertRaises(diffing.PatchError):
+                diffing.diff_data(data, self.base)
+            with self.assertRaises(diffing.PatchError):
+                diffing.apply_patch(data, {'ops': []})
+        with self.assertRaises(diffing.PatchError):
+            diffing.apply_patch({'nodes': 'text'}, {'ops': []})
+
+    def test_endpoints_reject_non_object_data(self):
+        cache.clear()
+        user = User.objects.create_user('owner')
+        diagram = Diagram.objects.create(name='d', project=_project(user), diagram_type='bpmn', data=[1, 2])
+        response = self.client.post(
+            f'/api/diagrams/{diagram.id}/diff', {'data': self.base}, content_type='application/json', headers=_auth(user),
+        )
+        self.assertEqual(response.status_code, 400)
+        patch = {'base': diffing.content_hash([1, 2]), 'ops': []}
+        response = self.client.post(
+            f'/api/diagrams/{diagram.id}/patch', {'patch': patch}, content_type='application/json', headers=_auth(user),
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+_job_calls = []
+
+
+@jobs.handler('tests.record')
+def _record_job(value=None, fail=False):
+    _job_calls.append(value)
+    if fail:
+        raise RuntimeError('failed')
+
+
+class LinkReconciliationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        self.source = _diagram(self.project, {'nodes': [{'id': 'a', 'data': {'label': 'Order'}}, {'id': 'b'}]})
+        self.target = _diagram(self.project, {'nodes': [{'id': 't'}]})
+        self.link = DiagramLink.objects.create(
+            source_diagram=self.source, source_element_id='a', source_element_label='Order',
+            target_diagram=self.target, target_element_id='t', created_by=self.user,
+        )
+
+    def _save(self, diagram, nodes):
+        diagram = Diagram.objects.get(id=diagram.id)
+        diagram.data = {'nodes': nodes}
+        diagram.save()
+
+    def test_removed_elements_flag_links_until_they_come_back(self):
+        self._save(self.target, [])
+        self.link.refresh_from_db()
+        self.assertTrue(self.link.is_dangling)
+        self._save(self.target, [{'id': 't'}])
+        self.link.refresh_from_db()
+        self.assertFalse(self.link.is_dangling)
+
+    def test_source_label_follows_the_element(self):
+        self._save(self.source, [{'id': 'a', 'data': {'label': 'Invoice'}}, {'id': 'b'}])
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.source_element_label, 'Invoice')
+
+    def test_only_changed_elements_are_checked(self):
+        self.assertEqual(
+            link_reconciliation.changed_element_ids(
+                {'nodes': [{'id': 'a', 'label': 'x'}, {'id': 'b'}, {'id': 'c', 'position': {'x': 0}}]},
+                {'nodes': [{'id': 'a', 'label': 'y'}, {'id': 'd'}, {'id': 'c', 'position': {'x': 9}}]},
+            ),
+            {'a', 'b', 'd'},
+        )
+        source = Diagram.objects.get(id=self.source.id)
+        source.data = {'nodes': [{'id': 'a', 'data': {'label': 'Order'}}, {'id': 'b', 'position': {'x': 1}}]}
+        self.assertEqual(link_reconciliation.reconcile_saved_diagram(source, source._saved_data), {})
+
+    @override_settings(DIAGRAMS_LINK_RECONCILIATION={'ON_REMOVED': 'delete'})
+    def test_delete_policy_removes_links(self):
+        self._save(self.source, [{'id': 'b'}])
+        self.assertFalse(DiagramLink.objects.filter(id=self.link.id).exists())
+
+    def test_command_repairs_existing_links(self):
+        Diagram.objects.filter(id=self.target.id).update(data={'nodes': []})
+        out = io.StringIO()
+        call_command('reconcile_links', stdout=out)
+        self.assertIn('Links flagged: 1', out.getvalue())
+        self.link.refresh_from_db()
+        self.assertTrue(self.link.is_dangling)
+
+
+class BulkLinkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        self.bpmn = _diagram(self.project, {'nodes': [{'id': 'a'}, {'id': 'b'}]})
+        self.erd = _diagram(self.project, {'nodes': [{'id': 't'}]}, diagram_type='erd')
+        stranger = User.objects.create_user('stranger')
+        self.foreign = _diagram(_project(stranger, 'foreign'))
+
+    def _post(self, links, **options):
+        return self.client.post(
+            '/api/links/bulk', {'links': links, **options}, content_type='application/json', headers=_auth(self.user),
+        )
+
+    def _link(self, element_id, target=None, **fields):
+        return {
+            'source_diagram': self.bpmn.id, 'source_element_id': element_id,
+            'target_diagram': (target or self.erd).id, **fields,
+        }
+
+    def test_valid_items_are_created_and_invalid_ones_reported(self):
+        response = self._post([
+            self._link('a', link_type='data_source'),
+            self._link('b', target=self.foreign),
+            self._link('b', target=self.bpmn),
+            {**self._link('b'), 'source_diagram': self.foreign.id},
+        ])
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'invalid', 'invalid', 'invalid'])
+        self.assertNotIn('warnings', results[0])
+        self.assertIn('target_diagram', results[1]['errors'])
+        self.assertEqual(DiagramLink.objects.count(), 1)
+
+    def test_atomic_request_creates_nothing_unless_all_are_valid(self):
+        response = self._post([self._link('a'), self._link('b', target=self.foreign)], atomic=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.json()['results']], ['skipped', 'invalid'])
+        self.assertFalse(DiagramLink.objects.exists())
+
+    @override_settings(DIAGRAMS_BULK_LINKS_MAX=1)
+    def test_item_count_is_limited(self):
+        self.assertEqual(self._post([self._link('a'), self._link('b')]).status_code, 400)
+
+    def test_delete_by_id_and_by_element(self):
+        self._post([self._link('a'), self._link('b')])
+        first, second = DiagramLink.objects.order_by('id')
+        foreign_link = DiagramLink.objects.create(
+            source_diagram=self.foreign, source_element_id='x', target_diagram=self.foreign, target_element_id='y',
+        )
+        response = self.client.delete(
+            '/api/links/bulk',
+            {'ids': [first.id, foreign_link.id], 'elements': [{'diagram': self.bpmn.id, 'element_id': 'b'}]},
+            content_type='application/json', headers=_auth(self.user),
+        )
+        self.assertEqual(response.json(), {'deleted': 2, 'not_found': [foreign_link.id]})
+        self.assertEqual(list(DiagramLink.objects.values_list('id', flat=True)), [foreign_link.id])
+
+
+@override_settings(DIAGRAMS_DELETION={'RUN_IN_PROCESS': False, 'CHUNK_SIZE': 2})
+class DeletionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        self.diagrams = [_diagram(self.project, name=f'd{index}') for index in range(3)]
+        self.other_project = _project(self.user, 'other')
+        self.linked = _diagram(self.other_project)
+        for index in range(3):
+            DiagramLink.objects.create(
+                source_diagram=self.diagrams[0], source_element_id=f'e{index}', target_diagram=self.linked,
+            )
+
+    def test_project_is_hidden_at_once_and_purged_later(self):
+        response = self.client.delete(f'/api/projects/{self.project.id}/', headers=_auth(self.user))
+        self.assertEqual(response.status_code, 202)
+        task_id = response.json()['id']
+        self.assertEqual((response.json()['status'], response.json()['total']), ('pending', 3))
+        projects = self.client.get('/api/projects/', headers=_auth(self.user)).json()
+        self.assertEqual([project['name'] for project in projects], ['other'])
+        self.assertFalse(Diagram.objects.filter(project=self.project).exists())
+        self.assertEqual(Diagram.all_objects.filter(project=self.project).count(), 3)
+
+        deletion.process(task_id)
+        body = self.client.get(f'/api/deletions/{task_id}', headers=_auth(self.user)).json()
+        self.assertEqual((body['status'], body['purged'], body['progress']), ('done', 3, 1.0))
+        self.assertFalse(Project.all_objects.filter(id=self.project.id).exists())
+        self.assertFalse(Diagram.all_objects.filter(project_id=self.project.id).exists())
+        self.assertFalse(DiagramLink.all_objects.exists())
+        self.assertTrue(Diagram.objects.filter(id=self.linked.id).exists())
+
+    def test_purge_is_queued_for_the_job_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/projects/{self.project.id}/', headers=_auth(self.user))
+        self.assertEqual([jobs.run(job) for job in jobs.claim('test', limit=10)], ['done'])
+        self.assertFalse(Project.all_objects.filter(id=self.project.id).exists())
+
+    def test_task_progress_is_private(self):
+        task = deletion.delete_diagram(self.diagrams[1], self.user)
+        stranger = User.objects.create_user('stranger')
+        self.assertEqual(self.client.get(f'/api/deletions/{task.id}', headers=_auth(stranger)).status_code, 404)
+
+    def test_purge_command_catches_up(self):
+        task = deletion.delete_diagram(self.diagrams[0], self.user)
+        out = io.StringIO()
+        call_command('purge_deleted', stdout=out)
+        self.assertIn('Purged: 1, failed: 0.', out.getvalue())
+        task.refresh_from_db()
+        self.assertEqual(task.rows_deleted, 4)
+        self.assertEqual(Diagram.all_objects.filter(project=self.project).count(), 2)
+        # Purging again finds nothing to do
+        self.assertIsNone(deletion.process(task.id))
+
+    @staticmethod
+    def _rtree_entries():
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {spatial.RTREE_TABLE}')
+            return cursor.fetchone()[0]
+
+    @override_settings(DIAGRAMS_SPATIAL_INDEX={'MIN_NODES': 1})
+    def test_purging_removes_the_spatial_index(self):
+        nodes = [{'id': f'n{index}', 'position': {'x': index * 100, 'y': 0}} for index in range(5)]
+        diagram = _diagram(self.project, {'nodes': nodes})
+        self.assertEqual(self._rtree_entries(), 5)
+        deletion.purge_diagram(diagram.id, 2)
+        self.assertEqual(self._rtree_entries(), 0)
+        self.assertFalse(DiagramElementIndex.objects.exists())
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        _job_calls.clear()
+
+    def _run_ready(self):
+        return [jobs.run(job) for job in jobs.claim('test', limit=10)]
+
+    def test_queued_jobs_are_deduplicated_and_run(self):
+        first = jobs.enqueue('tests.record', {'value': 1}, dedupe_key='k')
+        self.assertEqual(jobs.enqueue('tests.record', {'value': 2}, dedupe_key='k'), first)
+        jobs.enqueue('tests.record', {'value': 3}, priority=5)
+        self.assertEqual(self._run_ready(), ['done', 'done'])
+        self.assertEqual(_job_calls, [3, 1])
+
+    def test_failing_job_is_retried_until_max_attempts(self):
+        job = jobs.enqueue('tests.record', {'fail': True}, max_attempts=2)
+        with self.assertLogs('diagrams.jobs', 'ERROR'):
+            self.assertEqual(self._run_ready(), ['retry'])
+            Job.objects.filter(id=job.id).update(run_after=timezone.now())
+            self.assertEqual(self._run_ready(), ['failed'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+
+    def _stale(self, job):
+        jobs.claim('dead worker')
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(hours=1))
+
+    def test_requeued_stale_job_still_deduplicates(self):
+        job = jobs.enqueue('tests.record', {'value': 1}, dedupe_key='k')
+        self._stale(job)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.enqueue('tests.record', {'value': 2}, dedupe_key='k'), job)
+        self.assertEqual(self._run_ready(), ['done'])
+        self.assertEqual(_job_calls, [1])
+
+    def test_stale_job_is_left_to_an_identical_queued_one(self):
+        job = jobs.enqueue('tests.record', {'value': 1}, dedupe_key='k')
+        self._stale(job)
+        newer = jobs.enqueue('tests.record', {'value': 2}, dedupe_key='k')
+        self.assertNotEqual(newer, job)
+        jobs.requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), (Job.STATUS_FAILED, jobs.SUPERSEDED))
+        self.assertEqual(self._run_ready(), ['done'])
+        self.assertEqual(_job_calls, [2])
+
+    @override_settings(DIAGRAMS_JOBS={'EAGER': True})
+    def test_eager_jobs_run_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(jobs.enqueue('tests.record', {'value': 1}))
+            self.assertEqual(_job_calls, [])
+        self.assertEqual(_job_calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_guest_login_cleans_up_when_no_worker_claims_the_job(self):
+        cache.clear()
+        old_guest = User.objects.create_user('guest_old')
+        GuestProfile.objects.create(user=old_guest)
+        GuestProfile.objects.filter(user=old_guest).update(created_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(self.client.post('/api/auth/guest').status_code, 201)
+        self.assertTrue(User.objects.filter(id=old_guest.id).exists())
+
+        Job.objects.filter(name='guests.cleanup').update(run_after=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('diagrams.jobs', 'WARNING'):
+            self.assertEqual(self.client.post('/api/auth/guest').status_code, 201)
+        self.assertFalse(User.objects.filter(id=old_guest.id).exists())
+        self.assertEqual(Job.objects.get(name='guests.cleanup').status, Job.STATUS_DONE)
+
+
+class ActivityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self._reset_buffer()
+        self.addCleanup(self._reset_buffer)
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        self.diagram = _diagram(self.project)
+
+    @staticmethod
+    def _reset_buffer():
+        with activity.buffer._lock:
+            activity.buffer._pending.clear()
+            activity.buffer._pending_ids.clear()
+            activity.buffer._increments.clear()
+            activity.buffer._latest.clear()
+
+    def _feed(self, user=None, **params):
+        return self.client.get(
+            f'/api/projects/{self.project.id}/activity', params, headers=_auth(user or self.user),
+        )
+
+    def _autosave(self, index):
+        # Entries are buffered once the request's transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(
+                f'/api/diagrams/{self.diagram.id}/', {'data': {'nodes': [{'id': f'n{index}'}]}},
+                content_type='application/json', headers=_auth(self.user),
+            )
+
+    def test_autosave_bursts_collapse_into_one_entry(self):
+        for index in range(3):
+            self.assertEqual(self._autosave(index).status_code, 200)
+        results = self._feed().json()['results']
+        self.assertEqual([(entry['action'], entry['count']) for entry in results], [('diagram.update', 3)])
+        self.assertEqual(results[0]['username'], 'owner')
+
+        # Saves after the entry was written still collapse into it
+        self._autosave(3)
+        self.assertEqual(self._feed().json()['results'][0]['count'], 4)
+
+    def test_other_users_and_actions_get_their_own_entries(self):
+        other = User.objects.create_user('other')
+        with self.captureOnCommitCallbacks(execute=True):
+            activity.record(self.project.id, self.user, 'diagram.update', self.diagram)
+            activity.record(self.project.id, other, 'diagram.update', self.diagram)
+            activity.record(self.project.id, self.user, 'diagram.update', self.diagram, {'via': 'layout'})
+        self.assertEqual(len(self._feed().json()['results']), 3)
+
+    @override_settings(DIAGRAMS_ACTIVITY={'PAGE_SIZE': 2})
+    def test_feed_is_paged_newest_first(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(3):
+                activity.record(self.project.id, self.user, 'project.update', self.project, {'step': index})
+        first = self._feed().json()
+        self.assertEqual([entry['details']['step'] for entry in first['results']], [2, 1])
+        second = self._feed(before=first['next_before']).json()
+        self.assertEqual([entry['details']['step'] for entry in second['results']], [0])
+        self.assertIsNone(second['next_before'])
+        self.assertEqual(self._feed(before='x').status_code, 400)
+
+    def test_rolled_back_work_is_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = self.client.post('/api/batch', {'atomic': True, 'requests': [
+                {'method': 'PUT', 'path': f'/api/diagrams/{self.diagram.id}/', 'body': {'name': 'renamed'}},
+                {'method': 'GET', 'path': '/api/projects/999999/'},
+            ]}, content_type='application/json', headers=_auth(self.user)).json()
+        self.assertTrue(result['rolled_back'])
+        self.assertEqual(self._feed().json()['results'], [])
+
+    def test_feed_is_limited_to_members(self):
+        stranger = User.objects.create_user('stranger')
+        self.assertEqual(self._feed(stranger).status_code, 403)
+
+    @override_settings(DIAGRAMS_ACTIVITY={'ENABLED': False})
+    def test_disabled_log_records_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            activity.record(self.project.id, self.user, 'project.update', self.project)
+        self.assertEqual(self._feed().json()['results'], [])
+
+
+class UploadLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.diagram = _diagram(_project(self.user))
+
+    def _put(self, body, **headers):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        return self.client.put(
+            f'/api/diagrams/{self.diagram.id}/', body, content_type='application/json', headers={**_auth(self.user), **headers},
+        )
+
+    def _stored(self):
+        return Diagram.objects.get(id=self.diagram.id).data
+
+    def test_gzip_and_string_documents_are_accepted(self):
+        body = gzip.compress(json.dumps({'data': {'nodes': [{'id': 'gz'}]}}).encode())
+        self.assertEqual(self._put(body, content_encoding='gzip').status_code, 200)
+        self.assertEqual(self._stored(), {'nodes': [{'id': 'gz'}]})
+
+        self.assertEqual(self._put({'data': json.dumps({'nodes': [{'id': 'str'}]})}).status_code, 200)
+        self.assertEqual(self._stored(), {'nodes': [{'id': 'str'}]})
+
+    @override_settings(DIAGRAMS_UPLOADS={'MAX_BODY_BYTES': 1000})
+    def test_bodies_over_the_limit_are_rejected(self):
+        document = {'data': {'nodes': [{'id': str(index)} for index in range(100)]}}
+        self.assertEqual(self._put(document).status_code, 413)
+        # Checked after inflating, however well it compresses
+        self.assertEqual(self._put(gzip.compress(json.dumps(document).encode()), content_encoding='gzip').status_code, 413)
+
+    @override_settings(DIAGRAMS_UPLOADS={'MAX_NODES': 2, 'MAX_DEPTH': 5})
+    def test_documents_over_the_limits_are_rejected(self):
+        self.assertEqual(self._put({'data': {'nodes': [{'id': 1}, {'id': 2}, {'id': 3}]}}).status_code, 413)
+        self.assertEqual(self._put({'data': {'nodes': [{'id': 1, 'data': {'a': {'b': {'c': {}}}}}]}}).status_code, 413)
+        self.assertEqual(self._put({'data': json.dumps({'nodes': [{'id': 1}, {'id': 2}, {'id': 3}]})}).status_code, 413)
+        self.assertEqual(self._stored(), {'nodes': []})
+
+    def test_bad_encodings_are_rejected(self):
+        self.assertEqual(self._put(b'{}', content_encoding='br').status_code, 415)
+        self.assertEqual(self._put(b'not gzip', content_encoding='gzip').status_code, 400)
+        self.assertEqual(self._put(gzip.compress(b'{"data": {}}')[:-4], content_encoding='gzip').status_code, 400)
+        with override_settings(DIAGRAMS_UPLOADS={'ACCEPT_GZIP': False}):
+            self.assertEqual(self._put(gzip.compress(b'{}'), content_encoding='gzip').status_code, 415)
+
+
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        nodes = [{'id': f'n{index}', 'data': {'label': f'Task {index}'}} for index in range(1000)]
+        self.diagram = _diagram(self.project, {'nodes': nodes})
+        self.url = f'/api/diagrams/{self.diagram.id}/'
+
+    def _get(self, **headers):
+        return self.client.get(self.url, headers={**_auth(self.user), **headers})
+
+    def _compressions(self, result):
+        snapshot = metrics.registry.snapshot()['counters']
+        return sum(
+            value for name, labels, value in snapshot
+            if name == 'response_compression_total' and dict(labels)['cache'] == result
+        )
+
+    def test_large_diagrams_are_gzipped_once_per_revision(self):
+        first = self._get(accept_encoding='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', first['Vary'])
+        self.assertTrue(first['ETag'].startswith('W/"d'))
+        self.assertEqual(json.loads(gzip.decompress(first.content))['data'], self.diagram.data)
+
+        second = self._get(accept_encoding='gzip')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual((self._compressions('miss'), self._compressions('hit')), (1, 1))
+
+    def test_matching_etag_gets_not_modified(self):
+        etag = self._get(accept_encoding='gzip')['ETag']
+        self.assertEqual(self._get(if_none_match=etag).status_code, 304)
+        self.assertEqual(self._get(if_none_match=etag.removeprefix('W/')).status_code, 304)
+
+        # The lock state is part of the representation
+        self.client.post(f'/api/diagrams/{self.diagram.id}/lock', headers=_auth(self.user))
+        self.assertEqual(self._get(if_none_match=etag).status_code, 200)
+
+    @override_settings(DIAGRAMS_COMPRESSION={'GZIP_LEVELS': [(None, 1)]})
+    def test_cached_bodies_are_not_shared_between_media_types(self):
+        html = self._get(accept_encoding='gzip', accept='text/html')
+        self.assertTrue(html['Content-Type'].startswith('text/html'))
+        response = self._get(accept_encoding='gzip', accept='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['data'], self.diagram.data)
+        self.assertIn('Accept', response['Vary'])
+        self.assertNotEqual(response['ETag'], html['ETag'])
+        self.assertEqual(self._get(accept='application/json', if_none_match=html['ETag']).status_code, 200)
+
+    def test_small_or_unaccepted_responses_are_left_alone(self):
+        self.assertNotIn('Content-Encoding', self._get())
+        self.assertNotIn('Content-Encoding', self._get(accept_encoding='gzip;q=0'))
+        response = self.client.get('/api/projects/', headers={**_auth(self.user), 'accept-encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_level_follows_body_size(self):
+        levels = compression.get_compression_settings()['GZIP_LEVELS']
+        self.assertEqual(compression.level_for(levels, 1000), 6)
+        self.assertEqual(compression.level_for(levels, 500 * 1024), 4)
+        self.assertEqual(compression.level_for(levels, 50 * 1024 * 1024), 1)
+
+
+class UnchangedSaveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.user = User.objects.create_user('owner')
+        self.diagram = _diagram(_project(self.user), {'nodes': [{'id': 'n1', 'position': {'x': 1, 'y': 2}}]})
+
+    def _put(self, payload):
+        return self.client.put(
+            f'/api/diagrams/{self.diagram.id}/', payload, content_type='application/json', headers=_auth(self.user),
+        )
+
+    def _saves(self, outcome):
+        for name, labels, value in metrics.registry.snapshot()['counters']:
+            if name == 'diagram_saves_total' and dict(labels) == {'outcome': outcome}:
+                return value
+        return 0
+
+    def test_same_document_is_not_written(self):
+        stored = Diagram.objects.get(id=self.diagram.id)
+        # Key order does not matter
+        response = self._put({'data': {'nodes': [{'position': {'y': 2, 'x': 1}, 'id': 'n1'}]}})
+        self.assertEqual(response.json()['revision'], 1)
+        self.assertEqual(Diagram.objects.get(id=self.diagram.id).updated_at, stored.updated_at)
+        self.assertEqual((self._saves('unchanged'), self._saves('saved')), (1, 0))
+
+    def test_changes_are_written(self):
+        self.assertEqual(self._put({'data': self.diagram.data, 'name': 'renamed'}).json()['revision'], 2)
+        self.assertEqual(self._put({'data': {'nodes': []}}).json()['revision'], 3)
+        diagram = Diagram.objects.get(id=self.diagram.id)
+        self.assertEqual(diagram.data_hash, diffing.content_hash({'nodes': []}))
+        self.assertEqual(self._saves('saved'), 2)
+
+    def test_rows_without_a_stored_hash_are_compared_by_content(self):
+        Diagram.objects.filter(id=self.diagram.id).update(data_hash='')
+        self.assertEqual(self._put({'data': self.diagram.data}).json()['revision'], 1)
+        self.assertEqual(self._saves('unchanged'), 1)
+
+
+class WriteCoalescingTests(TransactionTestCase):
+    # Requests in a TestCase run inside its transaction, which coalescing leaves alone
+    def setUp(self):
+        cache.clear()
+        journal_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(journal_dir.cleanup)
+        self.journal_dir = journal_dir.name
+        settings = override_settings(DIAGRAMS_WRITE_COALESCING={
+            'ENABLED': True, 'FLUSH_INTERVAL': 3600, 'JOURNAL_DIR': self.journal_dir, 'FSYNC': False,
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(self._reset_coalescer)
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+        self.diagram = _diagram(self.project)
+
+    @staticmethod
+    def _reset_coalescer():
+        coalescer = coalescing.coalescer
+        with coalescer._lock:
+            coalescer._slots.clear()
+            coalescer._revisions.clear()
+            if coalescer._journal is not None:
+                coalescer._journal.close()
+                coalescer._journal = None
+            coalescer._retired.clear()
+
+    def _submit(self, diagram, document):
+        coalescing.submit(diagram, document, diffing.content_hash(document))
+
+    def _stored(self):
+        return Diagram.objects.filter(id=self.diagram.id).values('revision', 'data').get()
+
+    def test_autosave_is_acknowledged_and_written_on_flush(self):
+        response = self.client.put(
+            f'/api/diagrams/{self.diagram.id}/', {'data': {'nodes': [{'id': 'n1'}]}},
+            content_type='application/json', headers=_auth(self.user),
+        )
+        self.assertEqual(response.json()['revision'], 2)
+        self.assertEqual(self._stored()['revision'], 1)
+        self.assertEqual(Diagram.objects.get(id=self.diagram.id).data, {'nodes': [{'id': 'n1'}]})
+        self.assertEqual(coalescing.flush(), 1)
+        self.assertEqual(self._stored(), {'revision': 2, 'data': {'nodes': [{'id': 'n1'}]}})
+
+    def test_updates_in_an_atomic_batch_are_not_coalesced(self):
+        result = self.client.post('/api/batch', {'atomic': True, 'requests': [
+            {'method': 'PUT', 'path': f'/api/diagrams/{self.diagram.id}/', 'body': {'data': {'nodes': [{'id': 'n1'}]}}},
+            {'method': 'GET', 'path': f'/api/diagrams/{self.diagram.id}/'},
+            {'method': 'GET', 'path': '/api/projects/999999/'},
+        ]}, content_type='application/json', headers=_auth(self.user)).json()
+        self.assertTrue(result['rolled_back'])
+        # Later requests of the batch saw the update
+        self.assertEqual(result['responses'][1]['body']['data'], {'nodes': [{'id': 'n1'}]})
+        self.assertFalse(coalescing.pending(self.diagram.id))
+        coalescing.flush()
+        self.assertEqual(self._stored(), {'revision': 1, 'data': {'nodes': []}})
+
+    def test_direct_save_from_a_stale_instance_gets_a_newer_revision(self):
+        stale = Diagram.objects.get(id=self.diagram.id)
+        self._submit(Diagram.objects.get(id=self.diagram.id), {'nodes': [{'id': 'pending'}]})
+        stale.data = {'nodes': [{'id': 'direct'}]}
+        stale.revision = coalescing.next_revision(stale)
+        stale.save(update_fields=['data', 'data_hash', 'revision', 'updated_at'])
+        self.assertEqual(stale.revision, 3)
+        # The older pending write is superseded, not written over the newer one
+        self.assertFalse(coalescing.pending(self.diagram.id))
+        self.assertEqual(coalescing.flush(), 0)
+        self.assertEqual(self._stored(), {'revision': 3, 'data': {'nodes': [{'id': 'direct'}]}})
+
+    def test_autosave_from_a_stale_instance_gets_a_newer_revision(self):
+        stale = Diagram.objects.get(id=self.diagram.id)
+        direct = Diagram.objects.get(id=self.diagram.id)
+        direct.revision = coalescing.next_revision(direct)
+        direct.save()
+        self._submit(stale, {'nodes': [{'id': 'pending'}]})
+        self.assertEqual(stale.revision, 3)
+        coalescing.flush()
+        self.assertEqual(self._stored()['revision'], 3)
+
+    def test_saves_are_not_tracked_while_disabled(self):
+        tracked = dict(coalescing.coalescer._revisions)
+        with override_settings(DIAGRAMS_WRITE_COALESCING={'ENABLED': False}):
+            self.diagram.revision = coalescing.next_revision(self.diagram)
+            self.diagram.save()
+        self.assertEqual(coalescing.coalescer._revisions, tracked)
+
+    def test_project_list_shows_pending_updates(self):
+        self._submit(Diagram.objects.get(id=self.diagram.id), {'nodes': [{'id': 'n1'}]})
+        slot_time = coalescing.pending_project_updates()[self.project.id]
+        response = self.client.get('/api/projects/', headers=_auth(self.user))
+        self.assertEqual(response.json()[0]['last_diagram_update'], slot_time.isoformat().replace('+00:00', 'Z'))
+
+    def test_journals_of_dead_processes_are_replayed(self):
+        entries = [
+            {'id': self.diagram.id, 'revision': 3, 'data_hash': 'x', 'data': {'nodes': [{'id': 'latest'}]}},
+            {'id': self.diagram.id, 'revision': 2, 'data_hash': 'x', 'data': {'nodes': [{'id': 'older'}]}},
+        ]
+        # A pid that is not running
+        path = os.path.join(self.journal_dir, 'journal-999999999-1.log')
+        with open(path, 'w') as journal:
+            journal.write(''.join(json.dumps(entry) + '\n' for entry in entries) + '{"torn')
+        with self.assertLogs('diagrams.coalescing', 'WARNING'):
+            self.assertEqual(coalescing.recover(), 1)
+        self.assertEqual(self._stored(), {'revision': 3, 'data': {'nodes': [{'id': 'latest'}]}})
+        self.assertFalse(os.path.exists(path))
+
+
+class RoutingTests(TestCase):
+    SAMPLES = {'int': '12', 'str': 'abc'}
+
+    def _variant_paths(self):
+        """A concrete path for every URL pattern of every endpoint."""
+        for e in api_endpoints:
+            for pattern in e.variants.values():
+                route = re.sub(
+                    r'<(?:(\w+):)?\w+>', lambda match: self.SAMPLES[match[1] or 'str'], str(pattern.pattern),
+                )
+                yield route, pattern
+
+    def test_tree_resolves_like_the_plain_patterns(self):
+        tree = RouteTree(api_endpoints)
+        plain = URLResolver(RoutePattern(''), [pattern for _, pattern in self._variant_paths()])
+        for route, pattern in self._variant_paths():
+            with self.subTest(route=route):
+                expected, found = plain.resolve(route), tree.resolve(route)
+                self.assertEqual((found.url_name, found.kwargs), (expected.url_name, expected.kwargs))
+                self.assertEqual(found.url_name, pattern.name)
+
+    def test_both_slash_variants_and_legacy_aliases_resolve(self):
+        self.assertEqual(resolve('/api/diagrams/5/').url_name, 'diagram_detail')
+        self.assertEqual(resolve('/api/diagrams/5').url_name, 'diagram_detail_no_slash')
+        self.assertEqual(resolve('/api/diagrams/5/lock/').url_name, 'diagram_lock')
+        self.assertEqual(resolve('/diagrams/5/lock').url_name, 'legacy_diagram_lock')
+        self.assertEqual(resolve('/api/diagrams/5/lock').kwargs, {'diagram_id': 5})
+        self.assertEqual(reverse('legacy_projects'), '/projects/')
+
+    def test_literal_segments_win_over_parameters(self):
+        self.assertEqual(resolve('/api/links/bulk').url_name, 'link_bulk')
+        self.assertEqual(resolve('/api/links/7').url_name, 'link_detail')
+
+    def test_unknown_paths_do_not_resolve(self):
+        for path in ('/api/', '/api/diagrams/x/lock', '/api/diagrams/5/unknown', '/api//diagrams/5'):
+            with self.subTest(path=path), self.assertRaises(Resolver404):
+                resolve(path)
+
+
+class LoadTestHarnessTests(TestCase):
+    def test_summary_reports_percentiles_and_error_rates(self):
+        stats = loadtest.Stats()
+        for index in range(1, 101):
+            stats.record('autosave', 200 if index <= 95 else 429, index / 1000)
+        stats.record('lock', 0, 0.5)
+        stats.lock_acquired, stats.lock_conflicts = 3, 1
+        summary = stats.summary(elapsed=10)
+
+        autosave = summary['operations']['autosave']
+        self.assertEqual((autosave['p50'], autosave['p90'], autosave['p99'], autosave['max']), (0.05, 0.09, 0.099, 0.1))
+        self.assertEqual((autosave['errors'], autosave['statuses']), (5, {200: 95, 429: 5}))
+        self.assertEqual((summary['requests'], summary['errors'], summary['rps']), (101, 6, 10.1))
+        self.assertEqual(summary['lock_conflict_rate'], 0.25)
+
+    def test_documents_are_repeatable_per_seed(self):
+        document = loadtest.diagram_document(50, random.Random(1))
+        self.assertEqual(document, loadtest.diagram_document(50, random.Random(1)))
+        self.assertEqual(len(document['nodes']), 50)
+        node_ids = {node['id'] for node in document['nodes']}
+        self.assertTrue(all(edge['source'] in node_ids and edge['target'] in node_ids for edge in document['edges']))
+
+    def test_unreachable_server_is_reported(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        with self.assertRaisesMessage(CommandError, 'is the server running?'):
+            call_command('loadtest', base_url=f'http://127.0.0.1:{port}', duration=0.1, timeout=1, stdout=io.StringIO())
+
+
+@override_settings(DIAGRAMS_PRESENCE={'BACKEND': 'cache', 'TTL': 30})
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.editor = User.objects.create_user('editor')
+        self.project = _project(self.owner)
+        ProjectMembership.objects.create(project=self.project, user=self.editor, role=ProjectMembership.ROLE_EDITOR)
+        self.diagram = _diagram(self.project)
+        self.url = f'/api/diagrams/{self.diagram.id}/presence'
+
+    def _heartbeat(self, user, mode='viewing'):
+        return self.client.post(self.url, {'mode': mode}, content_type='application/json', headers=_auth(user))
+
+    @staticmethod
+    def _names(people):
+        return [person['username'] for person in people]
+
+    def test_heartbeats_show_who_is_viewing_and_editing(self):
+        self._heartbeat(self.owner)
+        body = self._heartbeat(self.editor, 'editing').json()
+        self.assertEqual((self._names(body['viewing']), self._names(body['editing']), body['ttl']), (['owner'], ['editor'], 30))
+
+        self.client.delete(self.url, headers=_auth(self.editor))
+        body = self._heartbeat(self.owner).json()
+        self.assertEqual((self._names(body['viewing']), body['editing']), (['owner'], []))
+
+    def test_entries_expire_after_the_ttl(self):
+        now = time.time()
+        with mock.patch('diagrams.presence.time.time', return_value=now):
+            self._heartbeat(self.editor)
+        with mock.patch('diagrams.presence.time.time', return_value=now + 31):
+            self.assertEqual(self._heartbeat(self.owner).json()['viewing'][0]['username'], 'owner')
+            self.assertEqual(len(presence.project_presence(self.project.id)[self.diagram.id]['viewing']), 1)
+
+    def test_unchanged_heartbeats_within_half_the_ttl_are_not_written(self):
+        store = presence.get_store()
+        with mock.patch.object(store, '_store', wraps=store._store) as written:
+            now = time.time()
+            for offset in (0, 5, 14):
+                with mock.patch('diagrams.presence.time.time', return_value=now + offset):
+                    presence.touch(self.project.id, self.diagram.id, self.owner)
+            self.assertEqual(written.call_count, 1)
+            with mock.patch('diagrams.presence.time.time', return_value=now + 16):
+                presence.touch(self.project.id, self.diagram.id, self.owner)
+            presence.touch(self.project.id, self.diagram.id, self.owner, presence.EDITING)
+            self.assertEqual(written.call_count, 3)
+
+    def test_project_presence_includes_lock_holders(self):
+        self._heartbeat(self.editor, 'editing')
+        self.client.post(f'/api/diagrams/{self.diagram.id}/lock', headers=_auth(self.editor))
+        locked_only = _diagram(self.project, name='locked')
+        Diagram.objects.filter(id=locked_only.id).update(is_locked=True, locked_by=self.owner)
+
+        body = self.client.get(f'/api/projects/{self.project.id}/presence', headers=_auth(self.owner)).json()
+        diagrams = {entry['diagram_id']: entry for entry in body['diagrams']}
+        self.assertEqual(diagrams[self.diagram.id]['lock']['user']['username'], 'editor')
+        self.assertEqual(self._names(diagrams[self.diagram.id]['editing']), ['editor'])
+        self.assertEqual(diagrams[locked_only.id]['lock']['user']['username'], 'owner')
+        self.assertEqual(self._names(body['users']), ['editor'])
+
+    def test_invalid_mode_and_strangers_are_rejected(self):
+        self.assertEqual(self._heartbeat(self.owner, 'lurking').status_code, 400)
+        stranger = User.objects.create_user('stranger')
+        self.assertEqual(self._heartbeat(stranger).status_code, 403)
+        response = self.client.get(f'/api/projects/{self.project.id}/presence', headers=_auth(stranger))
+        self.assertEqual(response.status_code, 403)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+
+    def _projects(self):
+        return {project['name']: project for project in self.client.get('/api/projects/', headers=_auth(self.user)).json()}
+
+    def test_aggregates(self):
+        member = User.objects.create_user('member')
+        ProjectMembership.objects.create(project=self.project, user=member, role=ProjectMembership.ROLE_VIEWER)
+        bpmn = _diagram(self.project)
+        _diagram(self.project)
+        erd = _diagram(self.project, diagram_type='erd')
+        deleted = _diagram(self.project, diagram_type='dfd')
+        Diagram.all_objects.filter(id=deleted.id).update(deleted_at=timezone.now())
+        other = _project(self.user, 'other')
+        other_diagram = _diagram(other)
+        DiagramLink.objects.create(source_diagram=bpmn, source_element_id='a', target_diagram=erd)
+        DiagramLink.objects.create(source_diagram=bpmn, source_element_id='b', target_diagram=other_diagram)
+        DiagramLink.objects.create(source_diagram=other_diagram, source_element_id='c', target_diagram=bpmn)
+        Diagram.objects.filter(id=erd.id).update(is_locked=True, locked_by=member)
+
+        projects = self._projects()
+        project = projects['project']
+        self.assertEqual(project['diagram_count'], 3)
+        self.assertEqual(project['diagram_counts'], {'bpmn': 2, 'erd': 1, 'dfd': 0})
+        self.assertEqual((project['member_count'], project['link_count'], project['locks_held']), (2, 2, 1))
+        latest = Diagram.objects.filter(project=self.project).latest('updated_at').updated_at
+        self.assertEqual(parse_datetime(project['last_diagram_update']), latest)
+        self.assertEqual((projects['other']['link_count'], projects['other']['locks_held']), (1, 0))
+
+    @override_settings(DIAGRAMS_RESPONSE_CACHE={'ENABLED': False})
+    def test_query_count_does_not_grow_with_projects(self):
+        _diagram(self.project)
+        # Creates the token before the queries are counted
+        _auth(self.user)
+        with CaptureQueriesContext(connection) as one:
+            self._projects()
+        for index in range(3):
+            project = _project(self.user, f'project {index}')
+            _diagram(project, diagram_type='erd')
+        with CaptureQueriesContext(connection) as four:
+            self.assertEqual(len(self._projects()), 4)
+        self.assertEqual(len(four), len(one))
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.project = _project(self.user)
+
+    def _diagram(self, nodes):
+        return _diagram(self.project, {'nodes': nodes})
+
+    def _queued_renders(self):
+        return Job.objects.filter(name='thumbnails.render', status=Job.STATUS_QUEUED).count()
+
+    def test_only_saves_that_change_the_document_schedule_a_render(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            diagram = self._diagram([{'id': 'n1'}])
+        self.assertEqual(self._queued_renders(), 1)
+        Job.objects.all().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Diagram.objects.get(id=diagram.id).save()
+        self.assertEqual(self._queued_renders(), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            loaded = Diagram.objects.get(id=diagram.id)
+            loaded.data = {'nodes': [{'id': 'n2'}]}
+            loaded.save()
+        self.assertEqual(self._queued_renders(), 1)
+
+    def test_thumbnails_are_served_for_the_current_hash_of_the_object_only(self):
+        diagram = self._diagram([{'id': 'n1', 'position': {'x': 0, 'y': 0}}])
+        other = self._diagram([{'id': 'other', 'position': {'x': 0, 'y': 0}}])
+        url = thumbnails.thumbnail_url('diagram', diagram)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertTrue(DiagramThumbnail.objects.filter(content_hash=diagram.data_hash).exists())
+
+        # The stored thumbnail is not reachable through another object
+        self.assertEqual(self.client.get(url.replace(f'/{diagram.id}/', f'/{other.id}/')).status_code, 404)
+
+        diagram.data = {'nodes': []}
+        diagram.save()
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': response['ETag']}).status_code, 404)
+        self.assertEqual(self.client.get(thumbnails.thumbnail_url('diagram', diagram)).status_code, 200)
+
+    def test_png_thumbnails_are_valid_images(self):
+        content = thumbnails.render_png({'nodes': [{'id': 'n1', 'position': {'x': 0, 'y': 0}}]}, 40, 30)
+        self.assertTrue(content.startswith(b'\x89PNG\r\n\x1a\n'))
+        width, height = struct.unpack('>II', content[16:24])
+        self.assertEqual((width, height), (40, 30))
+        idat_length = struct.unpack('>I', content[33:37])[0]
+        pixels = zlib.decompress(content[41:41 + idat_length])
+        self.assertEqual(len(pixels), height * (1 + width * 3))
+
+    def test_prune_keeps_thumbnails_of_current_documents(self):
+        diagram = self._diagram([{'id': 'n1'}])
+        thumbnails.store(diagram.data_hash, DiagramThumbnail.FORMAT_SVG, diagram.data)
+        thumbnails.store('stale', DiagramThumbnail.FORMAT_SVG, {'nodes': []})
+        DiagramThumbnail.objects.update(created_at=timezone.now() - timedelta(days=30))
+
+        self.assertEqual(thumbnails.prune(), 1)
+        self.assertEqual(list(DiagramThumbnail.objects.values_list('content_hash', flat=True)), [diagram.data_hash])
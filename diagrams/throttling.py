@@ -0,0 +1,223 @@
+"""
+Admission control for the anonymous and authentication endpoints.
+
+Token-bucket throttles answer with 429 + ``Retry-After`` once a client's
+bucket is empty. Clients are told apart by ``REMOTE_ADDR``, or by
+``X-Forwarded-For`` when ``REST_FRAMEWORK['NUM_PROXIES']`` says how many
+trusted proxies add to it. Expensive endpoints (password hashing, guest account
+creation) additionally run behind a per-process concurrency limit and are
+shed with 503 + ``Retry-After`` while too many editor writes (autosaves,
+lock requests) are in flight, so bursts of logins cannot starve the editor.
+"""
+from contextlib import contextmanager
+import functools
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+ADMISSION_DEFAULTS = {
+    'EXPENSIVE_CONCURRENCY': 4,
+    'SHED_ABOVE_EDITOR_WRITES': 8,
+    'RETRY_AFTER': 1,
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def get_admission_settings() -> dict:
+    return {**ADMISSION_DEFAULTS, **getattr(settings, 'DIAGRAMS_ADMISSION', {})}
+
+
+class ServiceOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Server is busy, please retry shortly.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait, detail=None):
+        super().__init__(detail)
+        # DRF's exception handler turns `wait` into a Retry-After header.
+        self.wait = wait
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket stored in the Django cache. A rate of ``'10/min'`` gives a
+    bucket of 10 requests refilled at 10 per minute.
+
+    The bucket is kept as request counters per refill period (the time to
+    refill an empty bucket), updated with the cache's atomic ``incr`` so that
+    concurrent requests cannot spend the same token. The level is the
+    current period's count plus the previous period's, drained linearly over
+    the current one.
+    """
+    scope = None
+    cache = default_cache
+    cache_format = 'throttle_bucket_%(scope)s_%(ident)s'
+    timer = time.time
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def parse_rate(self):
+        rates = api_settings.DEFAULT_THROTTLE_RATES or {}
+        if self.scope not in rates:
+            raise ImproperlyConfigured(f"No throttle rate set for '{self.scope}' scope")
+        rate = rates[self.scope]
+        if rate is None:
+            return None, None
+        num, period = rate.split('/')
+        capacity = int(num)
+        return capacity, capacity / PERIODS[period[0]]
+
+    def _incr(self, key: str, timeout: int) -> int:
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.add(key, 0, timeout)
+            return self.cache.incr(key)
+
+    def allow_request(self, request, view):
+        capacity, refill_rate = self.parse_rate()
+        if capacity is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        period = capacity / refill_rate
+        index, offset = divmod(self.timer(), period)
+        current_key = f'{key}:{int(index)}'
+        previous = self.cache.get(f'{key}:{int(index) - 1}', 0)
+        used = self._incr(current_key, timeout=math.ceil(2 * period))
+        drained = offset / period
+        if previous * (1 - drained) + used <= capacity:
+            return True
+
+        # Denied requests do not spend a token
+        try:
+            self.cache.decr(current_key)
+        except ValueError:
+            pass
+        free = capacity - used
+        if free >= 0:
+            # Once enough of the previous period has drained
+            self._wait = (1 - free / previous - drained) * period
+        else:
+            # Next period, once enough of this one has drained
+            self._wait = (1 - drained + max(0, 1 - (capacity - 1) / max(used - 1, 1))) * period
+        return False
+
+    def wait(self):
+        return getattr(self, '_wait', None)
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """Bucket per authenticated user, falling back to the client IP."""
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user-{request.user.pk}'
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class UsernameTokenBucketThrottle(TokenBucketThrottle):
+    """Bucket per submitted username, to slow down guessing one account's password."""
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not username:
+            return None
+        ident = hashlib.sha256(str(username).lower().encode()).hexdigest()[:32]
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class AuthIPThrottle(IPTokenBucketThrottle):
+    scope = 'auth_ip'
+
+
+class AuthUsernameThrottle(UsernameTokenBucketThrottle):
+    scope = 'auth_username'
+
+
+class GuestLoginThrottle(IPTokenBucketThrottle):
+    scope = 'guest_ip'
+
+
+class InviteAcceptThrottle(UserTokenBucketThrottle):
+    scope = 'invite_accept'
+
+
+# --- Concurrency limits and editor write priority ---
+
+class _AdmissionState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.expensive_in_flight = 0
+        self.editor_writes_in_flight = 0
+
+
+_state = _AdmissionState()
+
+
+@contextmanager
+def editor_write():
+    """Mark an editor write as in flight for the duration of the block."""
+    with _state.lock:
+        _state.editor_writes_in_flight += 1
+    try:
+        yield
+    finally:
+        with _state.lock:
+            _state.editor_writes_in_flight -= 1
+
+
+@contextmanager
+def expensive_request():
+    """
+    Admit an expensive request or raise ``ServiceOverloaded`` right away,
+    without queueing, when the concurrency limit is reached or editor writes
+    are backed up.
+    """
+    config = get_admission_settings()
+    with _state.lock:
+        admitted = (
+            _state.expensive_in_flight < config['EXPENSIVE_CONCURRENCY']
+            and _state.editor_writes_in_flight < config['SHED_ABOVE_EDITOR_WRITES']
+        )
+        if admitted:
+            _state.expensive_in_flight += 1
+    if not admitted:
+        raise ServiceOverloaded(wait=config['RETRY_AFTER'])
+    try:
+        yield
+    finally:
+        with _state.lock:
+            _state.expensive_in_flight -= 1
+
+
+def expensive_endpoint(func):
+    """Decorator form of ``expensive_request`` for API views."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with expensive_request():
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,451 @@
+"""
+Server-rendered previews of ``Diagram.data`` and ``DiagramTemplate.data``.
+
+Nodes are drawn as their shapes (rectangle, circle, diamond, entity and lane
+headers) with their fill and border colours, edges as straight lines between
+node centres, scaled into ``WIDTH`` x ``HEIGHT``; labels are left out. The
+same scene is written as SVG or rasterized to PNG by a small pure-Python
+rasterizer.
+
+Thumbnails are stored in ``DiagramThumbnail`` keyed by the content hash of
+the document, so identical documents share one. Saves schedule a
+``thumbnails.render`` job ``DELAY`` seconds later, which lets an autosave
+burst end in one render. They are served at
+``/api/thumbnails/<kind>/<id>/<hash>.<svg|png>``: the hash makes the URL
+change with the content, so browsers cache responses as immutable, and it stands
+in for authentication, which an ``<img>`` tag cannot send. Such a URL is a
+bearer capability for the current content of that one object only: it is
+served while ``<hash>`` is the object's current hash (rendered on the spot if
+missing), and is a 404 once the object changes or is deleted, or for a hash
+that belongs to another object.
+"""
+import math
+import re
+import struct
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotModified
+from django.urls import reverse
+from django.utils import timezone
+
+from . import diffing, jobs
+from .models import Diagram, DiagramTemplate, DiagramThumbnail
+from .spatial import _elements, node_boxes
+
+
+THUMBNAIL_DEFAULTS = {
+    'ENABLED': True,
+    'WIDTH': 320,
+    'HEIGHT': 200,
+    # Rendered in the background; other formats are rendered when first requested
+    'FORMATS': ['svg'],
+    'DELAY': 30,
+    'MAX_NODES': 2000,
+    # Thumbnails no current diagram refers to are deleted after this many seconds
+    'PRUNE_AFTER': 7 * 24 * 3600,
+}
+
+KINDS = {
+    'diagram': Diagram,
+    'template': DiagramTemplate,
+}
+CONTENT_TYPES = {
+    DiagramThumbnail.FORMAT_SVG: 'image/svg+xml',
+    DiagramThumbnail.FORMAT_PNG: 'image/png',
+}
+
+BACKGROUND = '#ffffff'
+DEFAULT_FILL = '#ffffff'
+DEFAULT_STROKE = '#1f2937'
+EDGE_STROKE = '#94a3b8'
+PADDING = 8
+HEADER_HEIGHT = 24
+
+_FILENAME = re.compile(r'^(?P<hash>[0-9a-f]{40})\.(?P<format>[a-z]+)$')
+_HEX_COLOR = re.compile(r'^#(?:[0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
+_NAMED_COLORS = {
+    'white': '#ffffff', 'black': '#000000', 'gray': '#808080', 'grey': '#808080',
+    'red': '#ff0000', 'green': '#008000', 'blue': '#0000ff', 'yellow': '#ffff00',
+    'orange': '#ffa500', 'purple': '#800080',
+}
+
+
+def get_thumbnail_settings() -> dict:
+    return {**THUMBNAIL_DEFAULTS, **getattr(settings, 'DIAGRAMS_THUMBNAILS', {})}
+
+
+# --- Scene ---
+
+def _color(value, default):
+    """A ``#rrggbb`` colour, None for transparent; anything else falls back to ``default``."""
+    if value == 'transparent' or value == 'none':
+        return None
+    if isinstance(value, str):
+        value = _NAMED_COLORS.get(value.lower(), value)
+        if _HEX_COLOR.match(value):
+            if len(value) == 4:
+                value = '#' + ''.join(ch * 2 for ch in value[1:])
+            return value.lower()
+    return default
+
+
+def scene(data, width: int, height: int) -> list:
+    """
+    Primitives to draw, in thumbnail coordinates and in drawing order:
+    ``('rect', x, y, w, h, fill, stroke)``, ``('ellipse', cx, cy, rx, ry, fill, stroke)``,
+    ``('polygon', points, fill, stroke)`` and ``('lines', segments, stroke)``.
+    """
+    config = get_thumbnail_settings()
+    nodes = {str(node['id']): node for node in _elements(data, 'nodes')[:config['MAX_NODES']]}
+    boxes = node_boxes({'nodes': list(nodes.values())})
+    if not boxes:
+        return []
+
+    min_x = min(box[0] for box in boxes.values())
+    min_y = min(box[1] for box in boxes.values())
+    max_x = max(box[2] for box in boxes.values())
+    max_y = max(box[3] for box in boxes.values())
+    # Fit and centre, without blowing small diagrams up beyond their size
+    scale = min((width - 2 * PADDING) / max(max_x - min_x, 1), (height - 2 * PADDING) / max(max_y - min_y, 1), 1.0)
+    offset_x = (width - (max_x - min_x) * scale) / 2
+    offset_y = (height - (max_y - min_y) * scale) / 2
+
+    def place(box):
+        return (
+            offset_x + (box[0] - min_x) * scale,
+            offset_y + (box[1] - min_y) * scale,
+            (box[2] - box[0]) * scale,
+            (box[3] - box[1]) * scale,
+        )
+
+    parents = {str(node.get('parentId') or node.get('parentNode')) for node in nodes.values()}
+    containers = [node_id for node_id in boxes if node_id in parents or _node_data(nodes[node_id]).get('isContainer')]
+    # Larger containers first, so nested ones stay visible
+    containers.sort(key=lambda node_id: -(boxes[node_id][2] - boxes[node_id][0]) * (boxes[node_id][3] - boxes[node_id][1]))
+    container_ids = set(containers)
+
+    primitives = []
+    for node_id in containers:
+        primitives.extend(_node_primitives(nodes[node_id], *place(boxes[node_id]), scale))
+
+    segments = []
+    for edge in _elements(data, 'edges'):
+        source, target = boxes.get(str(edge.get('source'))), boxes.get(str(edge.get('target')))
+        if source is None or target is None:
+            continue
+        x1, y1, w1, h1 = place(source)
+        x2, y2, w2, h2 = place(target)
+        segments.append((x1 + w1 / 2, y1 + h1 / 2, x2 + w2 / 2, y2 + h2 / 2))
+    if segments:
+        primitives.append(('lines', segments, EDGE_STROKE))
+
+    for node_id in boxes:
+        if node_id not in container_ids:
+            primitives.extend(_node_primitives(nodes[node_id], *place(boxes[node_id]), scale))
+    return primitives
+
+
+def _node_data(node) -> dict:
+    return node['data'] if isinstance(node.get('data'), dict) else {}
+
+
+def _node_primitives(node, x, y, w, h, scale) -> list:
+    data = _node_data(node)
+    shape = data.get('shape', 'rectangle')
+    fill = _color(data.get('background'), DEFAULT_FILL)
+    stroke = _color(data.get('borderColor'), DEFAULT_STROKE)
+
+    if shape == 'circle':
+        return [('ellipse', x + w / 2, y + h / 2, w / 2, h / 2, fill, stroke)]
+    if shape == 'diamond':
+        points = [(x + w / 2, y), (x + w, y + h / 2), (x + w / 2, y + h), (x, y + h / 2)]
+        return [('polygon', points, fill, stroke)]
+    if shape == 'annotation':
+        return [('lines', [(x, y, x, y + h), (x, y, x + w / 4, y), (x, y + h, x + w / 4, y + h)], stroke)]
+
+    primitives = [('rect', x, y, w, h, fill, stroke)]
+    header = min(HEADER_HEIGHT * scale, h / 2)
+    if shape == 'entity':
+        primitives.append(('rect', x, y, w, header, stroke, stroke))
+    elif shape == 'lane':
+        header_fill = _color(data.get('headerBackground'), '#e2e8f0')
+        if data.get('headerPosition') == 'left':
+            primitives.append(('rect', x, y, min(HEADER_HEIGHT * scale, w / 2), h, header_fill, stroke))
+        else:
+            primitives.append(('rect', x, y, w, header, header_fill, stroke))
+    return primitives
+
+
+# --- SVG ---
+
+def _n(value: float) -> str:
+    return f'{round(value, 1):g}'
+
+
+def _paint(fill, stroke) -> str:
+    return f'fill="{fill or "none"}" stroke="{stroke or "none"}"'
+
+
+def render_svg(data, width: int, height: int) -> bytes:
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" width="{width}" height="{height}">',
+        f'<rect width="{width}" height="{height}" fill="{BACKGROUND}"/>',
+    ]
+    for primitive in scene(data, width, height):
+        kind = primitive[0]
+        if kind == 'rect':
+            _, x, y, w, h, fill, stroke = primitive
+            parts.append(f'<rect x="{_n(x)}" y="{_n(y)}" width="{_n(w)}" height="{_n(h)}" {_paint(fill, stroke)}/>')
+        elif kind == 'ellipse':
+            _, cx, cy, rx, ry, fill, stroke = primitive
+            parts.append(f'<ellipse cx="{_n(cx)}" cy="{_n(cy)}" rx="{_n(rx)}" ry="{_n(ry)}" {_paint(fill, stroke)}/>')
+        elif kind == 'polygon':
+            _, points, fill, stroke = primitive
+            coordinates = ' '.join(f'{_n(px)},{_n(py)}' for px, py in points)
+            parts.append(f'<polygon points="{coordinates}" {_paint(fill, stroke)}/>')
+        elif kind == 'lines':
+            _, segments, stroke = primitive
+            path = ''.join(f'M{_n(x1)} {_n(y1)}L{_n(x2)} {_n(y2)}' for x1, y1, x2, y2 in segments)
+            parts.append(f'<path d="{path}" {_paint(None, stroke)}/>')
+    parts.append('</svg>')
+    return ''.join(parts).encode()
+
+
+# --- PNG ---
+
+def _rgb(color) -> bytes:
+    return bytes.fromhex(color[1:])
+
+
+class _Canvas:
+    def __init__(self, width: int, height: int, background: str):
+        self.width, self.height = width, height
+        self.pixels = bytearray(_rgb(background) * (width * height))
+
+    def span(self, y: int, x1: int, x2: int, color: bytes) -> None:
+        """Fill pixels ``x1..x2`` (inclusive) of row ``y``."""
+        if not 0 <= y < self.height:
+            return
+        x1, x2 = max(x1, 0), min(x2, self.width - 1)
+        if x1 > x2:
+            return
+        start = (y * self.width + x1) * 3
+        self.pixels[start:start + (x2 - x1 + 1) * 3] = color * (x2 - x1 + 1)
+
+    def point(self, x: int, y: int, color: bytes) -> None:
+        self.span(y, x, x, color)
+
+    def line(self, x1, y1, x2, y2, color: bytes) -> None:
+        x1, y1, x2, y2 = round(x1), round(y1), round(x2), round(y2)
+        dx, dy = abs(x2 - x1), -abs(y2 - y1)
+        step_x, step_y = (1 if x1 < x2 else -1), (1 if y1 < y2 else -1)
+        error = dx + dy
+        while True:
+            self.point(x1, y1, color)
+            if x1 == x2 and y1 == y2:
+                return
+            doubled = 2 * error
+            if doubled >= dy:
+                error += dy
+                x1 += step_x
+            if doubled <= dx:
+                error += dx
+                y1 += step_y
+
+    def rect(self, x, y, w, h, fill, stroke) -> None:
+        left, top, right, bottom = round(x), round(y), round(x + w) - 1, round(y + h) - 1
+        if fill is not None:
+            for row in range(top, bottom + 1):
+                self.span(row, left, right, fill)
+        if stroke is not None:
+            self.span(top, left, right, stroke)
+            self.span(bottom, left, right, stroke)
+            for row in range(top, bottom + 1):
+                self.point(left, row, stroke)
+                self.point(right, row, stroke)
+
+    def ellipse(self, cx, cy, rx, ry, fill, stroke) -> None:
+        if rx <= 0 or ry <= 0:
+            return
+        if fill is not None:
+            for row in range(round(cy - ry), round(cy + ry) + 1):
+                t = (row + 0.5 - cy) / ry
+                if abs(t) <= 1:
+                    half = rx * (1 - t * t) ** 0.5
+                    self.span(row, round(cx - half), round(cx + half) - 1, fill)
+        if stroke is not None:
+            steps = 32
+            outline = [
+                (cx + rx * math.cos(2 * math.pi * i / steps), cy + ry * math.sin(2 * math.pi * i / steps))
+                for i in range(steps)
+            ]
+            for (x1, y1), (x2, y2) in zip(outline, outline[1:] + outline[:1]):
+                self.line(x1, y1, x2, y2, stroke)
+
+    def polygon(self, points, fill, stroke) -> None:
+        if fill is not None:
+            top = round(min(py for _, py in points))
+            bottom = round(max(py for _, py in points))
+            edges = list(zip(points, points[1:] + points[:1]))
+            for row in range(top, bottom + 1):
+                y = row + 0.5
+                crossings = sorted(
+                    x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+                    for (x1, y1), (x2, y2) in edges
+                    if (y1 <= y < y2) or (y2 <= y < y1)
+                )
+                for start, end in zip(crossings[::2], crossings[1::2]):
+                    self.span(row, round(start), round(end) - 1, fill)
+        if stroke is not None:
+            for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+                self.line(x1, y1, x2, y2, stroke)
+
+    def png(self) -> bytes:
+        def chunk(kind: bytes, body: bytes) -> bytes:
+            return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+        stride = self.width * 3
+        # Filter type 0 (none) in front of every row
+        raw = b''.join(b'\x00' + self.pixels[row * stride:(row + 1) * stride] for row in range(self.height))
+        header = struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0)
+        return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 9)) + chunk(b'IEND', b'')
+
+
+def render_png(data, width: int, height: int) -> bytes:
+    canvas = _Canvas(width, height, BACKGROUND)
+
+    def paint(color):
+        return _rgb(color) if color else None
+
+    for primitive in scene(data, width, height):
+        kind = primitive[0]
+        if kind == 'rect':
+            _, x, y, w, h, fill, stroke = primitive
+            canvas.rect(x, y, w, h, paint(fill), paint(stroke))
+        elif kind == 'ellipse':
+            _, cx, cy, rx, ry, fill, stroke = primitive
+            canvas.ellipse(cx, cy, rx, ry, paint(fill), paint(stroke))
+        elif kind == 'polygon':
+            _, points, fill, stroke = primitive
+            canvas.polygon(points, paint(fill), paint(stroke))
+        elif kind == 'lines':
+            _, segments, stroke = primitive
+            for segment in segments:
+                canvas.line(*segment, paint(stroke))
+    return canvas.png()
+
+
+RENDERERS = {
+    DiagramThumbnail.FORMAT_SVG: render_svg,
+    DiagramThumbnail.FORMAT_PNG: render_png,
+}
+
+
+# --- Storage ---
+
+def document_hash(obj) -> str:
+    """Content hash of a diagram's or template's document; diagrams keep theirs in ``data_hash``."""
+    return getattr(obj, 'data_hash', '') or diffing.content_hash(obj.data)
+
+
+def thumbnail_url(kind: str, obj, fmt: str = DiagramThumbnail.FORMAT_SVG):
+    """Path of the thumbnail of ``obj``; None if neither its hash nor its data is loaded."""
+    content_hash = obj.__dict__.get('data_hash') or (diffing.content_hash(obj.data) if 'data' in obj.__dict__ else '')
+    if not content_hash:
+        return None
+    return reverse('thumbnail', args=[kind, obj.id, f'{content_hash}.{fmt}'])
+
+
+def store(content_hash: str, fmt: str, data) -> bytes:
+    """The ``fmt`` thumbnail of ``data``, rendered and saved unless it already is."""
+    existing = DiagramThumbnail.objects.filter(content_hash=content_hash, format=fmt).values_list('content', flat=True).first()
+    if existing is not None:
+        return bytes(existing)
+    config = get_thumbnail_settings()
+    content = RENDERERS[fmt](data, config['WIDTH'], config['HEIGHT'])
+    try:
+        with transaction.atomic():
+            DiagramThumbnail.objects.create(content_hash=content_hash, format=fmt, content=content)
+    except IntegrityError:
+        # Rendered concurrently by someone else
+        pass
+    return content
+
+
+def render_object(kind: str, object_id) -> None:
+    """Render the thumbnails of the current content of a diagram or template in every configured format."""
+    obj = KINDS[kind].objects.filter(id=object_id).first()
+    if obj is None:
+        return
+    content_hash = document_hash(obj)
+    for fmt in get_thumbnail_settings()['FORMATS']:
+        store(content_hash, fmt, obj.data)
+    jobs.enqueue('thumbnails.prune', priority=-2, delay=3600, dedupe_key='thumbnails.prune')
+
+
+def schedule(kind: str, object_id) -> None:
+    """Render the thumbnails of a saved diagram or template in the background."""
+    config = get_thumbnail_settings()
+    if not config['ENABLED']:
+        return
+    jobs.enqueue(
+        'thumbnails.render', {'kind': kind, 'object_id': object_id},
+        priority=-1, delay=config['DELAY'], dedupe_key=f'thumbnails.render:{kind}:{object_id}',
+    )
+
+
+def prune() -> int:
+    """Delete old thumbnails of documents no diagram has anymore; template thumbnails are rendered again on request."""
+    cutoff = timezone.now() - timedelta(seconds=get_thumbnail_settings()['PRUNE_AFTER'])
+    current = Diagram.all_objects.exclude(data_hash='').values('data_hash')
+    deleted, _ = DiagramThumbnail.objects.filter(created_at__lt=cutoff).exclude(content_hash__in=current).delete()
+    return deleted
+
+
+def current_object(kind: str, object_id, content_hash: str):
+    """The diagram or template whose current hash is ``content_hash``; None if there is none."""
+    # Diagrams keep their hash, templates are hashed from their data
+    fields = ['data_hash'] if kind == 'diagram' else ['data']
+    obj = KINDS[kind].objects.filter(id=object_id).only(*fields).first()
+    if obj is None or document_hash(obj) != content_hash:
+        return None
+    return obj
+
+
+def lookup(kind: str, object_id, content_hash: str, fmt: str):
+    """
+    Content of a thumbnail if ``content_hash`` is the current hash of the
+    object, rendered now if missing; None otherwise.
+    """
+    obj = current_object(kind, object_id, content_hash)
+    if obj is None:
+        return None
+    existing = DiagramThumbnail.objects.filter(content_hash=content_hash, format=fmt).values_list('content', flat=True).first()
+    if existing is not None:
+        return bytes(existing)
+    return store(content_hash, fmt, obj.data)
+
+
+# --- View ---
+
+def thumbnail_view(request, kind, object_id, filename):
+    match = _FILENAME.match(filename)
+    if kind not in KINDS or match is None or match['format'] not in CONTENT_TYPES:
+        return HttpResponseNotFound()
+    etag = f'"{match["hash"]}.{match["format"]}"'
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        if current_object(kind, object_id, match['hash']) is None:
+            return HttpResponseNotFound()
+        response = HttpResponseNotModified()
+    else:
+        content = lookup(kind, object_id, match['hash'], match['format'])
+        if content is None:
+            return HttpResponseNotFound()
+        response = HttpResponse(content, content_type=CONTENT_TYPES[match['format']])
+    response['ETag'] = etag
+    # Browser caches only: shared ones would keep serving it after the object changes
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,166 @@
+"""
+Request parsing and size limits for diagram uploads.
+
+``DiagramJSONParser`` replaces DRF's JSON parser. It reads the body in chunks,
+inflating ``Content-Encoding: gzip`` as it goes, and gives up with 413 as
+soon as the (inflated) body passes ``MAX_BODY_BYTES``. The body is parsed
+with a single ``json.loads``; a diagram document under ``data`` (also when
+an older client sends it as a JSON string) is checked against the node,
+edge and depth limits and marked as ``ParsedDocument`` so serializers take
+it as is instead of encoding it again to validate it. A save therefore
+holds the raw body and the parsed document, and the body only until it
+has been parsed.
+"""
+import json
+import zlib
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser
+
+
+UPLOAD_DEFAULTS = {
+    'MAX_BODY_BYTES': 20 * 1024 * 1024,
+    'MAX_NODES': 50000,
+    'MAX_EDGES': 100000,
+    'MAX_DEPTH': 32,
+    'ACCEPT_GZIP': True,
+}
+
+READ_CHUNK = 64 * 1024
+
+
+def get_upload_settings() -> dict:
+    return {**UPLOAD_DEFAULTS, **getattr(settings, 'DIAGRAMS_UPLOADS', {})}
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request body is too large.'
+    default_code = 'payload_too_large'
+
+
+class ParsedDocument(dict):
+    """A diagram document that came out of DiagramJSONParser and passed the limits."""
+
+
+def _chunks(stream):
+    while chunk := stream.read(READ_CHUNK):
+        yield chunk
+
+
+def _inflate(chunks):
+    inflater = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    try:
+        for chunk in chunks:
+            # Bounded output per call, a small body cannot expand all at once
+            while chunk:
+                yield inflater.decompress(chunk, READ_CHUNK)
+                chunk = inflater.unconsumed_tail
+        yield inflater.flush()
+    except zlib.error as exc:
+        raise ParseError(f'Invalid gzip body: {exc}')
+    if not inflater.eof:
+        raise ParseError('Truncated gzip body.')
+
+
+def read_body(stream, content_encoding='', limit=None) -> bytearray:
+    """The request body, inflated if gzip-encoded; PayloadTooLarge past ``limit`` bytes."""
+    config = get_upload_settings()
+    limit = config['MAX_BODY_BYTES'] if limit is None else limit
+    content_encoding = (content_encoding or '').strip().lower()
+    chunks = _chunks(stream)
+    if content_encoding in ('gzip', 'x-gzip'):
+        if not config['ACCEPT_GZIP']:
+            raise UnsupportedMediaType('gzip', detail='gzip-encoded request bodies are not accepted.')
+        chunks = _inflate(chunks)
+    elif content_encoding not in ('', 'identity'):
+        raise UnsupportedMediaType(content_encoding, detail=f'Unsupported Content-Encoding "{content_encoding}".')
+
+    body = bytearray()
+    for chunk in chunks:
+        body += chunk
+        if len(body) > limit:
+            raise PayloadTooLarge(f'Request body is larger than {limit} bytes.')
+    return body
+
+
+def _depth(value, limit) -> int:
+    """Nesting depth of a JSON value, stopping once it passes ``limit``."""
+    deepest = 0
+    stack = [(value, 1)]
+    while stack:
+        value, depth = stack.pop()
+        if isinstance(value, dict):
+            value = value.values()
+        elif not isinstance(value, list):
+            continue
+        deepest = max(deepest, depth)
+        if deepest > limit:
+            break
+        stack.extend((item, depth + 1) for item in value if isinstance(item, (dict, list)))
+    return deepest
+
+
+def check_document(document) -> None:
+    """Raise PayloadTooLarge if a diagram document exceeds the node, edge or depth limits."""
+    if not isinstance(document, dict):
+        return
+    config = get_upload_settings()
+    for key, limit in (('nodes', config['MAX_NODES']), ('edges', config['MAX_EDGES'])):
+        items = document.get(key)
+        if isinstance(items, list) and len(items) > limit:
+            raise PayloadTooLarge(f'A diagram can have at most {limit} {key} ({len(items)} sent).')
+    if _depth(document, config['MAX_DEPTH']) > config['MAX_DEPTH']:
+        raise PayloadTooLarge(f"Diagram data is nested deeper than {config['MAX_DEPTH']} levels.")
+
+
+def load_document(value):
+    """
+    Turn the ``data`` member of a payload into a checked ParsedDocument. JSON
+    strings are parsed; strings that are not JSON are returned unchanged.
+    """
+    if isinstance(value, str):
+        if len(value) > get_upload_settings()['MAX_BODY_BYTES']:
+            raise PayloadTooLarge()
+        try:
+            value = json.loads(value)
+        except RecursionError:
+            raise PayloadTooLarge('Diagram data is nested too deeply.')
+        except ValueError:
+            return value
+    if isinstance(value, dict):
+        check_document(value)
+        return ParsedDocument(value)
+    return value
+
+
+class DiagramJSONParser(BaseParser):
+    """JSON parser with gzip support and diagram size limits (see module docstring)."""
+    media_type = 'application/json'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        meta = request.META if request is not None else {}
+        limit = get_upload_settings()['MAX_BODY_BYTES']
+        content_encoding = meta.get('HTTP_CONTENT_ENCODING', '')
+        try:
+            declared = int(meta.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            declared = 0
+        if declared > limit and not content_encoding:
+            raise PayloadTooLarge(f'Request body is larger than {limit} bytes.')
+
+        body = read_body(stream, content_encoding, limit)
+        try:
+            payload = json.loads(body)
+        except RecursionError:
+            raise PayloadTooLarge('Request body is nested too deeply.')
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+        del body
+
+        if isinstance(payload, dict) and 'data' in payload:
+            payload['data'] = load_document(payload['data'])
+        return payload
@@ -1,46 +1,116 @@
+from collections import Counter
+from contextlib import contextmanager
 from datetime import timedelta
-import json
+import contextvars
 import uuid
 
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, F, Func, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from rest_framework import generics, status
+from rest_framework import generics, serializers, status
 from rest_framework.authtoken.models import Token
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.authentication import get_authorization_header
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, PermissionDenied, ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Diagram, DiagramLink, DiagramTemplate, GuestProfile, Project, ProjectInvite, ProjectMembership
+from . import access_tokens, activity, coalescing, compression, deletion, diffing, jobs, layout, metrics, presence, response_cache, spatial
+from .authentication import FlexibleTokenAuthentication
+from .models import ActivityEntry, DeletionTask, Diagram, DiagramLink, DiagramTemplate, GuestProfile, Project, ProjectInvite, ProjectMembership
+from .profiling import span
 from .serializers import (
+    ActivityEntrySerializer,
     DiagramLinkCreateSerializer,
     DiagramLinkSerializer,
+    DiagramMetaSerializer,
     DiagramSerializer,
     DiagramTemplateCreateSerializer,
     DiagramTemplateSerializer,
     ProjectInviteInfoSerializer,
     ProjectInviteSerializer,
+    ProjectListSerializer,
     ProjectSerializer,
     UserRegistrationSerializer,
     UserSerializer,
 )
+from .throttling import (
+    AuthIPThrottle,
+    AuthUsernameThrottle,
+    GuestLoginThrottle,
+    InviteAcceptThrottle,
+    editor_write,
+    expensive_endpoint,
+)
+from .uploads import ParsedDocument, load_document
+
+
+# Memberships of one user resolved once for a group of requests, see membership_scope()
+_membership_memo = contextvars.ContextVar('diagrams_membership_memo', default=None)
+
+
+class _MembershipMemo:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.project_ids = None
+
+    def __contains__(self, project_id) -> bool:
+        if self.project_ids is None:
+            self.project_ids = set(
+                ProjectMembership.objects.filter(user_id=self.user_id).values_list('project_id', flat=True)
+            )
+        return project_id in self.project_ids
+
+
+@contextmanager
+def membership_scope(user):
+    """
+    Resolve the user's project memberships once for every check inside the
+    block; they are loaded again after a membership of the user changed.
+    """
+    token = _membership_memo.set(_MembershipMemo(user.id))
+    try:
+        yield
+    finally:
+        _membership_memo.reset(token)
+
+
+def forget_memberships(user_id) -> None:
+    """Called when a membership of ``user_id`` is saved or deleted."""
+    memo = _membership_memo.get()
+    if memo is not None and memo.user_id == user_id:
+        memo.project_ids = None
 
 
 def _ensure_project_member(project: Project, user) -> None:
-    if not ProjectMembership.objects.filter(project=project, user=user).exists():
+    memo = _membership_memo.get()
+    if memo is not None and memo.user_id == user.id:
+        with span('perm'):
+            is_member = project.id in memo
+    else:
+        with span('perm'):
+            is_member = ProjectMembership.objects.filter(project=project, user=user).exists()
+    if not is_member:
         raise PermissionDenied("You do not have access to this project.")
 
 
 def _ensure_project_owner(project: Project, user) -> None:
-    if not ProjectMembership.objects.filter(
-        project=project,
-        user=user,
-        role=ProjectMembership.ROLE_OWNER,
-    ).exists():
+    with span('perm'):
+        is_owner = ProjectMembership.objects.filter(
+            project=project,
+            user=user,
+            role=ProjectMembership.ROLE_OWNER,
+        ).exists()
+    if not is_owner:
         raise PermissionDenied("Only project owners can perform this action.")
 
 
@@ -50,6 +120,82 @@ def _get_project_for_user(project_id: int, user) -> Project:
     return project
 
 
+def _prepare_diagram_update(request_data):
+    """Normalize a diagram update payload; `data` may arrive as a JSON string (form posts)."""
+    if isinstance(request_data.get('data'), ParsedDocument):
+        # Parsed and checked by DiagramJSONParser, and the dict is ours
+        return request_data
+    data_to_update = request_data
+    if hasattr(request_data, 'copy'):
+        data_to_update = request_data.copy()
+
+    if 'data' in data_to_update:
+        # Strings that are not JSON are left to serializer validation
+        data_to_update['data'] = load_document(data_to_update['data'])
+    return data_to_update
+
+
+def _changed_by_update(diagram: Diagram, data_to_update) -> set:
+    """
+    Fields that saving ``data_to_update`` would change; empty for e.g. an
+    autosave after a drag that ended where it started. The hash of a new
+    document is kept on the instance so saving it does not hash it again.
+    """
+    changed = set()
+    document = data_to_update.get('data')
+    if isinstance(document, ParsedDocument):
+        incoming = diffing.content_hash(document)
+        if incoming != (diagram.data_hash or diffing.content_hash(diagram.data)):
+            changed.add('data')
+        diagram.data_hash, diagram._hashed_data = incoming, document
+    elif 'data' in data_to_update:
+        changed.add('data')
+    changed.update(
+        field for field in ('name', 'diagram_type')
+        if field in data_to_update and data_to_update[field] != getattr(diagram, field)
+    )
+    return changed
+
+
+def _coalesce_update(diagram: Diagram, data_to_update, changed) -> bool:
+    """
+    Hand a data-only update to the write coalescer if it is enabled; True if
+    it took it. Updates inside a transaction (an atomic batch) are saved
+    directly, so they are rolled back with it.
+    """
+    if changed != {'data'} or connection.in_atomic_block or not coalescing.enabled():
+        return False
+    if not isinstance(data_to_update['data'], ParsedDocument):
+        return False
+    coalescing.submit(diagram, data_to_update['data'], diagram.data_hash)
+    return True
+
+
+def _apply_lock(diagram: Diagram, user) -> bool:
+    """Take or refresh the lock for `user` on the instance; the caller saves LOCK_FIELDS."""
+    if diagram.is_locked and diagram.locked_by_id != user.id:
+        metrics.inc('diagram_lock_conflicts_total')
+        return False
+
+    diagram.is_locked = True
+    diagram.locked_by = user
+    diagram.locked_at = timezone.now()
+    metrics.inc('diagram_lock_acquisitions_total')
+    return True
+
+
+def _release_lock(diagram: Diagram, user) -> None:
+    if diagram.locked_by_id != user.id:
+        raise PermissionDenied("Only the locking user can release this diagram.")
+
+    diagram.is_locked = False
+    diagram.locked_by = None
+    diagram.locked_at = None
+
+
+LOCK_FIELDS = ['is_locked', 'locked_by', 'locked_at']
+
+
 def _serialize_lock(diagram: Diagram):
     return {
         "diagram_id": diagram.id,
@@ -61,6 +207,8 @@ def _serialize_lock(diagram: Diagram):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AuthIPThrottle])
+@expensive_endpoint
 def register_user(request):
     data = request.data.copy()
     if 'confirmPassword' in data and 'password2' not in data:
@@ -73,8 +221,33 @@ def register_user(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def _issue_access_token(request, user) -> dict:
+    """
+    Token fields for a login response: a signed access token when enabled in
+    settings or requested with `token_format: "signed"`, a DRF token otherwise.
+    """
+    token_format = request.data.get('token_format') if hasattr(request.data, 'get') else None
+    if token_format == 'signed' or (
+        token_format is None and access_tokens.get_signed_token_settings()['ISSUE']
+    ):
+        issued = access_tokens.issue(user)
+        return {
+            "access_token": issued['token'],
+            "token_type": "Bearer",
+            "expires_at": issued['expires_at'],
+        }
+
+    token, _ = Token.objects.get_or_create(user=user)
+    return {
+        "access_token": token.key,
+        "token_type": "Bearer",
+    }
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([AuthIPThrottle, AuthUsernameThrottle])
+@expensive_endpoint
 def obtain_token(request):
     username = request.data.get('username')
     password = request.data.get('password')
@@ -92,23 +265,66 @@ def obtain_token(request):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    token, _ = Token.objects.get_or_create(user=user)
+    return Response(_issue_access_token(request, user), status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+@throttle_classes([AuthIPThrottle])
+def refresh_token(request):
+    """
+    Exchange the bearer token for a new signed access token. Signed tokens are
+    accepted up to REFRESH_GRACE seconds after expiry and revoked on exchange.
+    """
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() not in (b'bearer', b'token'):
+        raise NotAuthenticated()
+
+    token = auth[1].decode()
+    if access_tokens.is_signed_token(token):
+        grace = access_tokens.get_signed_token_settings()['REFRESH_GRACE']
+        user, payload = access_tokens.verify(token, leeway=grace, fresh=True)
+        # Exchanged at most once, also by concurrent refreshes
+        if not access_tokens.revoke(payload):
+            raise AuthenticationFailed('Token has been revoked.')
+    else:
+        user, _ = FlexibleTokenAuthentication().authenticate_credentials(token)
+
+    issued = access_tokens.issue(user)
     return Response(
         {
-            "access_token": token.key,
+            "access_token": issued['token'],
             "token_type": "Bearer",
+            "expires_at": issued['expires_at'],
         },
         status=status.HTTP_200_OK,
     )
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def revoke_token(request):
+    """Revoke the current token, or with `all: true` every token of the user."""
+    if hasattr(request.data, 'get') and request.data.get('all'):
+        access_tokens.revoke_all(request.user)
+        Token.objects.filter(user=request.user).delete()
+    elif isinstance(request.auth, dict):
+        access_tokens.revoke(request.auth)
+    else:
+        Token.objects.filter(user=request.user).delete()
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([GuestLoginThrottle])
+@expensive_endpoint
 def guest_login(request):
-    # Clean up guest users older than 24 hours
-    cutoff = timezone.now() - timedelta(hours=24)
-    old_guest_ids = GuestProfile.objects.filter(created_at__lt=cutoff).values_list('user_id', flat=True)
-    User.objects.filter(id__in=list(old_guest_ids)).delete()
+    # Guests older than 24 hours are removed by the job worker, or here if none is running
+    cleanup = jobs.enqueue('guests.cleanup', dedupe_key='guests.cleanup')
+    if jobs.unclaimed(cleanup):
+        jobs.run_here(cleanup)
 
     # Create a new guest user
     unique_suffix = uuid.uuid4().hex[:10]
@@ -118,13 +334,8 @@ def guest_login(request):
     user.save(update_fields=['password'])
     GuestProfile.objects.create(user=user)
 
-    token, _ = Token.objects.get_or_create(user=user)
     return Response(
-        {
-            "access_token": token.key,
-            "token_type": "Bearer",
-            "is_guest": True,
-        },
+        {**_issue_access_token(request, user), "is_guest": True},
         status=status.HTTP_201_CREATED,
     )
 
@@ -136,10 +347,43 @@ class CurrentUserView(APIView):
         return Response(UserSerializer(request.user).data, status=status.HTTP_200_OK)
 
 
+def _subquery_value(queryset, function: str, field: str = 'pk', output_field=None):
+    """``function(field)`` over the rows of ``queryset`` (correlated with OuterRef) as a scalar subquery."""
+    return Subquery(
+        queryset.order_by().annotate(value=Func(F(field), function=function)).values('value')[:1],
+        output_field=output_field,
+    )
+
+
+def _annotate_project_stats(projects):
+    """The dashboard aggregates of ``ProjectListSerializer``, as subqueries of the one project query."""
+    diagrams = Diagram.objects.filter(project=OuterRef('pk'))
+    counts = {
+        f'{diagram_type}_count': Coalesce(_subquery_value(diagrams.filter(diagram_type=diagram_type), 'COUNT'), 0)
+        for diagram_type, _ in Diagram.DIAGRAM_TYPES
+    }
+    return projects.annotate(
+        **counts,
+        member_count=Coalesce(_subquery_value(ProjectMembership.objects.filter(project=OuterRef('pk')), 'COUNT'), 0),
+        # Links belong to the project of the element they start from
+        link_count=Coalesce(
+            _subquery_value(DiagramLink.objects.filter(source_diagram__project=OuterRef('pk')), 'COUNT'), 0,
+        ),
+        last_diagram_update=_subquery_value(diagrams, 'MAX', 'updated_at', output_field=Diagram._meta.get_field('updated_at')),
+    )
+
+
 class ProjectApiView(generics.ListCreateAPIView):
-    serializer_class = ProjectSerializer
+    """
+    GET: The user's projects with dashboard aggregates: diagrams by type,
+    members, links, last diagram update and locks currently held.
+    POST: Create a project.
+    """
     permission_classes = [IsAuthenticated]
 
+    def get_serializer_class(self):
+        return ProjectListSerializer if self.request.method == 'GET' else ProjectSerializer
+
     def get_queryset(self):
         return (
             Project.objects.filter(memberships__user=self.request.user)
@@ -147,6 +391,31 @@ class ProjectApiView(generics.ListCreateAPIView):
             .distinct()
         )
 
+    def list(self, request, *args, **kwargs):
+        def build():
+            serializer = self.get_serializer(_annotate_project_stats(self.get_queryset()), many=True)
+            data = list(serializer.data)
+            return data, [('project', project['id']) for project in data]
+
+        data = response_cache.read_through('projects', [request.user.id], [('user', request.user.id)], build)
+        # Lock changes do not invalidate cached responses, so held locks are counted fresh
+        locks = dict(
+            Diagram.objects.filter(project_id__in=[project['id'] for project in data], is_locked=True)
+            .order_by()
+            .values('project_id')
+            .annotate(held=Count('id'))
+            .values_list('project_id', 'held')
+        )
+        data = [{**project, 'locks_held': locks.get(project['id'], 0)} for project in data]
+        # Autosaves still waiting in the write coalescer are not in the aggregates yet
+        pending = coalescing.pending_project_updates()
+        for project in data:
+            updated_at = pending.get(project['id'])
+            stored = project['last_diagram_update'] and parse_datetime(project['last_diagram_update'])
+            if updated_at is not None and (not stored or updated_at > stored):
+                project['last_diagram_update'] = serializers.DateTimeField().to_representation(updated_at)
+        return Response(data, status=status.HTTP_200_OK)
+
     def perform_create(self, serializer):
         project = serializer.save(user=self.request.user)
         ProjectMembership.objects.get_or_create(
@@ -168,10 +437,14 @@ class ProjectDetailApiView(generics.RetrieveUpdateDestroyAPIView):
         project = self.get_object()
         _ensure_project_owner(project, self.request.user)
         serializer.save()
+        activity.record(project.id, self.request.user, 'project.update', project)
 
-    def perform_destroy(self, instance):
-        _ensure_project_owner(instance, self.request.user)
-        instance.delete()
+    def destroy(self, request, *args, **kwargs):
+        project = self.get_object()
+        _ensure_project_owner(project, request.user)
+        task = deletion.delete_project(project, request.user)
+        activity.record(project.id, request.user, 'project.delete', project)
+        return Response(deletion.serialize_task(task), status=status.HTTP_202_ACCEPTED)
 
 
 class DiagramApiView(generics.ListCreateAPIView):
@@ -184,7 +457,8 @@ class DiagramApiView(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
         project = _get_project_for_user(self.kwargs["project_id"], self.request.user)
-        serializer.save(project=project, locked_by=None, is_locked=False)
+        diagram = serializer.save(project=project, locked_by=None, is_locked=False)
+        activity.record(project.id, self.request.user, 'diagram.create', diagram)
 
 
 class DiagramDetailApiView(APIView):
@@ -197,38 +471,50 @@ class DiagramDetailApiView(APIView):
 
     def get(self, request, diagram_id):
         diagram = self._get_diagram(diagram_id, request.user)
+        etag = compression.diagram_etag(diagram, request.accepted_media_type)
+        if compression.etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
         serializer = DiagramSerializer(diagram)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers={'ETag': etag})
 
+    @editor_write()
     def put(self, request, diagram_id):
         diagram = self._get_diagram(diagram_id, request.user)
-        
-        # Safe data handling
-        data_to_update = request.data
-        if hasattr(request.data, 'copy'):
-            data_to_update = request.data.copy()
-
-        if 'data' in data_to_update:
-            diagram_data = data_to_update['data']
-            # If it comes as a string, parse it. If it's a dict, leave it.
-            if isinstance(diagram_data, str):
-                try:
-                    diagram_data = json.loads(diagram_data)
-                except json.JSONDecodeError:
-                    # If invalid json, maybe it's just a string, let serializer validation handle it
-                    pass
-            data_to_update['data'] = diagram_data
-
+        metrics.observe('diagram_autosave_bytes', int(request.META.get('CONTENT_LENGTH') or 0))
+
+        data_to_update = _prepare_diagram_update(request.data)
+        changed = _changed_by_update(diagram, data_to_update)
+        if not changed:
+            metrics.inc('diagram_saves_total', outcome='unchanged')
+            return Response(DiagramSerializer(diagram).data, status=status.HTTP_200_OK)
+        if _coalesce_update(diagram, data_to_update, changed):
+            metrics.inc('diagram_saves_total', outcome='coalesced')
+            activity.record(diagram.project_id, request.user, 'diagram.update', diagram)
+            return Response(DiagramSerializer(diagram).data, status=status.HTTP_200_OK)
         serializer = DiagramSerializer(diagram, data=data_to_update, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            serializer.save(revision=coalescing.next_revision(diagram))
+            metrics.inc('diagram_saves_total', outcome='saved')
+            activity.record(diagram.project_id, request.user, 'diagram.update', diagram)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, diagram_id):
         diagram = self._get_diagram(diagram_id, request.user)
-        diagram.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        task = deletion.delete_diagram(diagram, request.user)
+        activity.record(diagram.project_id, request.user, 'diagram.delete', diagram)
+        return Response(deletion.serialize_task(task), status=status.HTTP_202_ACCEPTED)
+
+
+class DeletionTaskView(APIView):
+    """
+    GET: Progress of a project or diagram deletion requested by the current user.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, task_id):
+        task = get_object_or_404(DeletionTask, id=task_id, requested_by=request.user)
+        return Response(deletion.serialize_task(task), status=status.HTTP_200_OK)
 
 
 class DiagramLockView(APIView):
@@ -243,29 +529,332 @@ class DiagramLockView(APIView):
         diagram = self._get_diagram(diagram_id, request.user)
         return Response(_serialize_lock(diagram), status=status.HTTP_200_OK)
 
+    @editor_write()
     def post(self, request, diagram_id):
         diagram = self._get_diagram(diagram_id, request.user)
 
-        if not diagram.is_locked or diagram.locked_by == request.user:
-            diagram.is_locked = True
-            diagram.locked_by = request.user
-            diagram.locked_at = timezone.now()
-            diagram.save(update_fields=['is_locked', 'locked_by', 'locked_at'])
+        if _apply_lock(diagram, request.user):
+            diagram.save(update_fields=LOCK_FIELDS)
+            activity.record(diagram.project_id, request.user, 'lock.acquire', diagram)
 
         return Response(_serialize_lock(diagram), status=status.HTTP_200_OK)
 
     def delete(self, request, diagram_id):
         diagram = self._get_diagram(diagram_id, request.user)
-        if diagram.locked_by != request.user:
-            raise PermissionDenied("Only the locking user can release this diagram.")
-
-        diagram.is_locked = False
-        diagram.locked_by = None
-        diagram.locked_at = None
-        diagram.save(update_fields=['is_locked', 'locked_by', 'locked_at'])
+        _release_lock(diagram, request.user)
+        diagram.save(update_fields=LOCK_FIELDS)
+        coalescing.flush(diagram.id)
+        activity.record(diagram.project_id, request.user, 'lock.release', diagram)
         return Response(_serialize_lock(diagram), status=status.HTTP_200_OK)
 
 
+class DiagramPresenceView(APIView):
+    """
+    POST: Heartbeat of a user who has the diagram open, with `mode` "viewing"
+    (default) or "editing"; send it every TTL/3 seconds (see DIAGRAMS_PRESENCE).
+    Returns who else is viewing and editing it. DELETE: Leave the diagram.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, diagram_id):
+        project_id = _member_diagram_project_id(diagram_id, request.user)
+        mode = request.data.get('mode', presence.VIEWING) if hasattr(request.data, 'get') else presence.VIEWING
+        if mode not in presence.MODES:
+            return Response(
+                {"detail": f"mode must be one of: {', '.join(presence.MODES)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        presence.touch(project_id, diagram_id, request.user, mode)
+        return Response(
+            {**presence.diagram_presence(project_id, diagram_id), "ttl": presence.get_presence_settings()['TTL']},
+            status=status.HTTP_200_OK,
+        )
+
+    def delete(self, request, diagram_id):
+        project_id = _member_diagram_project_id(diagram_id, request.user)
+        presence.leave(project_id, diagram_id, request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class DiagramOpenView(APIView):
+    """
+    POST: Open a diagram for editing in one round trip: acquire the lock, load
+    the diagram and its links. Pass the `revision` the client already holds
+    (body or query string) to get the diagram without its `data` when unchanged.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @editor_write()
+    def post(self, request, diagram_id):
+        params = request.data if hasattr(request.data, 'get') else {}
+        known_revision = params.get('revision', request.query_params.get('revision'))
+        try:
+            known_revision = int(known_revision) if known_revision is not None else None
+        except (TypeError, ValueError):
+            return Response(
+                {"detail": "revision must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        visible = Diagram.objects.filter(id=diagram_id, project__memberships__user=request.user)
+        with transaction.atomic():
+            # Conditional UPDATE: take the lock unless somebody else holds it
+            acquired = visible.filter(Q(is_locked=False) | Q(locked_by=request.user)).update(
+                is_locked=True,
+                locked_by=request.user,
+                locked_at=timezone.now(),
+            )
+
+            diagrams = visible.select_related('locked_by__guest_profile')
+            if known_revision is not None:
+                diagrams = diagrams.defer('data')
+            diagram = diagrams.first()
+            if diagram is None:
+                get_object_or_404(Diagram, id=diagram_id)
+                raise PermissionDenied("You do not have access to this project.")
+
+            data_unchanged = known_revision == diagram.revision
+            serializer_class = DiagramMetaSerializer if data_unchanged else DiagramSerializer
+            diagram_data = serializer_class(diagram).data
+
+            links = _cached_diagram_links(diagram.id, diagram.project_id)
+
+        metrics.inc('diagram_lock_acquisitions_total' if acquired else 'diagram_lock_conflicts_total')
+        if acquired:
+            activity.record(diagram.project_id, request.user, 'lock.acquire', diagram)
+        return Response(
+            {
+                "revision": diagram.revision,
+                "data_unchanged": data_unchanged,
+                "diagram": diagram_data,
+                "lock": _serialize_lock(diagram),
+                "links": links,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class DiagramLayoutView(APIView):
+    """
+    POST: Lay out the diagram on the server and save the result as a new revision.
+    Body: `algorithm` ("layered" or "force", defaults by diagram type),
+    `direction` ("LR" or "TB"), `incremental` (only place nodes without a
+    position and those in `node_ids`) and optionally the `revision` the client
+    holds, which must still be current.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @expensive_endpoint
+    def post(self, request, diagram_id):
+        params = request.data if hasattr(request.data, 'get') else {}
+        node_ids = params.get('node_ids') or []
+        known_revision = params.get('revision')
+        if not isinstance(node_ids, list) or (known_revision is not None and not isinstance(known_revision, int)):
+            return Response(
+                {"detail": "node_ids must be a list and revision an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        with transaction.atomic():
+            diagram = get_object_or_404(Diagram.objects.select_for_update(), id=diagram_id)
+            _ensure_project_member(diagram.project, request.user)
+            if diagram.is_locked and diagram.locked_by_id != request.user.id:
+                return Response(
+                    {"detail": "The diagram is locked by another user."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if known_revision is not None and known_revision != diagram.revision:
+                return Response(
+                    {"detail": "The diagram has changed.", "revision": diagram.revision},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            try:
+                data, placed = layout.layout_data(
+                    diagram.data,
+                    diagram.diagram_type,
+                    algorithm=params.get('algorithm'),
+                    direction=params.get('direction', 'LR'),
+                    incremental=bool(params.get('incremental', False)),
+                    node_ids=node_ids,
+                )
+            except layout.LayoutError as exc:
+                return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+            if placed:
+                diagram.data = data
+                diagram.revision = coalescing.next_revision(diagram)
+                diagram.save(update_fields=['data', 'data_hash', 'revision', 'updated_at'])
+                activity.record(diagram.project_id, request.user, 'diagram.update', diagram, {'via': 'layout'})
+
+        return Response(
+            {"placed": placed, "revision": diagram.revision, "diagram": DiagramSerializer(diagram).data},
+            status=status.HTTP_200_OK,
+        )
+
+
+class DiagramDiffView(APIView):
+    """
+    Structural diff of the diagram's current `data` (head) against a base:
+    GET  ?diagram=<id> or ?template=<id> compares with another diagram or a template;
+    POST {"data": {...}} compares with a document the client holds, e.g. an earlier save.
+    `ignore_position=true` drops position-only changes; `output=patch` returns an
+    applicable patch (see POST /patch) instead of the full report.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def _base_data(self, request):
+        if request.method == 'POST':
+            base = request.data.get('data') if hasattr(request.data, 'get') else None
+            if not isinstance(base, dict):
+                raise ValidationError({"data": "A diagram data object is required."})
+            return base
+
+        diagram_id, template_id = request.query_params.get('diagram'), request.query_params.get('template')
+        if (diagram_id is None) == (template_id is None):
+            raise ValidationError({"detail": "Pass exactly one of diagram or template."})
+        try:
+            if diagram_id is not None:
+                base = get_object_or_404(Diagram, id=int(diagram_id))
+                _ensure_project_member(base.project, request.user)
+            else:
+                base = get_object_or_404(
+                    DiagramTemplate.objects.filter(Q(user=request.user) | Q(is_public=True)), id=int(template_id)
+                )
+        except ValueError:
+            raise ValidationError({"detail": "diagram and template must be integers."})
+        return base.data
+
+    def _diff(self, request, diagram_id):
+        params = request.data if request.method == 'POST' and hasattr(request.data, 'get') else request.query_params
+        output = params.get('output', 'full')
+        if output not in ('full', 'patch'):
+            raise ValidationError({"output": "Must be full or patch."})
+        ignore_position = str(params.get('ignore_position', '')).lower() in ('1', 'true', 'yes')
+
+        diagram = get_object_or_404(Diagram, id=diagram_id)
+        _ensure_project_member(diagram.project, request.user)
+        try:
+            result = diffing.cached_diff(self._base_data(request), diagram.data, ignore_position, output)
+        except diffing.PatchError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**result, "revision": diagram.revision}, status=status.HTTP_200_OK)
+
+    def get(self, request, diagram_id):
+        return self._diff(request, diagram_id)
+
+    def post(self, request, diagram_id):
+        return self._diff(request, diagram_id)
+
+
+class DiagramPatchView(APIView):
+    """
+    POST: Apply a patch produced by the diff endpoint (`output=patch`) and save
+    the result as a new revision. The patch's `base` hash must match the
+    diagram's current content, otherwise 409 is returned with the current hash.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @editor_write()
+    def post(self, request, diagram_id):
+        patch = request.data.get('patch') if hasattr(request.data, 'get') else None
+        if not isinstance(patch, dict):
+            return Response({"detail": "patch must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            diagram = get_object_or_404(Diagram.objects.select_for_update(), id=diagram_id)
+            _ensure_project_member(diagram.project, request.user)
+            current_hash = diffing.content_hash(diagram.data)
+            if patch.get('base') != current_hash:
+                return Response(
+                    {"detail": "The diagram has changed.", "base_hash": current_hash, "revision": diagram.revision},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            try:
+                diagram.data = diffing.apply_patch(diagram.data, patch)
+            except diffing.PatchError as exc:
+                return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            diagram.revision = coalescing.next_revision(diagram)
+            diagram.save(update_fields=['data', 'data_hash', 'revision', 'updated_at'])
+            activity.record(diagram.project_id, request.user, 'diagram.update', diagram, {'via': 'patch'})
+
+        return Response(DiagramSerializer(diagram).data, status=status.HTTP_200_OK)
+
+
+def _member_diagram_project_id(diagram_id, user) -> int:
+    """Project of a diagram the user may access, checked from cached membership without loading the diagram."""
+    project_id = response_cache.get_diagram_project_id(diagram_id)
+    if project_id is None:
+        raise Http404
+    if project_id not in response_cache.get_user_project_ids(user):
+        raise PermissionDenied("You do not have access to this project.")
+    return project_id
+
+
+def _viewport_diagram(diagram_id, user) -> Diagram:
+    # `data` is only loaded for unindexed diagrams
+    _member_diagram_project_id(diagram_id, user)
+    if coalescing.pending(diagram_id):
+        # The element index is only updated when the row is written
+        coalescing.flush(diagram_id)
+    return get_object_or_404(Diagram.objects.defer('data'), id=diagram_id)
+
+
+class DiagramViewportView(APIView):
+    """
+    GET: Nodes of a diagram intersecting the rectangle `x1,y1,x2,y2`, the edges
+    touching them and the off-screen nodes those edges connect (`endpoints`).
+    At most `limit` nodes are returned; `truncated` tells whether there were more.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, diagram_id):
+        try:
+            x1, y1, x2, y2 = (float(request.query_params[name]) for name in ('x1', 'y1', 'x2', 'y2'))
+            limit = int(request.query_params.get('limit', spatial.get_spatial_index_settings()['MAX_VIEWPORT_NODES']))
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {"detail": "x1, y1, x2 and y2 are required numbers; limit must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = max(1, min(limit, spatial.get_spatial_index_settings()['MAX_VIEWPORT_NODES']))
+
+        diagram = _viewport_diagram(diagram_id, request.user)
+        rect = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        data = spatial.viewport(diagram, rect, limit)
+        data['revision'] = diagram.revision
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class DiagramOverviewView(APIView):
+    """
+    GET: Node counts per `tile` sized square and the diagram bounds, for a
+    minimap or a zoomed-out rendering of very large diagrams.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, diagram_id):
+        try:
+            tile_size = float(request.query_params.get('tile', spatial.get_spatial_index_settings()['DEFAULT_TILE_SIZE']))
+        except (TypeError, ValueError):
+            tile_size = 0
+        if not tile_size >= 50:
+            return Response({"detail": "tile must be a number of at least 50."}, status=status.HTTP_400_BAD_REQUEST)
+
+        diagram = _viewport_diagram(diagram_id, request.user)
+
+        def build():
+            result = spatial.overview(diagram, tile_size)
+            result['revision'] = diagram.revision
+            return result, []
+
+        # Keyed by revision: every data change bumps it
+        data = response_cache.read_through(
+            'diagram_overview', [diagram.id, diagram.revision, tile_size], [('diagram', diagram.id)], build
+        )
+        return Response(data, status=status.HTTP_200_OK)
+
+
 class ProjectInviteCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -288,6 +877,7 @@ class ProjectInviteCreateView(APIView):
             invited_by=request.user,
             expires_at=expires_at,
         )
+        activity.record(project.id, request.user, 'invite.create', invite)
         serializer = ProjectInviteSerializer(invite)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -312,6 +902,7 @@ class ProjectInviteDetailView(APIView):
         invite = get_object_or_404(ProjectInvite, id=invite_id, project=project)
         invite.is_active = False
         invite.save(update_fields=['is_active'])
+        activity.record(project.id, request.user, 'invite.revoke', invite)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -336,6 +927,7 @@ class InviteInfoView(APIView):
 
 class AcceptInviteView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_classes = [InviteAcceptThrottle]
 
     def post(self, request, token):
         invite = get_object_or_404(ProjectInvite, token=token)
@@ -351,6 +943,7 @@ class AcceptInviteView(APIView):
             defaults={'role': ProjectMembership.ROLE_EDITOR},
         )
         invite.mark_used(request.user)
+        activity.record(invite.project_id, request.user, 'invite.accept', invite)
 
         return Response(
             {"project_id": invite.project_id},
@@ -360,6 +953,79 @@ class AcceptInviteView(APIView):
 
 # --- Diagram Links ---
 
+def _cached_diagram_links(diagram_id, project_id):
+    """Outgoing and incoming links of a diagram, served from the response cache."""
+    def build():
+        # Outgoing (from elements in this diagram) and incoming links in one query
+        links = list(
+            DiagramLink.objects.filter(
+                Q(source_diagram_id=diagram_id) | Q(target_diagram_id=diagram_id)
+            ).select_related('source_diagram', 'target_diagram', 'created_by')
+        )
+        outgoing = [link for link in links if link.source_diagram_id == diagram_id]
+        incoming = [link for link in links if link.target_diagram_id == diagram_id]
+
+        data = {
+            'outgoing': DiagramLinkSerializer(outgoing, many=True).data,
+            'incoming': DiagramLinkSerializer(incoming, many=True).data,
+        }
+        # Linked diagrams in other projects can be renamed or deleted too
+        linked_projects = {link.target_diagram.project_id for link in outgoing}
+        linked_projects.update(link.source_diagram.project_id for link in incoming)
+        return data, [('project', linked_id) for linked_id in linked_projects]
+
+    return response_cache.read_through('diagram_links', [diagram_id], [('project', project_id)], build)
+
+
+def _diagram_links_data(diagram_id, user):
+    # Permission check from cached membership so a warm read never hits the ORM
+    project_id = response_cache.get_diagram_project_id(diagram_id)
+    if project_id is None:
+        raise Http404
+    if project_id not in response_cache.get_user_project_ids(user):
+        raise PermissionDenied("You do not have access to this project.")
+    return _cached_diagram_links(diagram_id, project_id)
+
+
+def _create_diagram_link(request, diagram: Diagram) -> Response:
+    serializer = DiagramLinkCreateSerializer(
+        data=request.data,
+        context={'request': request, 'source_diagram': diagram}
+    )
+
+    if serializer.is_valid():
+        # Verify user has access to target diagram
+        target_diagram = serializer.validated_data['target_diagram']
+        try:
+            _ensure_project_member(target_diagram.project, request.user)
+        except PermissionDenied:
+            return Response(
+                {"detail": "You don't have access to the target diagram."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        # Extract validation warnings before save
+        warnings = serializer.validated_data.pop('_validation_warnings', [])
+
+        link = serializer.save(
+            source_diagram=diagram,
+            created_by=request.user
+        )
+        activity.record(diagram.project_id, request.user, 'link.create', link)
+
+        # Include warnings in response if any
+        response_data = DiagramLinkSerializer(link).data
+        if warnings:
+            response_data['warnings'] = warnings
+
+        return Response(
+            response_data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 class DiagramLinksView(APIView):
     """
     GET: List all links for a diagram (both outgoing and incoming)
@@ -373,61 +1039,11 @@ class DiagramLinksView(APIView):
         return diagram
 
     def get(self, request, diagram_id):
-        diagram = self._get_diagram(diagram_id, request.user)
-        
-        # Get outgoing links (from elements in this diagram to other diagrams)
-        outgoing = DiagramLink.objects.filter(source_diagram=diagram).select_related(
-            'target_diagram', 'created_by'
-        )
-        
-        # Get incoming links (from other diagrams pointing to this one)
-        incoming = DiagramLink.objects.filter(target_diagram=diagram).select_related(
-            'source_diagram', 'created_by'
-        )
-        
-        return Response({
-            'outgoing': DiagramLinkSerializer(outgoing, many=True).data,
-            'incoming': DiagramLinkSerializer(incoming, many=True).data,
-        }, status=status.HTTP_200_OK)
+        return Response(_diagram_links_data(diagram_id, request.user), status=status.HTTP_200_OK)
 
     def post(self, request, diagram_id):
         diagram = self._get_diagram(diagram_id, request.user)
-        
-        serializer = DiagramLinkCreateSerializer(
-            data=request.data,
-            context={'request': request, 'source_diagram': diagram}
-        )
-        
-        if serializer.is_valid():
-            # Verify user has access to target diagram
-            target_diagram = serializer.validated_data['target_diagram']
-            try:
-                _ensure_project_member(target_diagram.project, request.user)
-            except PermissionDenied:
-                return Response(
-                    {"detail": "You don't have access to the target diagram."},
-                    status=status.HTTP_403_FORBIDDEN,
-                )
-            
-            # Extract validation warnings before save
-            warnings = serializer.validated_data.pop('_validation_warnings', [])
-            
-            link = serializer.save(
-                source_diagram=diagram,
-                created_by=request.user
-            )
-            
-            # Include warnings in response if any
-            response_data = DiagramLinkSerializer(link).data
-            if warnings:
-                response_data['warnings'] = warnings
-            
-            return Response(
-                response_data,
-                status=status.HTTP_201_CREATED,
-            )
-        
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return _create_diagram_link(request, diagram)
 
 
 class DiagramLinkDetailView(APIView):
@@ -470,15 +1086,165 @@ class DiagramLinkDetailView(APIView):
         
         if updated:
             link.save()
+            activity.record(link.source_diagram.project_id, request.user, 'link.update', link)
         
         return Response(DiagramLinkSerializer(link).data, status=status.HTTP_200_OK)
 
     def delete(self, request, link_id):
         link = self._get_link(link_id, request.user)
+        activity.record(link.source_diagram.project_id, request.user, 'link.delete', link)
         link.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+BULK_LINKS_MAX = 1000
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _bump_link_projects(project_ids) -> None:
+    # bulk_create() and the bulk delete send no per-link invalidation
+    for project_id in project_ids:
+        response_cache.bump('project', project_id)
+
+
+def _record_bulk_links(user, action, project_ids) -> None:
+    # One activity entry per project instead of one per link
+    for project_id, count in Counter(project_ids).items():
+        activity.record(project_id, user, action, details={'count': count})
+
+
+class DiagramLinkBulkView(APIView):
+    """
+    POST: Create many links at once: {"links": [{"source_diagram": id, ...link fields}], "atomic": false}.
+          Returns a result per item with its errors or warnings; with "atomic" nothing
+          is created unless every item is valid.
+    DELETE: Remove links by id and/or by element:
+          {"ids": [...], "elements": [{"diagram": id, "element_id": "..."}]}.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def _items(self, request, key):
+        items = request.data.get(key) if hasattr(request.data, 'get') else None
+        max_items = getattr(settings, 'DIAGRAMS_BULK_LINKS_MAX', BULK_LINKS_MAX)
+        if items is None:
+            return []
+        if not isinstance(items, list):
+            raise ValidationError({key: "Must be a list."})
+        if len(items) > max_items:
+            raise ValidationError({key: f"At most {max_items} items per request."})
+        return items
+
+    def post(self, request):
+        items = self._items(request, 'links')
+        if not items or not all(isinstance(item, dict) for item in items):
+            return Response({"detail": "links must be a non-empty list of objects."}, status=status.HTTP_400_BAD_REQUEST)
+        atomic = bool(request.data.get('atomic', False))
+
+        # Every diagram and membership involved, in two queries
+        diagram_ids = {
+            diagram_id for item in items for key in ('source_diagram', 'target_diagram')
+            if (diagram_id := _int_or_none(item.get(key))) is not None
+        }
+        diagrams = {diagram.id: diagram for diagram in Diagram.objects.filter(id__in=diagram_ids).defer('data')}
+        member_of = set(
+            ProjectMembership.objects.filter(
+                user=request.user, project_id__in={diagram.project_id for diagram in diagrams.values()}
+            ).values_list('project_id', flat=True)
+        )
+
+        results, pending = [], []
+        for index, item in enumerate(items):
+            result = {"index": index}
+            results.append(result)
+            source = diagrams.get(_int_or_none(item.get('source_diagram')))
+            if source is None or source.project_id not in member_of:
+                result.update(status="invalid", errors={"source_diagram": ["Diagram not found."]})
+                continue
+
+            serializer = DiagramLinkCreateSerializer(
+                data=item, context={'request': request, 'source_diagram': source, 'diagrams': diagrams}
+            )
+            if not serializer.is_valid():
+                result.update(status="invalid", errors=serializer.errors)
+                continue
+            if serializer.validated_data['target_diagram'].project_id not in member_of:
+                result.update(status="invalid", errors={"target_diagram": ["You don't have access to the target diagram."]})
+                continue
+
+            warnings = serializer.validated_data.pop('_validation_warnings', [])
+            if warnings:
+                result['warnings'] = warnings
+            link = DiagramLink(source_diagram=source, created_by=request.user, **serializer.validated_data)
+            pending.append((result, link))
+
+        if atomic and len(pending) < len(items):
+            for result, _ in pending:
+                result['status'] = "skipped"
+            return Response({"created": 0, "results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+        if pending:
+            with transaction.atomic():
+                created = DiagramLink.objects.bulk_create([link for _, link in pending])
+                _bump_link_projects(
+                    {link.source_diagram.project_id for link in created}
+                    | {link.target_diagram.project_id for link in created}
+                )
+            for (result, _), link in zip(pending, created):
+                result.update(status="created", link=DiagramLinkSerializer(link).data)
+            _record_bulk_links(request.user, 'link.create', [link.source_diagram.project_id for link in created])
+
+        return Response(
+            {"created": len(pending), "results": results},
+            status=status.HTTP_201_CREATED if pending else status.HTTP_400_BAD_REQUEST,
+        )
+
+    def delete(self, request):
+        ids = self._items(request, 'ids')
+        elements = self._items(request, 'elements')
+        link_ids = [_int_or_none(link_id) for link_id in ids]
+        by_diagram = {}
+        for element in elements:
+            diagram_id = _int_or_none(element.get('diagram')) if isinstance(element, dict) else None
+            element_id = element.get('element_id') if isinstance(element, dict) else None
+            if diagram_id is None or not isinstance(element_id, str):
+                raise ValidationError({"elements": "Each element needs a diagram id and an element_id."})
+            by_diagram.setdefault(diagram_id, set()).add(element_id)
+        if None in link_ids:
+            raise ValidationError({"ids": "Link ids must be integers."})
+        if not link_ids and not by_diagram:
+            return Response({"detail": "Pass ids or elements."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One condition per diagram keeps the SQL flat however many elements are sent
+        condition = Q(id__in=link_ids)
+        for diagram_id, element_ids in by_diagram.items():
+            condition |= Q(source_diagram_id=diagram_id, source_element_id__in=element_ids)
+            condition |= Q(target_diagram_id=diagram_id, target_element_id__in=element_ids)
+        rows = list(
+            DiagramLink.objects.filter(condition)
+            .filter(source_diagram__project__memberships__user=request.user)
+            .values_list('id', 'source_diagram__project_id', 'target_diagram__project_id')
+        )
+
+        deleted_ids = [row[0] for row in rows]
+        with transaction.atomic(), response_cache.link_invalidation_handled():
+            for start in range(0, len(deleted_ids), BULK_LINKS_MAX):
+                DiagramLink.objects.filter(id__in=deleted_ids[start:start + BULK_LINKS_MAX]).delete()
+            _bump_link_projects({project_id for row in rows for project_id in row[1:]})
+        _record_bulk_links(request.user, 'link.delete', [row[1] for row in rows])
+
+        deleted = set(deleted_ids)
+        return Response(
+            {"deleted": len(deleted_ids), "not_found": [link_id for link_id in link_ids if link_id not in deleted]},
+            status=status.HTTP_200_OK,
+        )
+
+
 class ElementLinksView(APIView):
     """
     GET: Get links for a specific element in a diagram
@@ -505,27 +1271,32 @@ class ProjectDiagramsForLinkingView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Get all projects user has access to
-        projects = Project.objects.filter(
-            memberships__user=request.user
-        ).prefetch_related('diagrams').distinct()
-        
-        result = []
-        for project in projects:
-            project_data = {
-                'id': project.id,
-                'name': project.name,
-                'diagrams': [
-                    {
-                        'id': d.id,
-                        'name': d.name,
-                        'diagram_type': d.diagram_type,
-                    }
-                    for d in project.diagrams.all()
-                ]
-            }
-            result.append(project_data)
-        
+        def build():
+            # Get all projects user has access to
+            projects = Project.objects.filter(
+                memberships__user=request.user
+            ).prefetch_related('diagrams').distinct()
+
+            result = []
+            for project in projects:
+                project_data = {
+                    'id': project.id,
+                    'name': project.name,
+                    'diagrams': [
+                        {
+                            'id': d.id,
+                            'name': d.name,
+                            'diagram_type': d.diagram_type,
+                        }
+                        for d in project.diagrams.all()
+                    ]
+                }
+                result.append(project_data)
+            return result, [('project', project['id']) for project in result]
+
+        result = response_cache.read_through(
+            'diagrams_for_linking', [request.user.id], [('user', request.user.id)], build
+        )
         return Response(result, status=status.HTTP_200_OK)
 
 
@@ -549,6 +1320,81 @@ class ProjectLinksView(APIView):
         return Response(DiagramLinkSerializer(links, many=True).data, status=status.HTTP_200_OK)
 
 
+class ProjectPresenceView(APIView):
+    """
+    GET: Presence for a whole project: viewers, editors and the lock holder of
+    every diagram that has any, and the users present anywhere in the project.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, project_id):
+        if project_id not in response_cache.get_user_project_ids(request.user):
+            get_object_or_404(Project, id=project_id)
+            raise PermissionDenied("You do not have access to this project.")
+
+        diagrams = presence.project_presence(project_id)
+        locks = Diagram.objects.filter(project_id=project_id, is_locked=True).values_list(
+            'id', 'locked_at', 'locked_by_id', 'locked_by__username',
+        )
+        for diagram_id, locked_at, user_id, username in locks:
+            entry = diagrams.setdefault(diagram_id, {'diagram_id': diagram_id, presence.VIEWING: [], presence.EDITING: []})
+            entry['lock'] = {
+                "locked_at": locked_at,
+                "user": {"id": user_id, "username": username} if user_id else None,
+            }
+
+        users = {}
+        for entry in diagrams.values():
+            entry.setdefault('lock', None)
+            for person in entry[presence.EDITING] + entry[presence.VIEWING]:
+                users.setdefault(person['id'], {"id": person['id'], "username": person['username']})
+        return Response(
+            {
+                "project_id": project_id,
+                "ttl": presence.get_presence_settings()['TTL'],
+                "diagrams": sorted(diagrams.values(), key=lambda entry: entry['diagram_id']),
+                "users": list(users.values()),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class ProjectActivityView(APIView):
+    """
+    GET: Activity feed of a project, newest first. Pages are keyed by entry id:
+    pass `before` (the `next_before` of the previous page) and optionally `limit`.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, project_id):
+        project = _get_project_for_user(project_id, request.user)
+        config = activity.get_activity_settings()
+        try:
+            before = int(request.query_params['before']) if 'before' in request.query_params else None
+            limit = max(1, min(int(request.query_params.get('limit', config['PAGE_SIZE'])), config['PAGE_SIZE']))
+        except ValueError:
+            return Response(
+                {"detail": "before and limit must be integers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Entries of this process that are still buffered
+        activity.flush()
+        entries = ActivityEntry.objects.filter(project_id=project.id)
+        if before is not None:
+            entries = entries.filter(id__lt=before)
+        page = list(entries.order_by('-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        return Response(
+            {
+                "results": ActivityEntrySerializer(page, many=True).data,
+                "next_before": page[-1].id if has_more else None,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 # --- Diagram Templates ---
 
 class DiagramTemplateListView(APIView):
@@ -559,19 +1405,25 @@ class DiagramTemplateListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        # Get user's own templates + public templates
-        from django.db.models import Q
-        templates = DiagramTemplate.objects.filter(
-            Q(user=request.user) | Q(is_public=True)
-        ).select_related('user').order_by('-created_at')
-        
         # Optional filter by diagram type
         diagram_type = request.query_params.get('type')
-        if diagram_type:
-            templates = templates.filter(diagram_type=diagram_type)
-        
-        serializer = DiagramTemplateSerializer(templates, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+        def build():
+            # Get user's own templates + public templates
+            from django.db.models import Q
+            templates = DiagramTemplate.objects.filter(
+                Q(user=request.user) | Q(is_public=True)
+            ).select_related('user').order_by('-created_at')
+
+            if diagram_type:
+                templates = templates.filter(diagram_type=diagram_type)
+
+            return list(DiagramTemplateSerializer(templates, many=True).data), []
+
+        data = response_cache.read_through(
+            'templates', [request.user.id, diagram_type or ''], [('templates', 'all')], build
+        )
+        return Response(data, status=status.HTTP_200_OK)
 
     def post(self, request):
         serializer = DiagramTemplateCreateSerializer(data=request.data)
@@ -1,5 +1,18 @@
 import apiClient from './client'
 
+// Bodies above this size are gzipped when the browser can (the server inflates them)
+const GZIP_MIN_BYTES = 32 * 1024
+
+const gzipJson = async (payload) => {
+  const json = JSON.stringify(payload)
+  if (json.length < GZIP_MIN_BYTES || typeof CompressionStream === 'undefined') {
+    return { body: json, headers: {} }
+  }
+  const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'))
+  const body = await new Response(stream).arrayBuffer()
+  return { body, headers: { 'Content-Encoding': 'gzip' } }
+}
+
 export const diagramsAPI = {
   getDiagrams: async (projectId) => {
     const response = await apiClient.get(`/projects/${projectId}/diagrams/`)
@@ -17,7 +30,8 @@ export const diagramsAPI = {
   },
 
   updateDiagram: async (diagramId, diagramData) => {
-    const response = await apiClient.put(`/diagrams/${diagramId}`, diagramData)
+    const { body, headers } = await gzipJson(diagramData)
+    const response = await apiClient.put(`/diagrams/${diagramId}`, body, { headers })
     return response.data
   },
 
@@ -41,6 +55,58 @@ export const diagramsAPI = {
     return response.data
   },
 
+  // Presence heartbeat (every `ttl / 3` seconds); returns who else has the diagram open
+  sendPresence: async (diagramId, mode = 'viewing') => {
+    const response = await apiClient.post(`/diagrams/${diagramId}/presence`, { mode })
+    return response.data
+  },
+
+  leavePresence: async (diagramId) => {
+    const response = await apiClient.delete(`/diagrams/${diagramId}/presence`)
+    return response.data
+  },
+
+  // Lock + diagram + links in one request; `data` is omitted when `revision` is current
+  openDiagram: async (diagramId, revision = null) => {
+    const response = await apiClient.post(`/diagrams/${diagramId}/open`, revision !== null ? { revision } : {})
+    return response.data
+  },
+
+  // Viewport loading for very large diagrams
+  getViewport: async (diagramId, { x1, y1, x2, y2 }, limit = null) => {
+    const params = { x1, y1, x2, y2 }
+    if (limit !== null) params.limit = limit
+    const response = await apiClient.get(`/diagrams/${diagramId}/viewport`, { params })
+    return response.data
+  },
+
+  getOverview: async (diagramId, tile = null) => {
+    const response = await apiClient.get(`/diagrams/${diagramId}/overview`, { params: tile !== null ? { tile } : {} })
+    return response.data
+  },
+
+  // Server-side automatic layout; saves a new revision
+  layoutDiagram: async (diagramId, options = {}) => {
+    const response = await apiClient.post(`/diagrams/${diagramId}/layout`, options)
+    return response.data
+  },
+
+  // Structural diff; base is { diagram }, { template } or { data }
+  diffDiagram: async (diagramId, base, { ignorePosition = false, output = 'full' } = {}) => {
+    const params = { ignore_position: ignorePosition, output }
+    if (base.data) {
+      const response = await apiClient.post(`/diagrams/${diagramId}/diff`, { ...params, data: base.data })
+      return response.data
+    }
+    const response = await apiClient.get(`/diagrams/${diagramId}/diff`, { params: { ...params, ...base } })
+    return response.data
+  },
+
+  applyDiagramPatch: async (diagramId, patch) => {
+    const response = await apiClient.post(`/diagrams/${diagramId}/patch`, { patch })
+    return response.data
+  },
+
   // Diagram Links
   getDiagramLinks: async (diagramId) => {
     const response = await apiClient.get(`/diagrams/${diagramId}/links`)
@@ -62,6 +128,21 @@ export const diagramsAPI = {
     return response.data
   },
 
+  getDeletion: async (taskId) => {
+    const response = await apiClient.get(`/deletions/${taskId}`)
+    return response.data
+  },
+
+  bulkCreateLinks: async (links, atomic = false) => {
+    const response = await apiClient.post('/links/bulk', { links, atomic })
+    return response.data
+  },
+
+  bulkDeleteLinks: async ({ ids = [], elements = [] } = {}) => {
+    const response = await apiClient.delete('/links/bulk', { data: { ids, elements } })
+    return response.data
+  },
+
   getElementLinks: async (diagramId, elementId) => {
     const response = await apiClient.get(`/diagrams/${diagramId}/elements/${elementId}/links`)
     return response.data
@@ -109,6 +190,12 @@ export const diagramsAPI = {
     const response = await apiClient.post(`/diagrams/${diagramId}/save-as-template`, templateData)
     return response.data
   },
+
+  // Several API calls in one round trip: [{ id, method, path, body }]
+  batch: async (requests, { atomic = false } = {}) => {
+    const response = await apiClient.post('/batch', { requests, atomic })
+    return response.data
+  },
 }
 
 
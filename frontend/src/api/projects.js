@@ -26,6 +26,18 @@ export const projectsAPI = {
     return response.data
   },
 
+  getActivity: async (projectId, before = null) => {
+    const params = before ? { before } : {}
+    const response = await apiClient.get(`/projects/${projectId}/activity`, { params })
+    return response.data
+  },
+
+  // Viewers, editors and lock holders of every diagram in the project
+  getPresence: async (projectId) => {
+    const response = await apiClient.get(`/projects/${projectId}/presence`)
+    return response.data
+  },
+
   // Invite methods
   createInvite: async (projectId, expiresInHours = 24) => {
     const response = await apiClient.post(`/projects/${projectId}/invite`, {